@@ -2,9 +2,13 @@ from backend.database.postgr.models.agent import Agent
 from backend.database.postgr.models.event import Event
 from backend.database.postgr.models.groupchat import GroupChat
 from backend.database.postgr.models.interaction import Interaction
+from backend.database.postgr.models.llm_usage import LLMUsage
 from backend.database.postgr.models.memory import Memory
 from backend.database.postgr.models.plan import Plan
+from backend.database.postgr.models.realtime_frame import RealtimeFrame
 from backend.database.postgr.models.relationship import Relationship
+from backend.database.postgr.models.shard import SimulationShard
+from backend.database.postgr.models.simulation_tenant import SimulationTenant
 from backend.database.postgr.models.user import User
 
 __all__ = [
@@ -12,8 +16,12 @@ __all__ = [
     "Event",
     "GroupChat",
     "Interaction",
+    "LLMUsage",
     "Memory",
     "Plan",
+    "RealtimeFrame",
     "Relationship",
+    "SimulationShard",
+    "SimulationTenant",
     "User",
 ]
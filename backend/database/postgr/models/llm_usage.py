@@ -0,0 +1,36 @@
+# -------------------------------------------------
+# Модель учёта расхода LLM (токены и задержки)
+# -------------------------------------------------
+
+from __future__ import annotations
+
+import datetime
+
+from sqlalchemy import DateTime, Float, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from backend.database.postgr.db import Base
+
+
+class LLMUsage(Base):
+    """
+    SQLAlchemy модель 'LLMUsage':
+    1 строка = суммарный расход LLM за час по агенту, пользователю и виду вызова.
+    Строки дополняются upsert-ом при периодическом сбросе счётчиков из памяти.
+    """
+
+    __tablename__ = "llm_usage"
+
+    bucket: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), primary_key=True
+    )  # начало часа
+    agent_id: Mapped[str] = mapped_column(String(64), primary_key=True, default="")  # "" — вне шага агента
+    user_id: Mapped[str] = mapped_column(String(64), primary_key=True, default="")  # владелец агента
+    method: Mapped[str] = mapped_column(String(16), primary_key=True)  # action | message | chat
+    calls: Mapped[int] = mapped_column(Integer, default=0)
+    errors: Mapped[int] = mapped_column(Integer, default=0)
+    cached: Mapped[int] = mapped_column(Integer, default=0)  # ответов из кэша (без токенов)
+    prompt_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    completion_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    latency_ms_total: Mapped[float] = mapped_column(Float, default=0.0)
+    latency_ms_max: Mapped[float] = mapped_column(Float, default=0.0)
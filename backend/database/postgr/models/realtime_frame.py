@@ -0,0 +1,32 @@
+# -------------------------------------------------
+# Модель кадра WebSocket-рассылки от воркеров симуляции
+# -------------------------------------------------
+
+from __future__ import annotations
+
+import datetime
+
+from sqlalchemy import BigInteger, DateTime, Index, Integer, Text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from backend.database.postgr.db import Base
+
+
+class RealtimeFrame(Base):
+    """
+    SQLAlchemy модель 'RealtimeFrame':
+    1 строка = 1 кадр для WebSocket-клиентов (tick_batch, message_delta, ...), опубликованный
+    воркером шарда (SIMULATION_MODE=workers). API-процесс читает новые кадры и рассылает их
+    своим подключениям; старые кадры удаляет воркер, который их записал.
+    """
+
+    __tablename__ = "realtime_frames"
+    __table_args__ = (Index("ix_realtime_frames_shard_id_id", "shard_id", "id"),)
+
+    # SQLite автоинкрементирует только INTEGER PRIMARY KEY
+    id: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True
+    )
+    shard_id: Mapped[int] = mapped_column(Integer, nullable=False)  # шард воркера-отправителя
+    created_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)  # JSON кадра
@@ -3,7 +3,7 @@ from __future__ import annotations
 import datetime
 from uuid import uuid4
 
-from sqlalchemy import DateTime, Float, ForeignKey, String, func
+from sqlalchemy import DateTime, Float, ForeignKey, String, UniqueConstraint, func
 from sqlalchemy.orm import Mapped, mapped_column
 
 from backend.database.postgr.db import Base
@@ -15,6 +15,10 @@ class Relationship(Base):
     """
 
     __tablename__ = "relationships"
+    # Одна запись на упорядоченную пару агентов — на это опирается пакетный upsert
+    __table_args__ = (
+        UniqueConstraint("source_agent_id", "target_agent_id", name="uq_relationships_pair"),
+    )
 
     id: Mapped[str] = mapped_column(
         String(64), primary_key=True, default=lambda: str(uuid4())
@@ -0,0 +1,35 @@
+# -------------------------------------------------
+# Модель шарда симуляции (аренда шарда воркером)
+# -------------------------------------------------
+
+from __future__ import annotations
+
+import datetime
+
+from sqlalchemy import DateTime, Float, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from backend.database.postgr.db import Base
+
+
+class SimulationShard(Base):
+    """
+    SQLAlchemy модель 'SimulationShard':
+    1 строка = 1 шард симуляции (партиция пользователей). Воркер-процесс арендует шард,
+    продлевает аренду heartbeat-ом и публикует в строке свою скорость тиков.
+    """
+
+    __tablename__ = "simulation_shards"
+
+    shard_id: Mapped[int] = mapped_column(Integer, primary_key=True)  # номер шарда 0..M-1
+    shard_count: Mapped[int] = mapped_column(Integer, nullable=False)  # M, при котором строка создана
+    owner: Mapped[str | None] = mapped_column(String(255), nullable=True)  # идентификатор воркера
+    lease_expires_at: Mapped[datetime.datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )  # до какого момента аренда действительна
+    heartbeat_at: Mapped[datetime.datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )  # время последнего heartbeat
+    ticks: Mapped[int] = mapped_column(Integer, default=0)  # тиков с момента аренды
+    ticks_per_second: Mapped[float] = mapped_column(Float, default=0.0)  # скорость за последний интервал
+    agents: Mapped[int] = mapped_column(Integer, default=0)  # агентов в шарде
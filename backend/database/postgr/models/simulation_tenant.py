@@ -0,0 +1,30 @@
+# -------------------------------------------------
+# Модель настроек симуляции пользователя (пауза и скорость)
+# -------------------------------------------------
+
+from __future__ import annotations
+
+import datetime
+
+from sqlalchemy import Boolean, DateTime, Float, String, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from backend.database.postgr.db import Base
+
+
+class SimulationTenant(Base):
+    """
+    SQLAlchemy модель 'SimulationTenant':
+    1 строка = пауза и скорость симуляции агентов одного пользователя. API записывает
+    настройки сюда, движок (в том числе в воркерах при SIMULATION_MODE=workers)
+    подхватывает их при загрузке и синхронизации мира.
+    """
+
+    __tablename__ = "simulation_tenants"
+
+    user_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    paused: Mapped[bool] = mapped_column(Boolean, default=False)
+    speed: Mapped[float] = mapped_column(Float, default=1.0)
+    updated_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
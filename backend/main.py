@@ -17,6 +17,9 @@ from starlette.exceptions import HTTPException as StarletteHTTPException
 
 from backend.database.postgr.db import async_session
 from backend.project_config import settings
+from backend.services.llm import llm_client
+from backend.services.realtime import broker
+from backend.services.relay import FrameRelay
 from backend.services.seed import ensure_seed_data, init_schema
 from backend.services.simulation import SimulationEngine
 
@@ -80,6 +83,13 @@ logger = logging.getLogger(__name__)
 # Инициализация FastAPI приложения, движка симуляции и сервисов
 app = FastAPI(title=settings.API_TITLE, version=settings.API_VERSION)
 sim_engine = SimulationEngine(async_session)
+# При SIMULATION_MODE=workers кадры для WebSocket-клиентов приходят от воркеров через БД
+frame_relay = FrameRelay(
+    async_session,
+    broker,
+    shards=range(max(1, settings.SIMULATION_SHARDS)),
+    poll_seconds=settings.SIMULATION_RELAY_POLL_SECONDS,
+)
 
 # Настройка CORS для фронтенда (можно потом ограничить)
 app.add_middleware(
@@ -135,6 +145,10 @@ async def on_startup() -> None:
     # В тестах нам не нужен фоновой tick loop: он усложняет изоляцию и может зависеть от внешних сервисов.
     if os.getenv("BACKEND_TESTING") == "1":
         logger.info("BACKEND_TESTING=1 — пропускаем запуск SimulationEngine")
+    elif settings.SIMULATION_MODE == "workers":
+        # Симуляцию крутят отдельные процессы: python -m backend.worker; их кадры рассылаем отсюда
+        logger.info("SIMULATION_MODE=workers — SimulationEngine запускается воркерами")
+        await frame_relay.start()
     else:
         await sim_engine.start()
     logger.info("API started")
@@ -146,3 +160,5 @@ async def on_shutdown() -> None:
     Корректная остановка симуляции при завершении работы.
     """
     await sim_engine.stop()
+    await frame_relay.stop()
+    llm_client.close()
@@ -29,10 +29,99 @@ class Settings(BaseSettings):
     # Симуляция
     SIMULATION_TICK_SECONDS: float = 1.0
     SIMULATION_DEFAULT_SPEED: float = 1.0
+    # Что делать, если тик не уложился в период: catch_up — догнать (не больше N тиков подряд), skip — пропустить
+    SIMULATION_TICK_POLICY: str = "skip"
+    SIMULATION_MAX_CATCH_UP_TICKS: int = 5
+    # Планировщик: ticks — тики с фиксированным периодом; events — у каждого агента своё время пробуждения
+    SIMULATION_SCHEDULER: str = "ticks"
+    # Базовый интервал между пробуждениями агента в режиме events (уточняется энергией, настроением и активностью чатов)
+    SIMULATION_AGENT_WAKE_SECONDS: float = 20.0
+    # Сколько энергии уставшие агенты восстанавливают за тик (0 — не восстанавливают)
+    SIMULATION_ENERGY_RECOVERY_PER_TICK: int = 0
+    # Сколько агентов продвигается за один тик и сколько из них обрабатывается одновременно
+    SIMULATION_AGENTS_PER_TICK: int = 8
+    SIMULATION_MAX_CONCURRENCY: int = 4
+    # Период сброса изменённых агентов и отношений из памяти в БД (write-behind)
+    SIMULATION_FLUSH_SECONDS: float = 2.0
+    # Политика выбора агентов на тик: uniform | energy | lra (least-recently-acted)
+    SIMULATION_PICK_POLICY: str = "uniform"
+    # Бюджет пользователя: максимум его агентов за тик при скорости 1.0 (слоты тика делятся между пользователями поровну)
+    SIMULATION_TENANT_TICK_BUDGET: int = 8
+    # Режим запуска: inprocess — движок внутри API; workers — отдельные процессы (python -m backend.worker)
+    SIMULATION_MODE: str = "inprocess"
+    # Число шардов (воркер-процессов) и параметры аренды шарда
+    SIMULATION_SHARDS: int = 1
+    SIMULATION_LEASE_SECONDS: float = 15.0
+    # Как часто воркер продлевает аренду и подтягивает изменения, сделанные через API
+    SIMULATION_SYNC_SECONDS: float = 5.0
+    # Доставка WebSocket-кадров от воркеров в API через таблицу realtime_frames:
+    # период записи и опроса и сколько хранить кадры
+    SIMULATION_RELAY_POLL_SECONDS: float = 0.25
+    SIMULATION_RELAY_RETENTION_SECONDS: float = 60.0
+    # Предгенерация реплик агентов, которые скоро проснутся: включение, сколько агентов за проход,
+    # размер очереди агента и когда реплика устаревает (сдвиг настроения, новые сообщения в чате, возраст)
+    SIMULATION_PREGEN_ENABLED: bool = False
+    SIMULATION_PREGEN_BATCH: int = 4
+    SIMULATION_PREGEN_PER_AGENT: int = 2
+    SIMULATION_PREGEN_MOOD_THRESHOLD: float = 0.15
+    SIMULATION_PREGEN_CONTEXT_DRIFT: int = 2
+    SIMULATION_PREGEN_TTL_SECONDS: float = 120.0
+    # Сцены в групповых чатах: один запрос к LLM даёт диалог из SIMULATION_SCENE_TURNS реплик,
+    # которые выпускаются по одной за тик; сколько участников берём в сцену и сколько она живёт
+    SIMULATION_SCENES_ENABLED: bool = False
+    SIMULATION_SCENE_TURNS: int = 4
+    SIMULATION_SCENE_MAX_SPEAKERS: int = 3
+    SIMULATION_SCENE_TTL_SECONDS: float = 300.0
 
     # LLM (OpenAI совместимый)
     OPENAI_API_KEY: Optional[str] = None
     OPENAI_MODEL: str = "gpt-3.5-turbo"
+    # Провайдер LLM: auto | openai | compatible | stub | off (auto — openai при заданном ключе)
+    LLM_PROVIDER: str = "auto"
+    # Base URL OpenAI-совместимого сервера (llama.cpp, vLLM) для LLM_PROVIDER=compatible
+    LLM_BASE_URL: Optional[str] = None
+    # Заглушка LLM_PROVIDER=stub: задержка ответа, разброс задержки и seed
+    LLM_STUB_LATENCY_MS: float = 50.0
+    LLM_STUB_JITTER_MS: float = 0.0
+    LLM_STUB_SEED: int = 42
+    # Кэш ответов LLM (только выбор действия агента, реплики не кэшируются): размер LRU в памяти
+    # (0 — выключен), время жизни записи и каталог дискового уровня. По умолчанию выключен:
+    # цикл симуляции сейчас не запрашивает выбор действия, и попаданий в кэш не бывает
+    LLM_CACHE_SIZE: int = 0
+    LLM_CACHE_TTL_SECONDS: float = 300.0
+    LLM_CACHE_DIR: Optional[str] = None
+    # Пакетирование реплик агентов: окно сбора запросов (0 — выключено; включённое окно экономит запросы,
+    # но каждая реплика ждёт его окончания) и максимум реплик в одном запросе
+    LLM_BATCH_WINDOW_SECONDS: float = 0.0
+    LLM_BATCH_MAX_SIZE: int = 8
+    # Упреждающие лимиты LLM: запросов и токенов в минуту (0 — без ограничения) и одновременных запросов
+    LLM_REQUESTS_PER_MINUTE: int = 500
+    LLM_TOKENS_PER_MINUTE: int = 200000
+    LLM_MAX_IN_FLIGHT: int = 8
+    # Потоковая генерация реплик (stream=True) с кадрами message_delta; такие реплики не пакетируются
+    LLM_STREAM_MESSAGES: bool = False
+    # Бюджет токенов на историю, воспоминания и описание персонажа в промпте и размер резюме разговора
+    LLM_CONTEXT_BUDGET_TOKENS: int = 800
+    LLM_SUMMARY_TOKENS: int = 150
+    # Таймауты LLM: начальный (пока мало замеров), границы и множитель к p95 последних LLM_LATENCY_WINDOW запросов
+    LLM_TIMEOUT_SECONDS: float = 4.0
+    LLM_TIMEOUT_MIN_SECONDS: float = 1.0
+    LLM_TIMEOUT_MAX_SECONDS: float = 15.0
+    LLM_TIMEOUT_P95_FACTOR: float = 1.5
+    LLM_LATENCY_WINDOW: int = 200
+    # Дублировать запрос, который идёт дольше p90 (побеждает первый ответ)
+    LLM_HEDGE_ENABLED: bool = True
+    # Автомат защиты LLM: окно исходов, минимум запросов для решения, доля неудач для размыкания,
+    # какой ответ считать медленным, сколько держать разомкнутым и как часто пробовать провайдера
+    LLM_BREAKER_WINDOW: int = 20
+    LLM_BREAKER_MIN_CALLS: int = 5
+    LLM_BREAKER_FAILURE_RATE: float = 0.5
+    LLM_BREAKER_SLOW_SECONDS: float = 8.0
+    LLM_BREAKER_COOLDOWN_SECONDS: float = 30.0
+    LLM_BREAKER_PROBE_SECONDS: float = 5.0
+    # Сколько синхронных вызовов (sync_generate_chat) одновременно выполняет фоновый цикл;
+    # столько же соединений в его пуле
+    LLM_SYNC_MAX_CONCURRENCY: int = 4
 
     # JWT settings
     SECRET_KEY: str
@@ -26,6 +26,7 @@ from backend.schemas import (
 )
 from backend.services.deps import get_current_active_user
 from backend.services.realtime import broker
+from backend.services.world import world
 
 logger = logging.getLogger(__name__)
 
@@ -201,6 +202,10 @@ async def create_agent(
 
     await session.commit()
     await session.refresh(agent)
+    # Держим состояние мира симуляции в актуальном виде
+    world.upsert_agent(agent)
+    if default_chat:
+        world.add_chat_member(default_chat.id, agent.id)
     logger.info("Агент создан id=%s name=%s user_id=%s", agent.id, agent.name, current_user.id)
     return await _build_agent_payload(session, agent, detailed=False)
 
@@ -246,6 +251,8 @@ async def send_message_to_agent(
     session.add(memory)
     await session.commit()
     await session.refresh(event)
+    # Агент получил сообщение — будим его сразу (событийный планировщик)
+    world.wakeups.wake_now([agent.id])
     logger.info("Отправлено сообщение агенту id=%s от user_id=%s, event_id=%s", agent.id, current_user.id, event.id)
 
     # Сохраняем в ChromaDB для быстрого поиска
@@ -324,6 +331,7 @@ async def delete_agent(
     # Удаляем самого агента
     await session.delete(agent)
     await session.commit()
+    world.remove_agent(agent.id)
 
     logger.info("Агент удален id=%s name=%s user_id=%s", agent.id, agent.name, current_user.id)
 
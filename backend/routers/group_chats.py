@@ -26,6 +26,7 @@ from backend.schemas import (
 )
 from backend.services.deps import get_current_active_user
 from backend.services.realtime import broker
+from backend.services.world import world
 
 logger = logging.getLogger(__name__)
 
@@ -124,6 +125,7 @@ async def create_group_chat(
 
     await session.commit()
     await session.refresh(group_chat)
+    world.upsert_chat(group_chat, valid_agent_ids)
     logger.info(
         "Создан групповой чат id=%s name=%s user_id=%s, количество агентов=%d",
         group_chat.id,
@@ -158,16 +160,12 @@ async def list_group_chats(
     )
     group_chats = result.scalars().all()
 
-    # Для каждой группы получаем список агентов через таблицу связей,
-    # чтобы не зависеть от ORM relationship и типов колонок
+    # Состав каждой группы берём из in-memory индекса участников,
+    # а не отдельным запросом к таблице связей на каждый чат
+    await world.ensure_loaded(session)
     response_chats = []
     for group_chat in group_chats:
-        agent_rows = await session.execute(
-            select(group_chat_agents.c.agent_id).where(
-                group_chat_agents.c.group_chat_id == group_chat.id
-            )
-        )
-        agent_ids = [str(row[0]) for row in agent_rows.fetchall()]
+        agent_ids = world.members_of(group_chat.id)
 
         response_chats.append(
             GroupChatSchema(
@@ -202,13 +200,9 @@ async def get_group_chat(
     if group_chat.created_by_user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    # Получаем агентов в чате через таблицу связей
-    agent_rows = await session.execute(
-        select(group_chat_agents.c.agent_id).where(
-            group_chat_agents.c.group_chat_id == group_chat.id
-        )
-    )
-    agent_ids = [str(row[0]) for row in agent_rows.fetchall()]
+    # Получаем агентов в чате из индекса участников
+    await world.ensure_loaded(session)
+    agent_ids = world.members_of(group_chat.id)
 
     return GroupChatSchema(
         id=str(group_chat.id),
@@ -247,6 +241,7 @@ async def update_group_chat(
         group_chat.description = payload.description
 
     # Обработка изменения списка агентов
+    valid_agent_ids = None
     if payload.agent_ids is not None:
         # Проверяем, что все указанные агенты принадлежат текущему пользователю
         valid_agents = []
@@ -287,15 +282,12 @@ async def update_group_chat(
 
     await session.commit()
     await session.refresh(group_chat)
+    world.upsert_chat(group_chat, valid_agent_ids)
     logger.info("Групповой чат обновлён id=%s user_id=%s", group_chat.id, current_user.id)
 
-    # Получаем актуальный список агентов через таблицу связей
-    agent_rows = await session.execute(
-        select(group_chat_agents.c.agent_id).where(
-            group_chat_agents.c.group_chat_id == group_chat.id
-        )
-    )
-    agent_ids = [str(row[0]) for row in agent_rows.fetchall()]
+    # Получаем актуальный список агентов из индекса участников
+    await world.ensure_loaded(session)
+    agent_ids = world.members_of(group_chat.id)
 
     return GroupChatSchema(
         id=str(group_chat.id),
@@ -326,13 +318,16 @@ async def delete_group_chat(
     if group_chat.created_by_user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    # Удаляем чат
+    # Удаляем связи в таблице group_chat_agents и сам чат
+    await session.execute(
+        delete(group_chat_agents).where(
+            group_chat_agents.c.group_chat_id == group_chat.id
+        )
+    )
     await session.delete(group_chat)
     await session.commit()
+    world.remove_chat(group_chat_id)
     logger.info("Групповой чат удалён id=%s user_id=%s", group_chat_id, current_user.id)
-
-    # Также нужно удалить связи в таблице group_chat_agents
-    # Доработка требуется
     return None
 
 
@@ -355,13 +350,9 @@ async def send_message_to_group_chat(
     if group_chat.created_by_user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    # Получаем агентов в чате через таблицу связей
-    agent_rows = await session.execute(
-        select(group_chat_agents.c.agent_id).where(
-            group_chat_agents.c.group_chat_id == group_chat.id
-        )
-    )
-    agent_ids = [row[0] for row in agent_rows.fetchall()]
+    # Получаем агентов в чате из индекса участников
+    await world.ensure_loaded(session)
+    agent_ids = world.members_of(group_chat.id)
 
     if not agent_ids:
         raise HTTPException(status_code=400, detail="Group chat has no agents")
@@ -408,7 +399,12 @@ async def send_message_to_group_chat(
             elif "neutral" in emotion_lower or "нейтрально" in emotion_lower:
                 mood_delta = random.uniform(-0.02, 0.02)
 
-        # Обновляем настроение и энергию агента
+        # Обновляем настроение и энергию агента.
+        # Симуляция в этом процессе пишет их в БД с задержкой, поэтому базой служат значения
+        # из состояния мира; при работе воркеров (world.live=False) актуальна БД.
+        state = world.get_agent(agent.id) if world.live else None
+        if state is not None:
+            agent.mood, agent.energy, agent.current_task = state.mood, state.energy, state.current_task
         agent.mood = max(0.0, min(1.0, agent.mood + mood_delta))
         agent.energy = max(0, min(100, agent.energy - 1))  # Небольшая трата энергии на обработку сообщения
         session.add(agent)
@@ -419,6 +415,11 @@ async def send_message_to_group_chat(
         await memory_store.add_memory(agent.id, payload.message, payload.emotion)
 
     await session.commit()
+    for agent in agents:
+        world.upsert_agent(agent)
+    # Участники получили сообщение пользователя — будим их сразу (событийный планировщик)
+    world.note_chat_message(group_chat.id, "Пользователь", payload.message)
+    world.wakeups.wake_now(agent.id for agent in agents)
 
     # Обновляем события после коммита и отправляем в WebSocket
     serialized_events: List[EventSchema] = []
@@ -2,11 +2,25 @@
 # Роутер для управления симуляцией
 # ---------------------------------------------------------
 
-from fastapi import APIRouter, Depends
+from typing import List, Literal
 
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.database.postgr.db import get_session
 from backend.database.postgr.models import User
-from backend.schemas import SimulationControlRequest, SimulationStatus
+from backend.project_config import settings
+from backend.schemas import (
+    LLMStatus,
+    LLMUsageRow,
+    SimulationControlRequest,
+    SimulationShardStatus,
+    SimulationStatus,
+)
 from backend.services.deps import get_current_active_user
+from backend.services.llm import llm_client
+from backend.services.llm_usage import fetch_usage, usage_ledger
+from backend.services.sharding import fetch_shards, lease_alive
 
 router = APIRouter(prefix="/api/simulation", tags=["simulation"])
 
@@ -27,8 +41,74 @@ async def control_simulation(
         current_user: User = Depends(get_current_active_user)
 ) -> SimulationStatus:
     """
-    Управление симуляцией (пауза или изменение скорости).
+    Управление симуляцией (пауза или изменение скорости) для агентов текущего пользователя.
+    Остальные пользователи продолжают получать свою долю тиков.
+    """
+    if _sim_engine is None:
+        raise RuntimeError("Simulation engine not initialized")
+    return await _sim_engine.control(action=payload.action, speed=payload.speed, user_id=str(current_user.id))
+
+
+@router.get("/status", response_model=SimulationStatus)
+async def simulation_status(
+        current_user: User = Depends(get_current_active_user)
+) -> SimulationStatus:
+    """
+    Пауза и скорость текущего пользователя, а также отставание цикла симуляции от расписания.
     """
     if _sim_engine is None:
         raise RuntimeError("Simulation engine not initialized")
-    return await _sim_engine.control(action=payload.action, speed=payload.speed)
+    return _sim_engine.status(user_id=str(current_user.id))
+
+
+@router.get("/llm", response_model=LLMStatus)
+async def llm_status(
+        current_user: User = Depends(get_current_active_user)
+) -> LLMStatus:
+    """
+    Состояние LLM-клиента: провайдер и модель, кэш ответов, пакетирование, ограничитель
+    темпа, бюджет контекста, автомат защиты, задержки и таймауты, синхронные вызовы.
+    """
+    return LLMStatus(**llm_client.stats())
+
+
+@router.get("/llm/usage", response_model=List[LLMUsageRow])
+async def llm_usage(
+        group_by: Literal["agent", "method", "user"] = "agent",
+        hours: int = Query(24, ge=1, le=24 * 90),
+        limit: int = Query(50, ge=1, le=500),
+        session: AsyncSession = Depends(get_session),
+        current_user: User = Depends(get_current_active_user)
+) -> List[LLMUsageRow]:
+    """
+    Расход LLM по агентам текущего пользователя (или по видам вызовов) за последние
+    hours часов: токены промпта и ответа, число вызовов и задержки. Самые дорогие — первыми.
+    """
+    rows = await fetch_usage(
+        session, str(current_user.id), group_by=group_by, hours=hours, limit=limit, ledger=usage_ledger
+    )
+    return [LLMUsageRow(**row) for row in rows]
+
+
+@router.get("/shards", response_model=List[SimulationShardStatus])
+async def list_shards(
+        session: AsyncSession = Depends(get_session),
+        current_user: User = Depends(get_current_active_user)
+) -> List[SimulationShardStatus]:
+    """
+    Состояние шардов симуляции при запуске воркеров (SIMULATION_MODE=workers):
+    владелец аренды и скорость тиков по каждому шарду.
+    """
+    shards = await fetch_shards(session, settings.SIMULATION_SHARDS)
+    return [
+        SimulationShardStatus(
+            shard_id=shard.shard_id,
+            owner=shard.owner,
+            alive=lease_alive(shard),
+            agents=shard.agents or 0,
+            ticks=shard.ticks or 0,
+            ticks_per_second=shard.ticks_per_second or 0.0,
+            heartbeat_at=shard.heartbeat_at,
+        )
+        for shard in shards
+    ]
@@ -6,7 +6,7 @@
 from __future__ import annotations
 
 import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 from uuid import UUID
 
 from pydantic import BaseModel, Field
@@ -111,6 +111,112 @@ class SimulationStatus(BaseModel):
     speed: float
     is_paused: bool
     tick_seconds: float
+    tick_lag_seconds: float = 0.0  # насколько последний тик начался позже расписания
+    overruns: int = 0  # тиков, не уложившихся в период
+    skipped_ticks: int = 0  # дедлайнов, пропущенных политикой SIMULATION_TICK_POLICY
+    pregen_ready: int = 0  # заранее сгенерированных реплик в очередях
+    pregen_hit_rate: float = 0.0  # доля шагов в чат, взявших готовую реплику
+    scenes_active: int = 0  # групповых чатов с недоигранной сценой
+    llm_breaker: str = "closed"  # состояние автомата защиты LLM: closed | open | half_open
+
+
+class LLMCacheStats(BaseModel):
+    size: int = 0  # записей в памяти
+    hits: int = 0
+    disk_hits: int = 0  # из них найдено на диске
+    misses: int = 0
+    hit_rate: float = 0.0
+
+
+class LLMBatchStats(BaseModel):
+    batches: int = 0  # пакетных запросов, разобранных успешно
+    batched_requests: int = 0  # реплик, полученных пакетами
+    fallbacks: int = 0  # пакетов, откатившихся на одиночные запросы
+
+
+class LLMLimiterStats(BaseModel):
+    queue_depth: int = 0  # запросов ждут бакета или слота
+    in_flight: int = 0
+    max_in_flight: int = 0
+    requests_per_minute: float = 0
+    tokens_per_minute: float = 0
+    admitted: int = 0
+    delayed: int = 0  # из них ждали перед отправкой
+    avg_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    last_wait_seconds: float = 0.0
+
+
+class LLMContextStats(BaseModel):
+    budget_tokens: int = 0
+    conversations: int = 0  # разговоров с резюме
+    folded_turns: int = 0  # реплик, свёрнутых в резюме
+    trimmed_turns: int = 0  # реплик, не поместившихся в бюджет
+
+
+class LLMLatencyModelStats(BaseModel):
+    samples: int = 0
+    p50: float = 0.0
+    p90: float = 0.0
+    p95: float = 0.0
+    timeout: float = 0.0  # текущий адаптивный таймаут
+    timeouts: int = 0
+
+
+class LLMLatencyStats(BaseModel):
+    hedges: int = 0  # отправлено дублей
+    hedge_wins: int = 0  # дубль ответил первым
+    models: Dict[str, LLMLatencyModelStats] = {}
+
+
+class LLMBreakerStats(BaseModel):
+    state: str = "closed"
+    failure_rate: float = 0.0  # доля неудач в окне
+    opened: int = 0  # сколько раз размыкался
+    rejected: int = 0  # запросов отклонено без обращения к провайдеру
+
+
+class LLMSyncStats(BaseModel):
+    running: bool = False  # запущен ли фоновый цикл синхронных вызовов
+    max_concurrency: int = 0
+    active: int = 0
+    calls: int = 0
+    timeouts: int = 0
+
+
+class LLMStatus(BaseModel):
+    enabled: bool
+    provider: str = "off"
+    model: Optional[str] = None
+    cache: LLMCacheStats
+    batch: LLMBatchStats
+    limiter: LLMLimiterStats
+    context: LLMContextStats
+    breaker: LLMBreakerStats
+    latency: LLMLatencyStats
+    sync: LLMSyncStats
+
+
+class LLMUsageRow(BaseModel):
+    key: str  # агент, пользователь или вид вызова (action, message, chat, scene) — по группировке
+    calls: int = 0
+    errors: int = 0
+    cached: int = 0  # из них отдано из кэша без запроса к API
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    avg_latency_ms: float = 0.0
+    latency_ms_max: float = 0.0
+
+
+class SimulationShardStatus(BaseModel):
+    shard_id: int  # номер шарда
+    owner: Optional[str] = None  # воркер, который арендует шард
+    alive: bool = False  # аренда действительна
+    agents: int = 0  # агентов в шарде
+    ticks: int = 0  # тиков с момента аренды
+    ticks_per_second: float = 0.0  # скорость за последний интервал heartbeat
+    heartbeat_at: Optional[datetime.datetime] = None
 
 
 # ------- Аутентификация -------
@@ -15,6 +15,7 @@ import logging
 from backend.database.postgr.models import User, GroupChat
 from backend.project_config import settings
 from backend.schemas import UserCreate, UserLogin, TokenData
+from backend.services.world import world
 
 logger = logging.getLogger(__name__)
 
@@ -80,6 +81,7 @@ async def create_user(session: AsyncSession, user_data: UserCreate) -> User:
     session.add(default_chat)
     await session.commit()
     await session.refresh(user)
+    world.upsert_chat(default_chat, [])
 
     logger.info("Пользователь создан id=%s, создан дефолтный чат id=%s", user.id, default_chat.id)
     return user
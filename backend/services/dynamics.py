@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+"""
+Состояние агентов в виде struct-of-arrays и векторные ядра динамики.
+
+Настроение и энергия всех агентов мира лежат в двух массивах NumPy,
+индексированных слотом агента (удаление — обменом с последним слотом).
+AgentState читает и пишет свои mood/energy через эти массивы, а массовые
+изменения — влияние сообщения на участников чата, восстановление
+энергии, ограничение диапазонов — выполняются одной операцией над набором
+слотов вместо цикла по агентам.
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+MOOD_MIN, MOOD_MAX = 0.0, 1.0
+ENERGY_MIN, ENERGY_MAX = 0, 100
+
+
+class AgentArrays:
+    """
+    Массивы mood (float64) и energy (int32) по слотам агентов.
+    """
+
+    def __init__(self, capacity: int = 64) -> None:
+        self.mood = np.zeros(capacity, dtype=np.float64)
+        self.energy = np.zeros(capacity, dtype=np.int32)
+        self.ids: List[str] = []
+        self.slots: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, agent_id: str) -> bool:
+        return agent_id in self.slots
+
+    def clear(self) -> None:
+        self.ids.clear()
+        self.slots.clear()
+
+    def _grow(self, capacity: int) -> None:
+        mood = np.zeros(capacity, dtype=np.float64)
+        energy = np.zeros(capacity, dtype=np.int32)
+        n = len(self.ids)
+        mood[:n] = self.mood[:n]
+        energy[:n] = self.energy[:n]
+        self.mood, self.energy = mood, energy
+
+    def add(self, agent_id: str, mood: float, energy: int) -> int:
+        slot = self.slots.get(agent_id)
+        if slot is None:
+            slot = len(self.ids)
+            if slot >= len(self.mood):
+                self._grow(max(64, len(self.mood) * 2))
+            self.ids.append(agent_id)
+            self.slots[agent_id] = slot
+        self.mood[slot] = min(MOOD_MAX, max(MOOD_MIN, float(mood)))
+        self.energy[slot] = min(ENERGY_MAX, max(ENERGY_MIN, int(energy)))
+        return slot
+
+    def remove(self, agent_id: str) -> None:
+        slot = self.slots.pop(agent_id, None)
+        if slot is None:
+            return
+        last_id = self.ids.pop()
+        last_slot = len(self.ids)
+        if slot != last_slot:
+            # Переносим последний слот на место удалённого
+            self.ids[slot] = last_id
+            self.slots[last_id] = slot
+            self.mood[slot] = self.mood[last_slot]
+            self.energy[slot] = self.energy[last_slot]
+
+    def slot(self, agent_id: str) -> int:
+        return self.slots[agent_id]
+
+    def slots_of(self, agent_ids: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.slots[a] for a in agent_ids), dtype=np.intp)
+
+    def ids_of(self, slots: np.ndarray) -> List[str]:
+        return [self.ids[s] for s in slots.tolist()]
+
+    # ----- Ядра динамики -----
+
+    def clamp(self, slots: Optional[np.ndarray] = None) -> None:
+        """Вернуть mood в [0, 1] и energy в [0, 100]."""
+        if slots is None:
+            n = len(self.ids)
+            np.clip(self.mood[:n], MOOD_MIN, MOOD_MAX, out=self.mood[:n])
+            np.clip(self.energy[:n], ENERGY_MIN, ENERGY_MAX, out=self.energy[:n])
+            return
+        self.mood[slots] = np.clip(self.mood[slots], MOOD_MIN, MOOD_MAX)
+        self.energy[slots] = np.clip(self.energy[slots], ENERGY_MIN, ENERGY_MAX)
+
+    def chat_influence(
+            self,
+            slots: np.ndarray,
+            affinities: np.ndarray,
+            rate: float = 0.02,
+            energy_cost: int = 1,
+    ) -> None:
+        """
+        Участники чата услышали сообщение: настроение сдвигается на affinity * rate
+        (к отправителю, которого любят, — вверх), энергия тратится на energy_cost.
+        """
+        self.mood[slots] += np.asarray(affinities, dtype=np.float64) * rate
+        self.energy[slots] -= energy_cost
+        self.clamp(slots)
+
+    def recover(self, amount: int, below: int = ENERGY_MAX) -> np.ndarray:
+        """
+        Восстановить энергию всем агентам, у которых её меньше below.
+        Возвращает слоты изменённых агентов.
+        """
+        n = len(self.ids)
+        slots = np.flatnonzero(self.energy[:n] < below)
+        if slots.size and amount:
+            self.energy[slots] = np.minimum(self.energy[slots] + amount, ENERGY_MAX)
+        return slots
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+"""
+Справедливое распределение тиков симуляции между пользователями (тенантами).
+
+У каждого пользователя своя выборка агентов (AgentSampler), а слоты тика
+делятся между пользователями stride-планированием: тенант с наименьшим
+"проходом" получает следующий слот, после чего его проход растёт на
+1 / (вес * скорость). Поэтому пользователь с 5000 агентов получает ту же долю
+тиков, что и пользователь с 5, если их веса и скорости равны.
+
+Кроме доли у тенанта есть бюджет — максимум агентов за тик
+(SIMULATION_TENANT_TICK_BUDGET, умноженный на скорость пользователя),
+а также собственная пауза.
+"""
+
+import heapq
+import random
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from backend.services.sampler import AgentSampler
+
+TenantId = Optional[str]
+
+MIN_SPEED = 0.1
+MAX_SPEED = 10.0
+
+
+@dataclass
+class TenantState:
+    tenant_id: TenantId
+    weight: float = 1.0
+    speed: float = 1.0
+    paused: bool = False
+    # Виртуальное время stride-планировщика
+    pass_value: float = 0.0
+    # Сколько агентов тенанта выбрано за всё время (для статистики)
+    picked: int = 0
+
+
+class FairShareScheduler:
+    """
+    Выборка агентов с разделением тика между тенантами.
+    Интерфейс совпадает с AgentSampler, только add() дополнительно принимает тенанта.
+    """
+
+    def __init__(self, policy: str = "uniform", tenant_budget: int = 8, rng: Optional[random.Random] = None) -> None:
+        self.policy = policy
+        self.tenant_budget = max(1, tenant_budget)
+        self._rng = rng or random.Random()
+        self._samplers: Dict[TenantId, AgentSampler] = {}
+        self._tenant_of: Dict[str, TenantId] = {}
+        # Настройки тенантов переживают перезагрузку мира: clear() их не трогает
+        self.tenants: Dict[TenantId, TenantState] = {}
+        self._vtime = 0.0
+
+    @property
+    def rng(self) -> random.Random:
+        return self._rng
+
+    @rng.setter
+    def rng(self, rng: random.Random) -> None:
+        self._rng = rng
+        for sampler in self._samplers.values():
+            sampler.rng = rng
+
+    def __len__(self) -> int:
+        return len(self._tenant_of)
+
+    def __contains__(self, agent_id: str) -> bool:
+        return agent_id in self._tenant_of
+
+    def clear(self) -> None:
+        self._samplers.clear()
+        self._tenant_of.clear()
+
+    # ----- Тенанты -----
+
+    def tenant(self, tenant_id: TenantId) -> TenantState:
+        state = self.tenants.get(tenant_id)
+        if state is None:
+            # Новый тенант стартует с текущего виртуального времени, а не с нуля
+            state = TenantState(tenant_id=tenant_id, pass_value=self._vtime)
+            self.tenants[tenant_id] = state
+        return state
+
+    def configure(
+            self,
+            tenant_id: TenantId,
+            paused: Optional[bool] = None,
+            speed: Optional[float] = None,
+            weight: Optional[float] = None,
+    ) -> TenantState:
+        """Изменить паузу, скорость или вес тенанта."""
+        state = self.tenant(tenant_id)
+        if paused is not None:
+            state.paused = paused
+        if speed is not None:
+            state.speed = max(MIN_SPEED, min(speed, MAX_SPEED))
+        if weight is not None and weight > 0:
+            state.weight = weight
+        return state
+
+    def budget_for(self, tenant_id: TenantId) -> int:
+        """Максимум агентов тенанта за один тик."""
+        return max(1, round(self.tenant_budget * self.tenant(tenant_id).speed))
+
+    # ----- Агенты -----
+
+    def tenant_of(self, agent_id: str) -> TenantId:
+        return self._tenant_of.get(agent_id)
+
+    def add(self, agent_id: str, energy: float = 100.0, tenant: TenantId = None) -> None:
+        current = self._tenant_of.get(agent_id, tenant)
+        if agent_id in self._tenant_of and current != tenant:
+            # Агент сменил владельца
+            self.remove(agent_id)
+        sampler = self._samplers.get(tenant)
+        if sampler is None:
+            sampler = AgentSampler(self.policy, self._rng)
+            self._samplers[tenant] = sampler
+            self.tenant(tenant)
+        sampler.add(agent_id, energy)
+        self._tenant_of[agent_id] = tenant
+
+    def remove(self, agent_id: str) -> None:
+        if agent_id not in self._tenant_of:
+            return
+        tenant = self._tenant_of.pop(agent_id)
+        sampler = self._samplers.get(tenant)
+        if sampler is not None:
+            sampler.remove(agent_id)
+            if not len(sampler):
+                del self._samplers[tenant]
+
+    def update(self, agent_id: str, energy: float) -> None:
+        if agent_id in self._tenant_of:
+            self._samplers[self._tenant_of[agent_id]].update(agent_id, energy)
+
+    def mark_acted(self, agent_ids: List[str]) -> None:
+        for agent_id in agent_ids:
+            if agent_id in self._tenant_of:
+                self._samplers[self._tenant_of[agent_id]].mark_acted([agent_id])
+
+    def sample(self, k: int) -> List[str]:
+        """
+        Вернуть до k различных агентов: слоты делятся между активными тенантами
+        пропорционально весу и скорости, но не больше бюджета тенанта.
+        """
+        if k <= 0:
+            return []
+        heap = []
+        caps: Dict[TenantId, int] = {}
+        for order, (tenant_id, sampler) in enumerate(self._samplers.items()):
+            state = self.tenant(tenant_id)
+            if state.paused or not len(sampler):
+                continue
+            caps[tenant_id] = min(len(sampler), self.budget_for(tenant_id))
+            # Простаивавший тенант не должен накопить "долг" и забрать весь тик
+            heapq.heappush(heap, (max(state.pass_value, self._vtime), order, tenant_id))
+
+        quotas: Dict[TenantId, int] = {}
+        remaining = k
+        while remaining and heap:
+            pass_value, order, tenant_id = heapq.heappop(heap)
+            state = self.tenants[tenant_id]
+            self._vtime = pass_value
+            state.pass_value = pass_value + 1.0 / (state.weight * state.speed)
+            quotas[tenant_id] = quotas.get(tenant_id, 0) + 1
+            remaining -= 1
+            if quotas[tenant_id] < caps[tenant_id]:
+                heapq.heappush(heap, (state.pass_value, order, tenant_id))
+
+        result: List[str] = []
+        for tenant_id, quota in quotas.items():
+            picked = self._samplers[tenant_id].sample(quota)
+            self.tenants[tenant_id].picked += len(picked)
+            result.extend(picked)
+        return result
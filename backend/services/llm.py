@@ -3,14 +3,31 @@ from __future__ import annotations
 import asyncio
 import logging
 import time
-from typing import Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
-from openai import AsyncOpenAI
 from openai._exceptions import RateLimitError
 from backend.project_config import settings
+from backend.services.llm_batch import MessageBatcher
+from backend.services.llm_bridge import LoopBridge
+from backend.services.llm_breaker import CircuitBreaker, CircuitOpenError
+from backend.services.llm_cache import ResponseCache
+from backend.services.llm_context import PERSONA_SHARE, ContextBuilder, truncate_tokens
+from backend.services.llm_latency import LatencyTracker
+from backend.services.llm_limiter import LLMRateLimiter, estimate_tokens
+from backend.services.llm_providers import LLMProvider, make_provider
+from backend.services.llm_usage import (
+    current_usage,
+    estimate_completion_tokens,
+    estimate_prompt_tokens,
+    track_usage,
+    usage_ledger,
+)
 
 logger = logging.getLogger(__name__)
 
+# Колбэк потоковой генерации: получает очередной фрагмент текста
+DeltaCallback = Callable[[str], Awaitable[None]]
+
 SYSTEM_PROMPT_ACTION = """Ты — симулятор действий конкретного агента в кибер-городе.
 ВАЖНО: Отвечай ТОЛЬКО на русском языке, одной строкой, лаконично, без цитат, без разметки.
 Не добавляй время и имена других агентов, только действие. Используй только русский язык.
@@ -47,20 +64,326 @@ SYSTEM_PROMPT_CHAT = """Ты — конкретный AI-агент в вирт
 Не повторяйся — каждый раз говори о чём-то новом или развивай тему по-своему.
 """
 
+SYSTEM_PROMPT_SCENE = """Ты — сценарист переписки в групповом чате виртуального кибер-города.
+ВАЖНО: Все реплики должны быть ТОЛЬКО на русском языке.
+
+Тебе передают название и описание чата, список участников (имя, настроение, черты характера, описание персонажа)
+и сколько реплик нужно. Напиши короткий связный диалог: участники отвечают друг другу, спорят, соглашаются
+и развивают одну тему в рамках ситуации чата. Каждый говорит в своём характере и от первого лица,
+как в обычном мессенджере, 1-3 предложения на реплику, без описания действий и без повествования.
+Первым говорит участник, указанный в запросе; дальше порядок выбирай сам, но не давай одному говорить дважды подряд.
+
+Верни ТОЛЬКО JSON-массив без пояснений и разметки, по объекту на реплику:
+[{"speaker": "имя участника точно как в списке", "text": "реплика"}, ...]
+"""
+
+# Заголовок промпта сцены (по нему заглушка провайдера узнаёт запрос сцены)
+SCENE_HEADER = "### Сцена"
+
 
 class LLMClient:
     """
-    Обертка над AsyncOpenAI с таймаутом и обработкой rate limiting.
+    Клиент LLM поверх провайдера (OpenAI, совместимый сервер, заглушка) с таймаутом, ограничением темпа запросов и кэшем ответов.
     """
 
-    def __init__(self) -> None:
-        self.enabled = bool(settings.OPENAI_API_KEY)
-        if self.enabled:
-            self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-            self.model = settings.OPENAI_MODEL
+    def __init__(self, provider: Optional[LLMProvider] = None) -> None:
+        self.use_provider(provider or make_provider(settings))
+        self.cache = ResponseCache(
+            max_entries=settings.LLM_CACHE_SIZE,
+            ttl_seconds=settings.LLM_CACHE_TTL_SECONDS,
+            disk_dir=settings.LLM_CACHE_DIR,
+        )
+        self.limiter = LLMRateLimiter(
+            requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE,
+            tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE,
+            max_in_flight=settings.LLM_MAX_IN_FLIGHT,
+        )
+        self.context = ContextBuilder(
+            budget_tokens=settings.LLM_CONTEXT_BUDGET_TOKENS,
+            summary_tokens=settings.LLM_SUMMARY_TOKENS,
+        )
+        # Задержки по моделям: адаптивные таймауты и дублирование медленных запросов
+        self.latency = LatencyTracker(
+            window=settings.LLM_LATENCY_WINDOW,
+            default_timeout=settings.LLM_TIMEOUT_SECONDS,
+            min_timeout=settings.LLM_TIMEOUT_MIN_SECONDS,
+            max_timeout=settings.LLM_TIMEOUT_MAX_SECONDS,
+            p95_factor=settings.LLM_TIMEOUT_P95_FACTOR,
+        )
+        self.hedge_enabled = settings.LLM_HEDGE_ENABLED
+        self.breaker = CircuitBreaker(
+            window=settings.LLM_BREAKER_WINDOW,
+            min_calls=settings.LLM_BREAKER_MIN_CALLS,
+            failure_rate=settings.LLM_BREAKER_FAILURE_RATE,
+            slow_seconds=settings.LLM_BREAKER_SLOW_SECONDS,
+            cooldown_seconds=settings.LLM_BREAKER_COOLDOWN_SECONDS,
+            probe_seconds=settings.LLM_BREAKER_PROBE_SECONDS,
+        )
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.batcher = MessageBatcher(
+            self._request,
+            send_batch=lambda messages, timeout: self._request(messages, timeout, kind="batch"),
+            window_seconds=settings.LLM_BATCH_WINDOW_SECONDS,
+            max_size=settings.LLM_BATCH_MAX_SIZE,
+        )
+        # Фоновый цикл для sync_generate_chat со своим пулом соединений
+        self.bridge = LoopBridge(max_concurrency=settings.LLM_SYNC_MAX_CONCURRENCY)
+
+    def use_provider(self, provider: LLMProvider) -> None:
+        """Переключить клиента на другого провайдера (OpenAI, совместимый сервер, заглушка)."""
+        self.provider = provider
+        self.client = provider.client
+        self.model = provider.model
+        self.enabled = provider.enabled
+
+    async def _complete(
+            self,
+            messages: List[Dict[str, str]],
+            timeout: Optional[float] = None,
+            batch: bool = False,
+            on_delta: Optional[DeltaCallback] = None,
+            method: str = "chat",
+            cache: bool = False,
+    ) -> str:
+        """
+        Ответ модели на промпт. С cache=True одинаковые (после нормализации) промпты
+        отдаются из кэша без запроса к API. Реплики (сообщения, чат, сцены) не
+        кэшируются: при том же промпте агент повторял бы ту же фразу дословно.
+        Запросы с batch=True могут уйти одним пакетом
+        с другими репликами того же тика. С on_delta ответ запрашивается потоком
+        (stream=True) и каждый фрагмент передаётся в колбэк по мере генерации.
+
+        Токены и время вызова записываются в usage_ledger под видом method и
+        агентом/пользователем из llm_call_tags.
+        """
+        started = time.monotonic()
+        with track_usage() as usage:
+            try:
+                text, cached = await self._complete_once(messages, timeout, batch, on_delta, cache)
+            except CircuitOpenError:
+                # Запрос не отправлялся — расходовать нечего
+                raise
+            except Exception:
+                usage_ledger.record(
+                    method,
+                    time.monotonic() - started,
+                    prompt_tokens=usage.prompt_tokens or 0,
+                    completion_tokens=usage.completion_tokens or 0,
+                    error=True,
+                )
+                raise
+        if cached:
+            usage_ledger.record(method, time.monotonic() - started, cached=True)
+        else:
+            # Поток и заглушка не сообщают usage — оцениваем по тексту
+            usage_ledger.record(
+                method,
+                time.monotonic() - started,
+                prompt_tokens=usage.prompt_tokens if usage.prompt_tokens is not None
+                else estimate_prompt_tokens(messages),
+                completion_tokens=usage.completion_tokens if usage.completion_tokens is not None
+                else estimate_completion_tokens(text),
+            )
+        return text
+
+    async def _complete_once(
+            self,
+            messages: List[Dict[str, str]],
+            timeout: Optional[float],
+            batch: bool,
+            on_delta: Optional[DeltaCallback],
+            cache: bool = False,
+    ) -> tuple[str, bool]:
+        """Текст ответа и признак, что он взят из кэша."""
+        key = self.cache.key(self.model, messages) if cache and self.cache.enabled else None
+        if key is not None:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                if on_delta is not None:
+                    await on_delta(cached)
+                return cached, True
+
+        # Провайдер недоступен — сразу отказ, вызывающий код возьмёт запасной текст
+        self.breaker.check()
+        if on_delta is not None:
+            text = await self._stream(messages, on_delta, timeout)
+        elif batch and self.batcher.enabled:
+            text = await self.batcher.submit(messages, timeout)
         else:
-            self.client = None
-            self.model = None
+            text = await self._request(messages, timeout)
+        if key is not None and text:
+            await self.cache.set(key, text)
+        return text, False
+
+    def _api(self) -> Any:
+        """
+        Клиент chat.completions для текущего цикла событий: в цикле моста — его
+        собственный клиент провайдера, иначе основной.
+        """
+        if self.bridge.in_loop() and self.client is self.provider.client:
+            return self.bridge.client_for(self.provider, self.provider.new_client)
+        return self.client
+
+    def _latency_key(self, kind: str = "") -> str:
+        return f"{self.model}:{kind}" if kind else str(self.model)
+
+    async def _request(
+            self,
+            messages: List[Dict[str, str]],
+            timeout: Optional[float] = None,
+            kind: str = "",
+    ) -> str:
+        """
+        Один запрос chat.completions с повторами при rate limit.
+        Без явного timeout таймаут берётся из гистограммы задержек модели;
+        если ответа нет дольше p90, запрос дублируется (hedging).
+        """
+        key = self._latency_key(kind)
+        budget = timeout if timeout is not None else self.latency.timeout_for(key)
+
+        async def attempt():
+            # Ожидание в ограничителе не входит ни в таймаут, ни в замер задержки
+            async with self.limiter.slot(estimate_tokens(messages)) as lease:
+                sent = time.monotonic()
+                try:
+                    resp = await asyncio.wait_for(
+                        self._api().chat.completions.create(model=self.model, messages=messages), timeout=budget
+                    )
+                except asyncio.TimeoutError:
+                    self.latency.observe_timeout(key, budget)
+                    self.breaker.record_failure()
+                    raise
+                except RateLimitError:
+                    # Лимит — не поломка провайдера, им занимается ограничитель
+                    raise
+                except Exception:
+                    self.breaker.record_failure()
+                    raise
+                elapsed = time.monotonic() - sent
+                self.latency.observe(key, elapsed)
+                self.breaker.record_success(elapsed)
+                usage = getattr(resp, "usage", None)
+                lease.used(getattr(usage, "total_tokens", None))
+                holder = current_usage()
+                if holder is not None and usage is not None:
+                    holder.add(usage)
+                return resp
+
+        resp = await self._call_with_retry(lambda: self._hedged(attempt, key))
+        return resp.choices[0].message.content.strip()
+
+    async def _hedged(self, attempt, key: str):
+        """
+        Запустить attempt(); если он не завершился за p90, запустить дубль и вернуть
+        первый успешный ответ. Проигравший запрос отменяется.
+        """
+        delay = self.latency.hedge_after(key) if self.hedge_enabled else None
+        if delay is None:
+            return await attempt()
+
+        first = asyncio.ensure_future(attempt())
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            # Дубль только если ограничитель не держит очередь: иначе он лишь отнимет квоту
+            if not done and self.limiter.queued == 0:
+                self.hedges += 1
+                pending.add(asyncio.ensure_future(attempt()))
+            error: Optional[BaseException] = None
+            while done or pending:
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _stream(
+            self,
+            messages: List[Dict[str, str]],
+            on_delta: DeltaCallback,
+            timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Потоковый запрос: фрагменты уходят в on_delta, возвращается весь текст.
+        Поток не дублируется — клиенты уже получают его фрагменты.
+        """
+        key = self._latency_key("stream")
+        budget = timeout if timeout is not None else self.latency.timeout_for(key)
+
+        async def _make_request():
+            async with self.limiter.slot(estimate_tokens(messages)):
+                parts: List[str] = []
+
+                async def consume() -> None:
+                    stream = await self._api().chat.completions.create(
+                        model=self.model, messages=messages, stream=True
+                    )
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            parts.append(delta)
+                            await on_delta(delta)
+
+                sent = time.monotonic()
+                try:
+                    await asyncio.wait_for(consume(), timeout=budget)
+                except asyncio.TimeoutError:
+                    self.latency.observe_timeout(key, budget)
+                    self.breaker.record_failure()
+                    raise
+                except RateLimitError:
+                    raise
+                except Exception:
+                    self.breaker.record_failure()
+                    raise
+                elapsed = time.monotonic() - sent
+                self.latency.observe(key, elapsed)
+                self.breaker.record_success(elapsed)
+                return "".join(parts).strip()
+
+        return await self._call_with_retry(_make_request)
+
+    def is_idle(self) -> bool:
+        """
+        Провайдер исправен, в ограничителе нет очереди и занято не больше половины
+        слотов — можно делать фоновую работу.
+        """
+        limit = self.limiter.stats()["max_in_flight"]
+        return (
+                self.breaker.state == "closed"
+                and self.limiter.queued == 0
+                and (limit <= 0 or self.limiter.in_flight * 2 < limit)
+        )
+
+    def stats(self) -> dict:
+        """Счётчики клиента для мониторинга."""
+        return {
+            "enabled": self.enabled,
+            "provider": self.provider.name,
+            "model": self.model,
+            "cache": self.cache.stats(),
+            "batch": self.batcher.stats(),
+            "limiter": self.limiter.stats(),
+            "context": self.context.stats(),
+            "breaker": self.breaker.stats(),
+            "latency": {"hedges": self.hedges, "hedge_wins": self.hedge_wins, "models": self.latency.stats()},
+            "sync": self.bridge.stats(),
+        }
+
+    def close(self) -> None:
+        """Остановить фоновый цикл синхронных вызовов."""
+        self.bridge.close()
 
     async def _call_with_retry(self, func, *args, max_retries=3, base_delay=1.0, **kwargs):
         """
@@ -78,7 +401,11 @@ class LLMClient:
                 delay = base_delay * (2 ** attempt) + (0.1 * attempt)
                 logger.info(
                     f"Rate limit достигнут. Повтор через {delay:.2f} секунд (попытка {attempt + 1}/{max_retries + 1})")
-                await asyncio.sleep(delay)
+                if self.limiter.requests.enabled or self.limiter.tokens.enabled:
+                    # Пауза для всех запросов сразу: повтор и остальные вызовы подождут в ограничителе
+                    self.limiter.pause(delay)
+                else:
+                    await asyncio.sleep(delay)
             except Exception as e:
                 logger.warning(f"Неожиданная ошибка при вызове API: {e}")
                 raise
@@ -92,16 +419,17 @@ class LLMClient:
             memories: List[str],
             traits: List[str] = None,
             persona: str | None = None,
-            timeout: float = 4.0,
+            timeout: Optional[float] = None,
     ) -> Optional[str]:
         if not self.enabled:
             return None
 
+        context = self.context.build([], memories, persona if isinstance(persona, str) else "")
         mood_str = f"{mood:.2f}"
-        mem_text = "; ".join(memories[:5]) if memories else "нет свежих воспоминаний"
+        mem_text = "; ".join(context.memories) if context.memories else "нет свежих воспоминаний"
         task_text = current_task or "нет активной задачи"
         traits_text = ", ".join(traits[:3]) if traits else "обычный"
-        persona_text = persona.strip() if isinstance(persona, str) else ""
+        persona_text = f"{context.persona}\n" if context.persona else ""
 
         user_prompt = (
             f"Агент: {agent_name}\n"
@@ -115,21 +443,16 @@ class LLMClient:
             f"Будь разнообразным - не повторяй предыдущие действия. Только русский язык."
         )
 
-        async def _make_request():
-            return await asyncio.wait_for(
-                self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": SYSTEM_PROMPT_ACTION},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                ),
-                timeout=timeout,
-            )
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT_ACTION},
+            {"role": "user", "content": user_prompt},
+        ]
 
         try:
-            resp = await self._call_with_retry(_make_request)
-            return resp.choices[0].message.content.strip()
+            # Выбор действия при том же состоянии агента можно повторить — его кэшируем
+            return await self._complete(messages, timeout=timeout, method="action", cache=True)
+        except CircuitOpenError:
+            return None
         except Exception as e:
             logger.warning(f"LLM generate_action failed: {e}")
             return None
@@ -146,25 +469,36 @@ class LLMClient:
             sender_persona: str | None = None,
             receiver_traits: List[str] = None,
             topic_hint: str = "",
-            timeout: float = 4.0,
+            timeout: Optional[float] = None,
+            on_delta: Optional[DeltaCallback] = None,
+            conversation_key: Optional[str] = None,
     ) -> Optional[str]:
+        """
+        conversation_key — ключ разговора (пара агентов или чат): реплики истории,
+        не поместившиеся в бюджет контекста, сворачиваются в его резюме.
+        """
         if not self.enabled:
             return None
 
+        context = self.context.build(
+            conversation_history, recent_memories, sender_persona or "", key=conversation_key
+        )
         messages: List[Dict[str, str]] = [{"role": "system", "content": SYSTEM_PROMPT_CHAT}]
-        for msg in conversation_history or []:
+        if context.summary:
+            messages.append({"role": "system", "content": f"Ранее в разговоре: {context.summary}"})
+        for msg in context.history:
             role = "assistant" if msg.get("from") == sender_name else "user"
             messages.append({"role": role, "content": msg.get("text", "")})
         if topic_hint:
             messages.append({"role": "system", "content": f"Тема: {topic_hint}"})
-        if recent_memories:
-            mem_text = "; ".join(recent_memories[:5])
+        if context.memories:
+            mem_text = "; ".join(context.memories)
             messages.append({"role": "system", "content": f"Воспоминания: {mem_text}"})
         sender_text = ", ".join(sender_traits[:3]) if sender_traits else ""
         receiver_text = ", ".join(receiver_traits[:3]) if receiver_traits else ""
         persona_parts: List[str] = []
-        if sender_persona:
-            persona_parts.append(f"Описание персонажа: {sender_persona.strip()[:200]}")
+        if context.persona:
+            persona_parts.append(f"Описание персонажа: {context.persona}")
         summary = (
                 f"Отправитель: {sender_name} (Настроение: {sender_mood:.2f}, Черты: {sender_text}). "
                 f"Получатель: {receiver_name} (Черты: {receiver_text}). "
@@ -172,18 +506,10 @@ class LLMClient:
         )
         messages.append({"role": "system", "content": summary})
 
-        async def _make_request():
-            return await asyncio.wait_for(
-                self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                ),
-                timeout=timeout,
-            )
-
         try:
-            resp = await self._call_with_retry(_make_request)
-            return resp.choices[0].message.content.strip()
+            return await self._complete(messages, timeout=timeout, batch=True, on_delta=on_delta, method="message")
+        except CircuitOpenError:
+            return None
         except Exception as e:
             logger.warning(f"LLM generate_message failed: {e}")
             return None
@@ -192,44 +518,87 @@ class LLMClient:
             self,
             history: List[Dict[str, str]],
             memory: str,
+            timeout: Optional[float] = None,
     ) -> Optional[str]:
         if not self.enabled:
             return None
 
-        async def _make_request():
-            return await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT_CHAT},
-                    *(history or []),
-                    {"role": "system", "content": f"Воспоминание: {memory}"},
-                ],
-            )
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT_CHAT},
+            *(history or []),
+            {"role": "system", "content": f"Воспоминание: {memory}"},
+        ]
 
         try:
-            resp = await self._call_with_retry(_make_request)
-            return resp.choices[0].message.content.strip()
+            return await self._complete(messages, timeout=timeout)
+        except CircuitOpenError:
+            return None
         except Exception as e:
             logger.warning(f"LLM generate_chat failed: {e}")
             return None
 
+    async def generate_scene(
+            self,
+            topic_hint: str,
+            speakers: List[Dict[str, Any]],
+            turns: int,
+            recent_memories: List[str],
+            timeout: Optional[float] = None,
+    ) -> Optional[str]:
+        """
+        Сценарий диалога в групповом чате одним запросом: ответ модели — JSON-массив
+        реплик {"speaker", "text"} (разбирается в services.scenes). speakers — участники
+        {"name", "mood", "traits", "persona"}, первый из них начинает; recent_memories —
+        его воспоминания.
+        """
+        if not self.enabled or not speakers:
+            return None
+
+        first = speakers[0]
+        context = self.context.build([], recent_memories, first.get("persona") or "")
+        # Описаниям персонажей вместе — та же доля бюджета, что одному персонажу в реплике
+        persona_tokens = int(self.context.budget_tokens * PERSONA_SHARE / len(speakers))
+        lines = [SCENE_HEADER, topic_hint, "Участники:"]
+        for speaker in speakers:
+            traits = ", ".join((speaker.get("traits") or [])[:3]) or "обычный"
+            persona = truncate_tokens((speaker.get("persona") or "").strip(), persona_tokens)
+            line = f"- {speaker['name']} (настроение: {speaker.get('mood', 0.5):.2f}, черты: {traits})"
+            lines.append(f"{line}. {persona}" if persona else line)
+        if context.memories:
+            lines.append(f"Воспоминания {first['name']}: {'; '.join(context.memories)}")
+        lines.append(f"Первым говорит {first['name']}. Реплик: {turns}.")
+
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT_SCENE},
+            {"role": "user", "content": "\n".join(lines)},
+        ]
+
+        try:
+            return await self._complete(messages, timeout=timeout, method="scene")
+        except CircuitOpenError:
+            return None
+        except Exception as e:
+            logger.warning(f"LLM generate_scene failed: {e}")
+            return None
+
     def sync_generate_chat(self, history: List[Dict[str, str]], memory: str) -> Optional[str]:
+        """
+        Синхронный вариант generate_chat для скриптов и потоков-воркеров: вызов
+        выполняется в фоновом цикле моста, работает и из потока с запущенным циклом.
+        """
         if not self.enabled:
             return None
 
-        async def _make_request():
-            return await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT_CHAT},
-                    *(history or []),
-                    {"role": "system", "content": f"Воспоминание: {memory}"},
-                ],
-            )
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT_CHAT},
+            *(history or []),
+            {"role": "system", "content": f"Воспоминание: {memory}"},
+        ]
 
         try:
-            resp = asyncio.run(self._call_with_retry(_make_request))
-            return resp.choices[0].message.content.strip()
+            return self.bridge.run(self._complete(messages))
+        except CircuitOpenError:
+            return None
         except Exception as e:
             logger.warning(f"LLM sync_generate_chat failed: {e}")
             return None
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+"""
+Пакетная отправка реплик агентов в LLM.
+
+Когда за тик говорят сразу несколько агентов, каждый generate_message —
+отдельный запрос к API. MessageBatcher собирает такие запросы в течение
+короткого окна (LLM_BATCH_WINDOW_SECONDS) и отправляет их одним промптом,
+в котором модель должна вернуть JSON-массив ответов в том же порядке.
+Ответы раздаются ожидающим вызовам; если массив не разобрался или его длина
+не совпала с числом запросов, каждый запрос отправляется отдельно.
+
+Токены пакетного запроса делятся между вызовами: промпт — пропорционально
+размеру диалога, ответ — длине доставшейся реплики. Одиночные запросы
+(откат) выполняются в контексте своего вызова и учитываются как обычно.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from backend.services.llm_usage import (
+    CallUsage,
+    current_usage,
+    estimate_completion_tokens,
+    estimate_prompt_tokens,
+    split_tokens,
+    track_usage,
+)
+
+logger = logging.getLogger(__name__)
+
+Messages = List[Dict[str, str]]
+
+BATCH_INSTRUCTIONS = """Тебе передано несколько независимых диалогов, каждый начинается с заголовка "### Диалог N".
+Для КАЖДОГО диалога напиши ровно одну реплику по правилам выше, учитывая только его собственный контекст.
+Верни ТОЛЬКО JSON-массив строк без пояснений и разметки: первая строка — ответ на диалог 1, вторая — на диалог 2 и т.д.
+Количество элементов массива должно совпадать с количеством диалогов."""
+
+_ROLE_LABELS = {"system": "Контекст", "user": "Собеседник", "assistant": "Ты"}
+
+
+@dataclass
+class _Pending:
+    messages: Messages
+    timeout: Optional[float]
+    future: asyncio.Future
+    # Контекст вызова: учёт токенов и метки агента для отката на одиночные запросы
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+
+    @property
+    def usage(self) -> Optional[CallUsage]:
+        return self.context.run(current_usage)
+
+
+def _render_batch(items: List[_Pending]) -> Messages:
+    """Собрать один промпт из нескольких запросов с общим системным сообщением."""
+    first = items[0].messages[0] if items[0].messages else None
+    shared = (
+        first
+        if first is not None and first.get("role") == "system" and all(p.messages[:1] == [first] for p in items)
+        else None
+    )
+    blocks: List[str] = []
+    for number, item in enumerate(items, start=1):
+        lines = [f"### Диалог {number}"]
+        for msg in item.messages[1:] if shared else item.messages:
+            label = _ROLE_LABELS.get(msg.get("role", ""), msg.get("role", ""))
+            lines.append(f"{label}: {msg.get('content', '')}")
+        blocks.append("\n".join(lines))
+
+    system = f"{shared['content']}\n\n{BATCH_INSTRUCTIONS}" if shared else BATCH_INSTRUCTIONS
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": "\n\n".join(blocks)},
+    ]
+
+
+def parse_batch_reply(text: str, expected: int) -> Optional[List[str]]:
+    """Достать JSON-массив из ответа модели; None, если формат не тот."""
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end <= start:
+        return None
+    try:
+        replies = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(replies, list) or len(replies) != expected:
+        return None
+    if not all(isinstance(r, str) and r.strip() for r in replies):
+        return None
+    return [r.strip() for r in replies]
+
+
+class MessageBatcher:
+    """
+    Окно сбора запросов и раздача ответов пакетного вызова.
+    """
+
+    def __init__(
+            self,
+            send: Callable[[Messages, Optional[float]], Awaitable[str]],
+            window_seconds: float = 0.05,
+            max_size: int = 8,
+            send_batch: Optional[Callable[[Messages, Optional[float]], Awaitable[str]]] = None,
+    ) -> None:
+        # send — одиночный запрос к API (без кэша), его же используем для отката;
+        # send_batch — пакетный запрос (по умолчанию тот же send)
+        self._send = send
+        self._send_batch = send_batch or send
+        self.window_seconds = window_seconds
+        self.max_size = max(1, max_size)
+        self._pending: List[_Pending] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.batched_requests = 0
+        self.fallbacks = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_seconds > 0 and self.max_size > 1
+
+    async def submit(self, messages: Messages, timeout: Optional[float] = None) -> str:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(_Pending(messages, timeout, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_seconds, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        items = [p for p in self._pending if not p.future.done()]
+        self._pending = []
+        if not items:
+            return
+        # Пустой контекст: пакет общий, его usage делится между вызовами в _dispatch,
+        # а не достаётся целиком тому, кто запустил сброс
+        task = asyncio.get_running_loop().create_task(self._dispatch(items), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, items: List[_Pending]) -> None:
+        if len(items) == 1:
+            await self._send_each(items)
+            return
+
+        timeouts = [p.timeout for p in items]
+        timeout = None if None in timeouts else max(timeouts)
+        with track_usage() as usage:
+            try:
+                text = await self._send_batch(_render_batch(items), timeout)
+            except Exception as exc:
+                _share_usage(items, usage, None)
+                for item in items:
+                    _resolve(item.future, error=exc)
+                return
+
+        replies = parse_batch_reply(text, len(items))
+        # Неразобранный пакет тоже оплачен
+        _share_usage(items, usage, replies)
+        if replies is None:
+            self.fallbacks += 1
+            logger.info("Пакетный ответ LLM не разобран, отправляем %s запросов по одному", len(items))
+            await self._send_each(items)
+            return
+
+        self.batches += 1
+        self.batched_requests += len(items)
+        for item, reply in zip(items, replies):
+            _resolve(item.future, result=reply)
+
+    async def _send_each(self, items: List[_Pending]) -> None:
+        async def one(item: _Pending) -> None:
+            try:
+                _resolve(item.future, result=await self._send(item.messages, item.timeout))
+            except Exception as exc:
+                _resolve(item.future, error=exc)
+
+        loop = asyncio.get_running_loop()
+        # Каждый запрос — в контексте своего вызова: его usage попадёт в учёт этого вызова
+        await asyncio.gather(*(loop.create_task(one(item), context=item.context) for item in items))
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "batched_requests": self.batched_requests,
+            "fallbacks": self.fallbacks,
+        }
+
+
+def _share_usage(items: List[_Pending], usage: CallUsage, replies: Optional[List[str]]) -> None:
+    """Раздать вызовам их доли usage пакетного запроса."""
+    if usage.prompt_tokens is None and usage.completion_tokens is None:
+        return
+    prompts = split_tokens(usage.prompt_tokens or 0, [estimate_prompt_tokens(p.messages) for p in items])
+    completions = split_tokens(
+        usage.completion_tokens or 0,
+        [estimate_completion_tokens(r) for r in replies] if replies is not None else [1] * len(items),
+    )
+    for item, prompt, completion in zip(items, prompts, completions):
+        holder = item.usage
+        if holder is not None:
+            holder.add_tokens(prompt, completion)
+
+
+def _resolve(future: asyncio.Future, result: Optional[str] = None, error: Optional[BaseException] = None) -> None:
+    # Вызывающий мог уже отменить ожидание (таймаут шага)
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
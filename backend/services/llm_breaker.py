@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+"""
+Автомат защиты (circuit breaker) для запросов к LLM.
+
+Когда провайдер лежит или отвечает очень медленно, каждый шаг агента ждал
+полный таймаут с повторами и только потом брал запасной текст. Автомат
+считает исходы последних LLM_BREAKER_WINDOW запросов (ошибка или ответ
+дольше LLM_BREAKER_SLOW_SECONDS — неудача) и переключается между
+состояниями:
+
+- closed    — запросы идут как обычно;
+- open      — доля неудач превысила LLM_BREAKER_FAILURE_RATE: запросы сразу
+  отклоняются, вызывающий код берёт запасной текст;
+- half_open — через LLM_BREAKER_COOLDOWN_SECONDS пропускается пробный запрос
+  раз в LLM_BREAKER_PROBE_SECONDS; удачная проба закрывает автомат,
+  неудачная снова открывает.
+
+Исходы записывают и основной цикл, и цикл моста sync_generate_chat в другом
+потоке, поэтому переходы состояний выполняются под threading.RLock.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Запрос отклонён: автомат открыт."""
+
+
+class CircuitBreaker:
+    """
+    Состояние автомата по скользящему окну исходов запросов.
+    """
+
+    def __init__(
+            self,
+            window: int = 20,
+            min_calls: int = 5,
+            failure_rate: float = 0.5,
+            slow_seconds: float = 8.0,
+            cooldown_seconds: float = 30.0,
+            probe_seconds: float = 5.0,
+            clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.min_calls = max(1, min_calls)
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.probe_seconds = probe_seconds
+        self._clock = clock
+        self._outcomes: Deque[bool] = deque(maxlen=max(self.min_calls, window))
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._last_probe: Optional[float] = None
+        self.opened = 0
+        self.rejected = 0
+        # Реентерабельный: record_success и record_failure обращаются к state под тем же замком
+        self._lock = threading.RLock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and self._clock() - self._opened_at >= self.cooldown_seconds:
+                self._state = HALF_OPEN
+                self._last_probe = None
+            return self._state
+
+    @property
+    def current_failure_rate(self) -> float:
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return self._outcomes.count(False) / len(self._outcomes)
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос сейчас."""
+        with self._lock:
+            state = self.state
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN:
+                now = self._clock()
+                if self._last_probe is None or now - self._last_probe >= self.probe_seconds:
+                    self._last_probe = now
+                    return True
+            self.rejected += 1
+            return False
+
+    def check(self) -> None:
+        if not self.allow():
+            raise CircuitOpenError(f"LLM недоступен (автомат {self._state})")
+
+    def record_success(self, latency: float) -> None:
+        if latency > self.slow_seconds:
+            self.record_failure()
+            return
+        with self._lock:
+            if self.state == HALF_OPEN:
+                # Провайдер ожил: начинаем счёт заново
+                self._state = CLOSED
+                self._outcomes.clear()
+            self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            state = self.state
+            self._outcomes.append(False)
+            if state == HALF_OPEN or (
+                    state == CLOSED
+                    and len(self._outcomes) >= self.min_calls
+                    and self.current_failure_rate >= self.failure_rate
+            ):
+                self._open()
+
+    def _open(self) -> None:
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self.opened += 1
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failure_rate": round(self.current_failure_rate, 3),
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
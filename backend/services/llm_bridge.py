@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+"""
+Фоновый цикл событий для синхронных вызовов LLM.
+
+sync_generate_chat раньше делал asyncio.run на каждый вызов: новый цикл,
+новые HTTP-соединения и их закрытие, а из потока с уже запущенным циклом —
+ошибка. LoopBridge держит один долгоживущий цикл в отдельном потоке-демоне;
+синхронный код отправляет в него корутину и ждёт concurrent.futures.Future.
+
+Клиент провайдера с пулом соединений создаётся для этого цикла один раз
+(пул httpx нельзя делить между циклами). Одновременно в цикле выполняется
+не больше LLM_SYNC_MAX_CONCURRENCY вызовов, остальные вызывающие потоки ждут
+свободного места у себя, не нагружая цикл.
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Coroutine, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Сколько ждать закрытия клиента и остановки потока при выключении
+CLOSE_TIMEOUT_SECONDS = 5.0
+
+
+class LoopBridge:
+    """
+    Поток с циклом событий и ограничением одновременных синхронных вызовов.
+    """
+
+    def __init__(self, max_concurrency: int = 4, name: str = "llm-bridge") -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.name = name
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        # Клиент провайдера для цикла моста и провайдер, для которого он создан
+        self._client: Any = None
+        self._client_source: Any = None
+        self.active = 0
+        self.calls = 0
+        self.timeouts = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def in_loop(self) -> bool:
+        """Вызывающий код выполняется в цикле моста."""
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is not None and self.running:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def serve() -> None:
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            thread = threading.Thread(target=serve, name=self.name, daemon=True)
+            thread.start()
+            ready.wait()
+            self._loop, self._thread = loop, thread
+            return loop
+
+    def client_for(self, source: Any, factory: Callable[[int], Any]) -> Any:
+        """
+        Клиент для цикла моста: создаётся factory один раз на источник (провайдер)
+        с пулом не больше max_concurrency соединений.
+        """
+        if self._client_source is not source:
+            self._client = factory(self.max_concurrency)
+            self._client_source = source
+        return self._client
+
+    def run(self, coro: Coroutine[Any, Any, T], timeout: Optional[float] = None) -> T:
+        """
+        Выполнить корутину в цикле моста и дождаться результата в текущем потоке.
+        timeout — сколько ждать, не считая очереди за свободным местом; по
+        истечении корутина отменяется и поднимается TimeoutError.
+        """
+        if self.in_loop():
+            coro.close()
+            # Ожидание из самого цикла моста заблокировало бы его навсегда
+            raise RuntimeError("LoopBridge.run вызван из цикла моста; используйте await")
+        loop = self._ensure_loop()
+        self._slots.acquire()
+        try:
+            self._count(active=1, calls=1)
+            # Контекст вызывающего потока (метки учёта расхода и т.п.) переезжает в цикл моста
+            future = asyncio.run_coroutine_threadsafe(_in_context(coro, contextvars.copy_context()), loop)
+            try:
+                return future.result(timeout)
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                self._count(timeouts=1)
+                raise TimeoutError(f"Вызов в {self.name} не завершился за {timeout} с") from None
+        finally:
+            self._count(active=-1)
+            self._slots.release()
+
+    def _count(self, active: int = 0, calls: int = 0, timeouts: int = 0) -> None:
+        # Счётчики меняют разные потоки
+        with self._stats_lock:
+            self.active += active
+            self.calls += calls
+            self.timeouts += timeouts
+
+    def close(self) -> None:
+        """Закрыть клиент моста и остановить поток."""
+        with self._lock:
+            loop, thread, client, source = self._loop, self._thread, self._client, self._client_source
+            self._loop = self._thread = self._client = self._client_source = None
+        if loop is None or thread is None:
+            return
+        # Клиент, общий с основным циклом (заглушка), закрывать не наше дело
+        owned = client is not getattr(source, "client", None)
+        closer: Optional[Callable[[], Awaitable[None]]] = getattr(client, "close", None)
+        if owned and closer is not None and asyncio.iscoroutinefunction(closer):
+            try:
+                asyncio.run_coroutine_threadsafe(closer(), loop).result(CLOSE_TIMEOUT_SECONDS)
+            except Exception as exc:  # pragma: no cover - защитный лог
+                logger.warning("Не удалось закрыть клиент %s: %s", self.name, exc)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(CLOSE_TIMEOUT_SECONDS)
+        if not thread.is_alive():
+            loop.close()
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+        }
+
+
+async def _in_context(coro: Coroutine[Any, Any, T], context: contextvars.Context) -> T:
+    # Отмена внешней задачи (таймаут run) отменяет и внутреннюю
+    return await asyncio.get_running_loop().create_task(coro, context=context)
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+"""
+Кэш ответов LLM на уровне промпта.
+
+Ключ — SHA-256 от модели и нормализованного списка сообщений (роль + текст
+со схлопнутыми пробелами), поэтому одинаковые по смыслу промпты попадают в
+одну запись. LLMClient кэширует только выбор действия агента: реплики в
+разговорах и чатах из кэша повторялись бы дословно. Первый уровень —
+LRU в памяти с TTL; второй, необязательный, — SQLite-файл на диске
+(LLM_CACHE_DIR), который переживает перезапуск процесса.
+
+Кэшем пользуются и основной цикл, и цикл моста sync_generate_chat в другом
+потоке, поэтому LRU и счётчики меняются под threading.Lock.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(messages: List[Dict[str, str]]) -> List[Tuple[str, str]]:
+    return [
+        (msg.get("role", ""), _WHITESPACE.sub(" ", str(msg.get("content", ""))).strip())
+        for msg in messages
+    ]
+
+
+def cache_key(model: Optional[str], messages: List[Dict[str, str]]) -> str:
+    payload = json.dumps([model or "", _normalize(messages)], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _DiskTier:
+    """Простое хранилище ключ-значение в SQLite; вызывается из потока через asyncio.to_thread."""
+
+    def __init__(self, directory: str) -> None:
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path / "llm_cache.sqlite3", check_same_thread=False)
+        # Соединение общее для потоков to_thread, обращения к нему сериализуем
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, key: str, value: str, expires_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            self._conn.commit()
+
+    def purge(self, now: float) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+
+
+class ResponseCache:
+    """
+    LRU-кэш ответов с TTL и необязательным дисковым уровнем.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0, disk_dir: Optional[str] = None) -> None:
+        self.max_entries = max(0, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk: Optional[_DiskTier] = None
+        if disk_dir:
+            try:
+                self._disk = _DiskTier(disk_dir)
+                self._disk.purge(time.time())
+            except (OSError, sqlite3.Error) as exc:
+                logger.warning("Дисковый кэш LLM недоступен (%s): %s", disk_dir, exc)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or self._disk is not None
+
+    def key(self, model: Optional[str], messages: List[Dict[str, str]]) -> str:
+        return cache_key(model, messages)
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        if self._disk is not None:
+            try:
+                found = await asyncio.to_thread(self._disk.get, key, now)
+            except sqlite3.Error as exc:
+                logger.warning("Ошибка чтения дискового кэша LLM: %s", exc)
+                found = None
+            if found is not None:
+                value, expires_at = found
+                self._remember(key, value, expires_at)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, value, expires_at)
+        if self._disk is not None:
+            try:
+                await asyncio.to_thread(self._disk.set, key, value, expires_at)
+            except sqlite3.Error as exc:
+                logger.warning("Ошибка записи дискового кэша LLM: %s", exc)
+
+    def _remember(self, key: str, value: str, expires_at: float) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+"""
+Сборка контекста промпта в пределах бюджета токенов.
+
+История переписки, воспоминания и описание персонажа делят общий бюджет
+(LLM_CONTEXT_BUDGET_TOKENS): персонажу и воспоминаниям отведены доли, история
+получает остаток и берётся с конца — самые свежие реплики остаются дословно.
+Реплики, которые в бюджет не поместились, не теряются: они сворачиваются в
+краткое скользящее резюме разговора (по паре агентов или по чату), которое
+хранится между вызовами и дополняется инкрементально — каждая реплика
+сворачивается один раз, а резюме само ограничено LLM_SUMMARY_TOKENS и
+забывает самые старые строки.
+
+Токены считаются той же грубой оценкой, что и в ограничителе запросов.
+"""
+
+import hashlib
+import math
+import re
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+from backend.services.llm_limiter import CHARS_PER_TOKEN
+
+# Доли бюджета: описание персонажа и воспоминания; остальное — резюме и история
+PERSONA_SHARE = 0.2
+MEMORIES_SHARE = 0.25
+# Сколько символов реплики остаётся в резюме
+SUMMARY_LINE_CHARS = 120
+# Сколько уже свёрнутых реплик помнить, чтобы не свернуть повторно
+FOLDED_MEMORY = 256
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s")
+
+
+def count_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def truncate_tokens(text: str, tokens: int) -> str:
+    """Обрезать текст до tokens токенов по границе слова."""
+    limit = max(0, tokens) * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    if limit <= 1:
+        return ""
+    cut = text[:limit - 1]
+    space = cut.rfind(" ")
+    if space > limit // 2:
+        cut = cut[:space]
+    return cut.rstrip() + "…"
+
+
+def conversation_key(*parts: object) -> str:
+    """Ключ разговора: пара агентов (в любом порядке) или чат."""
+    if len(parts) == 2:
+        return "pair:" + ":".join(sorted(str(p) for p in parts))
+    return ":".join(str(p) for p in parts)
+
+
+def _compact(text: str) -> str:
+    first = _SENTENCE_END.split(text.strip(), maxsplit=1)[0]
+    if len(first) > SUMMARY_LINE_CHARS:
+        first = first[:SUMMARY_LINE_CHARS - 1].rstrip() + "…"
+    return first
+
+
+class RollingSummary:
+    """
+    Резюме одного разговора: по строке на свёрнутую реплику, не больше max_tokens.
+    """
+
+    def __init__(self, max_tokens: int) -> None:
+        self.max_tokens = max_tokens
+        self.lines: Deque[str] = deque()
+        self._tokens = 0
+        self._folded: "OrderedDict[str, None]" = OrderedDict()
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.lines)
+
+    @property
+    def tokens(self) -> int:
+        return self._tokens
+
+    def fold(self, turns: List[Dict[str, str]]) -> int:
+        """Добавить реплики, вытесненные из истории. Возвращает число новых строк."""
+        added = 0
+        for turn in turns:
+            text = str(turn.get("text", ""))
+            speaker = str(turn.get("from", ""))
+            fingerprint = hashlib.sha1(f"{speaker}\0{text}".encode("utf-8")).hexdigest()
+            if fingerprint in self._folded or not text.strip():
+                continue
+            self._folded[fingerprint] = None
+            if len(self._folded) > FOLDED_MEMORY:
+                self._folded.popitem(last=False)
+            line = f"{speaker}: {_compact(text)}" if speaker else _compact(text)
+            self.lines.append(line)
+            self._tokens += count_tokens(line) + 1
+            added += 1
+        while self.lines and self._tokens > self.max_tokens:
+            self._tokens -= count_tokens(self.lines.popleft()) + 1
+        return added
+
+
+@dataclass
+class PromptContext:
+    """Части промпта, уложенные в бюджет."""
+    history: List[Dict[str, str]] = field(default_factory=list)
+    summary: str = ""
+    memories: List[str] = field(default_factory=list)
+    persona: str = ""
+    tokens: int = 0
+
+
+class ContextBuilder:
+    """
+    Укладывает историю, воспоминания и персонажа в бюджет и ведёт резюме разговоров.
+    """
+
+    def __init__(self, budget_tokens: int = 800, summary_tokens: int = 150, max_conversations: int = 4096) -> None:
+        self.budget_tokens = max(0, budget_tokens)
+        self.summary_tokens = max(0, summary_tokens)
+        self.max_conversations = max(1, max_conversations)
+        self._summaries: "OrderedDict[str, RollingSummary]" = OrderedDict()
+        self.folded_turns = 0
+        self.trimmed = 0
+
+    def summary_of(self, key: str) -> Optional[RollingSummary]:
+        return self._summaries.get(key)
+
+    def _summary(self, key: str) -> RollingSummary:
+        summary = self._summaries.get(key)
+        if summary is None:
+            summary = RollingSummary(self.summary_tokens)
+            self._summaries[key] = summary
+            if len(self._summaries) > self.max_conversations:
+                self._summaries.popitem(last=False)
+        self._summaries.move_to_end(key)
+        return summary
+
+    def build(
+            self,
+            history: List[Dict[str, str]],
+            memories: List[str],
+            persona: str = "",
+            key: Optional[str] = None,
+    ) -> PromptContext:
+        """
+        history — реплики {"from", "text"} от старых к новым, memories — от важных к менее важным.
+        С key вытесненные реплики сворачиваются в резюме этого разговора.
+        """
+        budget = self.budget_tokens
+        persona = truncate_tokens((persona or "").strip(), int(budget * PERSONA_SHARE))
+        used = count_tokens(persona)
+
+        kept_memories: List[str] = []
+        memory_budget = int(budget * MEMORIES_SHARE)
+        for memory in memories or []:
+            cost = count_tokens(memory) + 1
+            if cost > memory_budget:
+                break
+            kept_memories.append(memory)
+            memory_budget -= cost
+            used += cost
+
+        keyed = key is not None and self.summary_tokens > 0
+        # Место под резюме резервируем заранее: свёрнутые сейчас реплики тоже в него попадут
+        reserved = min(self.summary_tokens, max(0, budget - used)) if keyed else 0
+        history_budget = max(0, budget - used - reserved)
+
+        history = list(history or [])
+        kept: List[Dict[str, str]] = []
+        cut = len(history)
+        for turn in reversed(history):
+            cost = count_tokens(str(turn.get("text", ""))) + 2
+            if cost > history_budget:
+                break
+            kept.append(turn)
+            history_budget -= cost
+            used += cost
+            cut -= 1
+        kept.reverse()
+
+        overflow = history[:cut]
+        if overflow:
+            self.trimmed += len(overflow)
+        summary = None
+        if keyed and (overflow or key in self._summaries):
+            summary = self._summary(key)
+            if overflow:
+                self.folded_turns += summary.fold(overflow)
+
+        summary_text = summary.text if summary is not None else ""
+        return PromptContext(
+            history=kept,
+            summary=summary_text,
+            memories=kept_memories,
+            persona=persona,
+            tokens=used + count_tokens(summary_text),
+        )
+
+    def stats(self) -> dict:
+        return {
+            "budget_tokens": self.budget_tokens,
+            "conversations": len(self._summaries),
+            "folded_turns": self.folded_turns,
+            "trimmed_turns": self.trimmed,
+        }
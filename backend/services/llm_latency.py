@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+"""
+Гистограммы задержек LLM и адаптивные таймауты.
+
+Для каждой модели (отдельно — для пакетных и потоковых запросов) хранится
+скользящее окно последних задержек. Пока замеров мало, действует
+фиксированный LLM_TIMEOUT_SECONDS; дальше таймаут — p95 окна, умноженный на
+LLM_TIMEOUT_P95_FACTOR и ограниченный [LLM_TIMEOUT_MIN_SECONDS,
+LLM_TIMEOUT_MAX_SECONDS]. Запрос, превысивший p90, может быть продублирован
+(hedging): побеждает тот, кто ответит первым, второй отменяется.
+
+Замеры пишет и цикл моста sync_generate_chat в другом потоке, поэтому окна
+читаются и дополняются под threading.Lock.
+"""
+
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional
+
+# Сколько замеров нужно, чтобы доверять перцентилям
+MIN_SAMPLES = 20
+
+
+def _percentile(ordered: list, q: float) -> float:
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LatencyTracker:
+    """
+    Скользящие окна задержек по ключу (модель или модель:вид запроса).
+    """
+
+    def __init__(
+            self,
+            window: int = 200,
+            default_timeout: float = 4.0,
+            min_timeout: float = 1.0,
+            max_timeout: float = 15.0,
+            p95_factor: float = 1.5,
+    ) -> None:
+        self.window = max(MIN_SAMPLES, window)
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max(min_timeout, max_timeout)
+        self.p95_factor = p95_factor
+        self._samples: Dict[str, Deque[float]] = {}
+        self.timeouts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def observe_timeout(self, key: str, seconds: float) -> None:
+        """Запрос не уложился в таймаут: учитываем его как задержку не меньше таймаута."""
+        with self._lock:
+            self.timeouts[key] = self.timeouts.get(key, 0) + 1
+        self.observe(key, seconds)
+
+    def _sorted(self, key: str) -> list:
+        with self._lock:
+            return sorted(self._samples.get(key, ()))
+
+    def percentile(self, key: str, q: float) -> Optional[float]:
+        ordered = self._sorted(key)
+        if len(ordered) < MIN_SAMPLES:
+            return None
+        return _percentile(ordered, q)
+
+    def timeout_for(self, key: str) -> float:
+        p95 = self.percentile(key, 95)
+        if p95 is None:
+            return self.default_timeout
+        return min(self.max_timeout, max(self.min_timeout, p95 * self.p95_factor))
+
+    def hedge_after(self, key: str) -> Optional[float]:
+        """Через сколько секунд дублировать запрос (p90); None — замеров пока мало."""
+        return self.percentile(key, 90)
+
+    def stats(self) -> dict:
+        result = {}
+        with self._lock:
+            keys = list(self._samples)
+        for key in keys:
+            ordered = self._sorted(key)
+            result[key] = {
+                "samples": len(ordered),
+                "p50": round(_percentile(ordered, 50), 3),
+                "p90": round(_percentile(ordered, 90), 3),
+                "p95": round(_percentile(ordered, 95), 3),
+                "timeout": round(self.timeout_for(key), 3),
+                "timeouts": self.timeouts.get(key, 0),
+            }
+        return result
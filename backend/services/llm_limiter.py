@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+"""
+Упреждающее ограничение запросов к LLM.
+
+Раньше клиент узнавал о лимитах провайдера только из RateLimitError и спал
+1, 2, 4 секунды, удерживая шаг симуляции. Теперь каждый запрос перед
+отправкой проходит три ограничителя:
+
+- токен-бакет запросов в минуту (LLM_REQUESTS_PER_MINUTE);
+- токен-бакет токенов в минуту (LLM_TOKENS_PER_MINUTE) — списывается оценка
+  размера промпта и ответа, после ответа оценка исправляется по usage;
+- семафор одновременных запросов (LLM_MAX_IN_FLIGHT).
+
+Бакеты работают резервированием: запрос сразу списывает токены (баланс может
+уйти в минус) и спит ровно столько, сколько нужно на пополнение, поэтому
+очередь обслуживается в порядке прихода без блокировок. Если провайдер всё же
+ответил 429, пауза выставляется всем бакетам сразу, а не одному вызову.
+
+Ограничитель общий для основного цикла и цикла моста sync_generate_chat
+(другой поток), поэтому его состояние меняется под threading.Lock; под
+замком нет ни одного await.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional
+
+# Грубая оценка: кириллица — около трёх символов на токен, плюс служебные токены сообщения
+CHARS_PER_TOKEN = 3
+TOKENS_PER_MESSAGE = 4
+# Запас на ответ модели (реплики короткие)
+REPLY_TOKENS = 200
+
+
+def estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    chars = sum(len(str(msg.get("content", ""))) for msg in messages)
+    return chars // CHARS_PER_TOKEN + TOKENS_PER_MESSAGE * len(messages) + REPLY_TOKENS
+
+
+class TokenBucket:
+    """
+    Бакет с пополнением per_minute / 60 в секунду и ёмкостью на минуту вперёд.
+    per_minute <= 0 — без ограничения.
+    """
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.per_minute = per_minute
+        self.capacity = max(1.0, float(per_minute))
+        self._rate = per_minute / 60.0
+        self._clock = clock
+        self._tokens = self.capacity
+        self._stamp = clock()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.per_minute > 0
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self._rate)
+        self._stamp = now
+
+    def reserve(self, amount: float) -> float:
+        """Списать amount и вернуть, сколько секунд ждать, пока баланс не станет неотрицательным."""
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            self._refill()
+            # Запрос больше ёмкости иначе не прошёл бы никогда
+            self._tokens -= min(amount, self.capacity)
+            return 0.0 if self._tokens >= 0 else -self._tokens / self._rate
+
+    def refund(self, amount: float) -> None:
+        """Вернуть неиспользованное (отмена) или списать недостающее (отрицательное amount)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def pause(self, seconds: float) -> None:
+        """Провайдер вернул 429: ближайшие seconds секунд бакет пуст для всех."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self._rate)
+
+
+class _InFlightGate:
+    """
+    Семафор одновременных запросов. В отличие от asyncio.Semaphore не привязан
+    к одному циклу событий: синхронный путь клиента работает в своём цикле.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._lock = threading.Lock()
+
+    async def acquire(self) -> None:
+        with self._lock:
+            if self.limit <= 0 or (self.active < self.limit and not self._waiters):
+                self.active += 1
+                return
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = future.done() and not future.cancelled()
+                if not granted:
+                    try:
+                        self._waiters.remove(future)
+                    except ValueError:
+                        pass
+            if granted:
+                # Слот уже передан нам — отдаём следующему
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            if not self._waiters:
+                self.active -= 1
+                return
+            # Слот переходит ожидающему, счётчик активных не меняется
+            future = self._waiters.popleft()
+        future.get_loop().call_soon_threadsafe(self._grant, future)
+
+    def _grant(self, future: asyncio.Future) -> None:
+        if future.done():
+            self.release()
+        else:
+            future.set_result(None)
+
+
+class LLMRateLimiter:
+    """
+    Ограничитель темпа запросов к LLM со статистикой очереди.
+    """
+
+    def __init__(
+            self,
+            requests_per_minute: float = 0,
+            tokens_per_minute: float = 0,
+            max_in_flight: int = 0,
+            clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._clock = clock
+        self.requests = TokenBucket(requests_per_minute, clock)
+        self.tokens = TokenBucket(tokens_per_minute, clock)
+        self._gate = _InFlightGate(max_in_flight)
+        # Запросы, ждущие бакета или слота
+        self.queued = 0
+        self.admitted = 0
+        self.delayed = 0
+        self.wait_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+        self.last_wait_seconds = 0.0
+        # Счётчики меняют основной цикл и цикл моста
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        return self._gate.active
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int) -> AsyncIterator["_Lease"]:
+        """
+        Дождаться права на запрос. Внутри блока можно сообщить фактический
+        расход токенов через lease.used(...).
+        """
+        started = self._clock()
+        with self._lock:
+            self.queued += 1
+        try:
+            delay = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+            try:
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self._gate.acquire()
+            except BaseException:
+                self.requests.refund(1)
+                self.tokens.refund(estimated_tokens)
+                raise
+        finally:
+            with self._lock:
+                self.queued -= 1
+
+        waited = self._clock() - started
+        with self._lock:
+            self.admitted += 1
+            self.last_wait_seconds = waited
+            self.wait_seconds_total += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            if waited > 0.001:
+                self.delayed += 1
+
+        lease = _Lease(self.tokens, estimated_tokens)
+        try:
+            yield lease
+        finally:
+            self._gate.release()
+
+    def pause(self, seconds: float) -> None:
+        self.requests.pause(seconds)
+        self.tokens.pause(seconds)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queued,
+            "in_flight": self.in_flight,
+            "max_in_flight": self._gate.limit,
+            "requests_per_minute": self.requests.per_minute,
+            "tokens_per_minute": self.tokens.per_minute,
+            "admitted": self.admitted,
+            "delayed": self.delayed,
+            "avg_wait_seconds": round(self.wait_seconds_total / self.admitted, 3) if self.admitted else 0.0,
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+            "last_wait_seconds": round(self.last_wait_seconds, 3),
+        }
+
+
+class _Lease:
+    def __init__(self, bucket: TokenBucket, estimated: int) -> None:
+        self._bucket = bucket
+        self._estimated = estimated
+
+    def used(self, tokens: Optional[int]) -> None:
+        """Исправить оценку по фактическому usage.total_tokens."""
+        if tokens is not None:
+            self._bucket.refund(self._estimated - tokens)
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+"""
+Провайдеры LLM.
+
+LLMClient разговаривает с моделью через интерфейс chat.completions.create
+в формате OpenAI; провайдер решает, кто стоит за этим интерфейсом
+(LLM_PROVIDER):
+
+- openai     — API OpenAI (нужен OPENAI_API_KEY);
+- compatible — любой OpenAI-совместимый сервер по LLM_BASE_URL, например
+  локальный llama.cpp или vLLM (ключ необязателен);
+- stub       — детерминированная заглушка в процессе с задержкой
+  LLM_STUB_LATENCY_MS ± LLM_STUB_JITTER_MS, для нагрузочных прогонов
+  SimulationEngine без сети;
+- off        — LLM выключен, движок использует запасные тексты;
+- auto       — openai, если задан OPENAI_API_KEY, иначе off (прежнее поведение).
+"""
+
+import asyncio
+import json
+import logging
+import random
+import re
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ("auto", "openai", "compatible", "stub", "off")
+
+_DIALOG_HEADER = re.compile(r"^### Диалог \d+", re.MULTILINE)
+# Промпт сцены LLMClient.generate_scene: участники строками "- Имя (...)" и число реплик
+_SCENE_HEADER = re.compile(r"^### Сцена", re.MULTILINE)
+_SCENE_SPEAKER = re.compile(r"^- (.+?) \(", re.MULTILINE)
+_SCENE_TURNS = re.compile(r"Реплик: (\d+)")
+
+
+class LLMProvider:
+    """
+    Провайдер: имя, модель и клиент с интерфейсом chat.completions.create.
+    """
+
+    name = "off"
+
+    def __init__(self, model: Optional[str] = None, client: Any = None) -> None:
+        self.model = model
+        self.client = client
+
+    @property
+    def enabled(self) -> bool:
+        return self.client is not None
+
+    def new_client(self, max_connections: int) -> Any:
+        """
+        Клиент для другого цикла событий. Клиенту без сетевого пула (заглушка)
+        всё равно, в каком цикле его вызывают, — отдаём тот же.
+        """
+        return self.client
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    def __init__(self, api_key: str, model: str, base_url: Optional[str] = None) -> None:
+        from openai import AsyncOpenAI
+
+        self._api_key = api_key
+        self._base_url = base_url
+        super().__init__(model, AsyncOpenAI(api_key=api_key, base_url=base_url))
+
+    def new_client(self, max_connections: int) -> Any:
+        # Пул соединений httpx привязан к циклу, в котором открыт: каждому циклу — свой
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        return AsyncOpenAI(
+            api_key=self._api_key,
+            base_url=self._base_url,
+            http_client=DefaultAsyncHttpxClient(limits=limits),
+        )
+
+
+class CompatibleProvider(OpenAIProvider):
+    """OpenAI-совместимый сервер (llama.cpp, vLLM и т.п.) по произвольному base URL."""
+
+    name = "compatible"
+
+    def __init__(self, base_url: str, model: str, api_key: Optional[str] = None) -> None:
+        # Локальные серверы обычно не проверяют ключ, но клиент openai требует непустой
+        super().__init__(api_key or "local", model, base_url=base_url)
+
+
+class _StubCompletions:
+    """Замена chat.completions: ответ по счётчику seed-генератора после задержки."""
+
+    def __init__(self, latency: float, jitter: float, rng: random.Random) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = rng
+        self.calls = 0
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)) if self.jitter else self.latency
+
+    def _reply(self, messages: List[dict]) -> str:
+        prompt = str(messages[-1].get("content", "")) if messages else ""
+        if _SCENE_HEADER.search(prompt):
+            # Сцена: реплики участников по кругу, начиная с первого
+            speakers = _SCENE_SPEAKER.findall(prompt) or ["?"]
+            found = _SCENE_TURNS.search(prompt)
+            turns = int(found.group(1)) if found else len(speakers)
+            return json.dumps(
+                [
+                    {"speaker": speakers[i % len(speakers)], "text": f"Тестовая реплика #{self.rng.randint(1, 1000)}"}
+                    for i in range(turns)
+                ],
+                ensure_ascii=False,
+            )
+        dialogs = len(_DIALOG_HEADER.findall(prompt))
+        if dialogs:
+            # Пакетный промпт LLMClient: отвечаем JSON-массивом по числу диалогов
+            return json.dumps(
+                [f"Тестовая реплика #{self.rng.randint(1, 1000)}" for _ in range(dialogs)], ensure_ascii=False
+            )
+        return f"Тестовая реплика #{self.rng.randint(1, 1000)}"
+
+    async def create(self, model: str, messages: list, stream: bool = False, **kwargs):
+        self.calls += 1
+        delay = self._delay()
+        text = self._reply(messages)
+        if stream:
+            return self._stream(text, delay)
+        await asyncio.sleep(delay)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+    async def _stream(self, text: str, delay: float) -> AsyncIterator[Any]:
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(delay / len(words))
+            part = word if i == 0 else f" {word}"
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))])
+
+
+class StubProvider(LLMProvider):
+    name = "stub"
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, rng: Optional[random.Random] = None) -> None:
+        self.completions = _StubCompletions(latency, jitter, rng or random.Random())
+        super().__init__("stub", SimpleNamespace(chat=SimpleNamespace(completions=self.completions)))
+
+
+def make_provider(settings: Any) -> LLMProvider:
+    """Провайдер по настройкам; при ошибке конфигурации LLM выключается с предупреждением."""
+    kind = (settings.LLM_PROVIDER or "auto").lower()
+    if kind not in PROVIDERS:
+        logger.warning("Неизвестный LLM_PROVIDER=%s, LLM выключен", kind)
+        return LLMProvider()
+    if kind == "auto":
+        kind = "openai" if settings.OPENAI_API_KEY else "off"
+
+    if kind == "openai":
+        if not settings.OPENAI_API_KEY:
+            logger.warning("LLM_PROVIDER=openai, но OPENAI_API_KEY не задан; LLM выключен")
+            return LLMProvider()
+        return OpenAIProvider(settings.OPENAI_API_KEY, settings.OPENAI_MODEL, base_url=settings.LLM_BASE_URL)
+    if kind == "compatible":
+        if not settings.LLM_BASE_URL:
+            logger.warning("LLM_PROVIDER=compatible, но LLM_BASE_URL не задан; LLM выключен")
+            return LLMProvider()
+        return CompatibleProvider(settings.LLM_BASE_URL, settings.OPENAI_MODEL, api_key=settings.OPENAI_API_KEY)
+    if kind == "stub":
+        return StubProvider(
+            latency=settings.LLM_STUB_LATENCY_MS / 1000,
+            jitter=settings.LLM_STUB_JITTER_MS / 1000,
+            rng=random.Random(settings.LLM_STUB_SEED),
+        )
+    return LLMProvider()
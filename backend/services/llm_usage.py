@@ -0,0 +1,309 @@
+from __future__ import annotations
+
+"""
+Учёт расхода LLM: токены и время по агенту, пользователю и виду вызова.
+
+LLMClient после каждого вызова (action, message, chat) записывает число
+токенов промпта и ответа и время от запроса до ответа. Агент и пользователь
+берутся из contextvar, который движок выставляет на время шага агента
+(llm_call_tags): сигнатуры generate_* не меняются, а параллельные шаги
+агентов не путают метки — у каждой задачи своя копия контекста.
+
+Счётчики копятся в памяти по часовым корзинам и при сбросе состояния мира
+дописываются в таблицу llm_usage upsert-ом (ON CONFLICT DO UPDATE со
+сложением). Usage пакетного запроса делится между его репликами. Если
+провайдер не вернул usage (поток, заглушка), токены оцениваются по длине текста.
+
+Записывают в журнал и основной цикл, и цикл моста sync_generate_chat в другом
+потоке, поэтому счётчики меняются под threading.Lock.
+"""
+
+import contextlib
+import logging
+import math
+import threading
+from contextvars import ContextVar
+from dataclasses import dataclass, fields
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.database.postgr.models import LLMUsage
+from backend.services.llm_limiter import CHARS_PER_TOKEN, TOKENS_PER_MESSAGE
+
+logger = logging.getLogger(__name__)
+
+_UPSERT_DIALECTS = {
+    "postgresql": pg_insert,
+    "sqlite": sqlite_insert,
+}
+
+GROUP_COLUMNS = {
+    "agent": LLMUsage.agent_id,
+    "user": LLMUsage.user_id,
+    "method": LLMUsage.method,
+}
+
+UsageKey = Tuple[datetime, str, str, str]
+
+
+@dataclass(frozen=True)
+class CallTags:
+    agent_id: str = ""
+    user_id: str = ""
+
+
+_call_tags: ContextVar[CallTags] = ContextVar("llm_call_tags", default=CallTags())
+
+
+@contextlib.contextmanager
+def llm_call_tags(agent_id: Optional[str] = None, user_id: Optional[str] = None) -> Iterator[None]:
+    """Пометить LLM-вызовы внутри блока агентом и пользователем."""
+    token = _call_tags.set(CallTags(str(agent_id or ""), str(user_id or "")))
+    try:
+        yield
+    finally:
+        _call_tags.reset(token)
+
+
+class CallUsage:
+    """
+    Токены одного вызова generate_*. Объект кладётся в contextvar, и попытки запроса
+    (в том числе дубли в отдельных задачах) дописывают в него usage провайдера.
+    """
+
+    def __init__(self) -> None:
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+
+    def add(self, usage: Any) -> None:
+        self.add_tokens(getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None))
+
+    def add_tokens(self, prompt: Optional[int], completion: Optional[int]) -> None:
+        if prompt is None and completion is None:
+            return
+        self.prompt_tokens = (self.prompt_tokens or 0) + (prompt or 0)
+        self.completion_tokens = (self.completion_tokens or 0) + (completion or 0)
+
+
+_call_usage: ContextVar[Optional[CallUsage]] = ContextVar("llm_call_usage", default=None)
+
+
+def current_usage() -> Optional[CallUsage]:
+    return _call_usage.get()
+
+
+@contextlib.contextmanager
+def track_usage() -> Iterator[CallUsage]:
+    usage = CallUsage()
+    token = _call_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _call_usage.reset(token)
+
+
+def split_tokens(total: int, weights: List[int]) -> List[int]:
+    """Разделить total пропорционально весам; сумма долей равна total."""
+    if not weights:
+        return []
+    if sum(weights) <= 0:
+        weights = [1] * len(weights)
+    weight_sum = sum(weights)
+    shares = [total * w // weight_sum for w in weights]
+    for i in range(total - sum(shares)):
+        shares[i % len(shares)] += 1
+    return shares
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    chars = sum(len(str(msg.get("content", ""))) for msg in messages)
+    return chars // CHARS_PER_TOKEN + TOKENS_PER_MESSAGE * len(messages)
+
+
+def estimate_completion_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+@dataclass
+class UsageTotals:
+    calls: int = 0
+    errors: int = 0
+    cached: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_ms_total: float = 0.0
+    latency_ms_max: float = 0.0
+
+    def merge(self, other: "UsageTotals") -> None:
+        self.calls += other.calls
+        self.errors += other.errors
+        self.cached += other.cached
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.latency_ms_total += other.latency_ms_total
+        self.latency_ms_max = max(self.latency_ms_max, other.latency_ms_max)
+
+    def as_dict(self) -> dict:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+
+def _bucket(now: datetime) -> datetime:
+    return now.replace(minute=0, second=0, microsecond=0)
+
+
+class UsageLedger:
+    """
+    Счётчики расхода LLM в памяти до очередного сброса в БД.
+    """
+
+    def __init__(self) -> None:
+        self._pending: Dict[UsageKey, UsageTotals] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def record(
+            self,
+            method: str,
+            seconds: float,
+            prompt_tokens: int = 0,
+            completion_tokens: int = 0,
+            cached: bool = False,
+            error: bool = False,
+    ) -> None:
+        tags = _call_tags.get()
+        key = (_bucket(datetime.now(timezone.utc)), tags.agent_id, tags.user_id, method)
+        latency_ms = seconds * 1000
+        call = UsageTotals(
+            calls=1,
+            errors=int(error),
+            cached=int(cached),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            latency_ms_total=latency_ms,
+            latency_ms_max=latency_ms,
+        )
+        with self._lock:
+            self._pending.setdefault(key, UsageTotals()).merge(call)
+
+    def pending(self) -> Dict[UsageKey, UsageTotals]:
+        """Снимок несброшенных счётчиков."""
+        with self._lock:
+            return {key: UsageTotals(**totals.as_dict()) for key, totals in self._pending.items()}
+
+    async def flush(self, session: AsyncSession) -> int:
+        """Дописать накопленное в llm_usage одной транзакцией. Возвращает число строк."""
+        with self._lock:
+            if not self._pending:
+                return 0
+            # Снимок берём синхронно: вызовы во время await попадут в следующий сброс
+            pending, self._pending = self._pending, {}
+        rows = [
+            {"bucket": bucket, "agent_id": agent_id, "user_id": user_id, "method": method, **totals.as_dict()}
+            for (bucket, agent_id, user_id, method), totals in pending.items()
+        ]
+        try:
+            await _upsert_usage(session, rows)
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            with self._lock:
+                for key, totals in pending.items():
+                    self._pending.setdefault(key, UsageTotals()).merge(totals)
+            raise
+        return len(rows)
+
+
+async def _upsert_usage(session: AsyncSession, rows: List[dict]) -> None:
+    insert_fn = _UPSERT_DIALECTS.get(session.get_bind().dialect.name)
+    if insert_fn is None:
+        logger.debug("Диалект без ON CONFLICT — учёт LLM пишется построчно")
+        for row in rows:
+            key = (row["bucket"], row["agent_id"], row["user_id"], row["method"])
+            current = await session.get(LLMUsage, key)
+            if current is None:
+                session.add(LLMUsage(**row))
+                continue
+            for name in ("calls", "errors", "cached", "prompt_tokens", "completion_tokens", "latency_ms_total"):
+                setattr(current, name, getattr(current, name) + row[name])
+            current.latency_ms_max = max(current.latency_ms_max, row["latency_ms_max"])
+        return
+
+    stmt = insert_fn(LLMUsage).values(rows)
+    table = LLMUsage.__table__.c
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[LLMUsage.bucket, LLMUsage.agent_id, LLMUsage.user_id, LLMUsage.method],
+        set_={
+            **{
+                name: table[name] + stmt.excluded[name]
+                for name in ("calls", "errors", "cached", "prompt_tokens", "completion_tokens", "latency_ms_total")
+            },
+            "latency_ms_max": func.max(table.latency_ms_max, stmt.excluded.latency_ms_max)
+            if session.get_bind().dialect.name == "sqlite"
+            else func.greatest(table.latency_ms_max, stmt.excluded.latency_ms_max),
+        },
+    )
+    await session.execute(stmt)
+
+
+async def fetch_usage(
+        session: AsyncSession,
+        user_id: str,
+        group_by: str = "agent",
+        hours: int = 24,
+        limit: int = 50,
+        ledger: Optional["UsageLedger"] = None,
+) -> List[dict]:
+    """
+    Расход пользователя за последние hours часов, сгруппированный по агенту,
+    пользователю или виду вызова; ещё не сброшенные счётчики из памяти учитываются.
+    Самые дорогие по токенам — первыми.
+    """
+    column = GROUP_COLUMNS[group_by]
+    since = _bucket(datetime.now(timezone.utc) - timedelta(hours=max(0, hours)))
+    result = await session.execute(
+        select(
+            column,
+            func.sum(LLMUsage.calls),
+            func.sum(LLMUsage.errors),
+            func.sum(LLMUsage.cached),
+            func.sum(LLMUsage.prompt_tokens),
+            func.sum(LLMUsage.completion_tokens),
+            func.sum(LLMUsage.latency_ms_total),
+            func.max(LLMUsage.latency_ms_max),
+        )
+        .where(LLMUsage.user_id == user_id, LLMUsage.bucket >= since)
+        .group_by(column)
+    )
+    groups: Dict[str, UsageTotals] = {}
+    for key, *values in result.all():
+        groups[key] = UsageTotals(*(v or 0 for v in values))
+
+    position = {"agent": 1, "user": 2, "method": 3}[group_by]
+    for usage_key, totals in (ledger.pending() if ledger is not None else {}).items():
+        bucket, _, owner, _ = usage_key
+        if owner == user_id and _as_utc(bucket) >= since:
+            groups.setdefault(usage_key[position], UsageTotals()).merge(totals)
+
+    rows = []
+    for key, totals in groups.items():
+        row = {"key": key, **totals.as_dict()}
+        row["total_tokens"] = totals.prompt_tokens + totals.completion_tokens
+        row["avg_latency_ms"] = round(totals.latency_ms_total / totals.calls, 1) if totals.calls else 0.0
+        rows.append(row)
+    rows.sort(key=lambda r: (r["total_tokens"], r["latency_ms_total"]), reverse=True)
+    return rows[:limit]
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite возвращает даты без часового пояса
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+usage_ledger = UsageLedger()
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+"""
+Двунаправленный индекс участников групповых чатов: агент -> чаты и чат -> агенты.
+
+Индекс повторяет таблицу group_chat_agents в памяти процесса, чтобы и движок
+симуляции, и роутеры получали состав чатов за O(1) без запросов к БД.
+Роутеры обновляют его инкрементально после коммита своих изменений.
+"""
+
+import uuid
+from typing import Dict, Iterable, List, Set
+
+# Пустые значения для отсутствующих ключей (не изменяются)
+_NO_CHATS: Dict[uuid.UUID, None] = {}
+_NO_MEMBERS: Dict[str, None] = {}
+
+
+class MembershipIndex:
+    """
+    Индекс членства агентов в групповых чатах.
+
+    Множества хранятся как dict с None-значениями: так сохраняется порядок
+    добавления участников, как при чтении из таблицы связей.
+    """
+
+    def __init__(self) -> None:
+        self._by_agent: Dict[str, Dict[uuid.UUID, None]] = {}
+        self._by_chat: Dict[uuid.UUID, Dict[str, None]] = {}
+
+    def clear(self) -> None:
+        self._by_agent.clear()
+        self._by_chat.clear()
+
+    # ----- Чтение -----
+
+    def chats_of(self, agent_id: str) -> List[uuid.UUID]:
+        return list(self._by_agent.get(str(agent_id), _NO_CHATS))
+
+    def members_of(self, chat_id: uuid.UUID) -> List[str]:
+        return list(self._by_chat.get(chat_id, _NO_MEMBERS))
+
+    def is_member(self, chat_id: uuid.UUID, agent_id: str) -> bool:
+        return str(agent_id) in self._by_chat.get(chat_id, _NO_MEMBERS)
+
+    def member_count(self, chat_id: uuid.UUID) -> int:
+        return len(self._by_chat.get(chat_id, _NO_MEMBERS))
+
+    def shared_chats(self, agent1_id: str, agent2_id: str) -> Set[uuid.UUID]:
+        chats1 = self._by_agent.get(str(agent1_id), _NO_CHATS)
+        chats2 = self._by_agent.get(str(agent2_id), _NO_CHATS)
+        if len(chats1) > len(chats2):
+            chats1, chats2 = chats2, chats1
+        return {chat_id for chat_id in chats1 if chat_id in chats2}
+
+    # ----- Изменения -----
+
+    def add(self, chat_id: uuid.UUID, agent_id: str) -> None:
+        agent_id = str(agent_id)
+        self._by_chat.setdefault(chat_id, {})[agent_id] = None
+        self._by_agent.setdefault(agent_id, {})[chat_id] = None
+
+    def remove(self, chat_id: uuid.UUID, agent_id: str) -> None:
+        agent_id = str(agent_id)
+        members = self._by_chat.get(chat_id)
+        if members is not None:
+            members.pop(agent_id, None)
+        chats = self._by_agent.get(agent_id)
+        if chats is not None:
+            chats.pop(chat_id, None)
+            if not chats:
+                del self._by_agent[agent_id]
+
+    def set_members(self, chat_id: uuid.UUID, agent_ids: Iterable[str]) -> None:
+        """Полностью заменить состав чата."""
+        for agent_id in self.members_of(chat_id):
+            self.remove(chat_id, agent_id)
+        self._by_chat.setdefault(chat_id, {})
+        for agent_id in agent_ids:
+            self.add(chat_id, agent_id)
+
+    def remove_chat(self, chat_id: uuid.UUID) -> None:
+        for agent_id in self.members_of(chat_id):
+            self.remove(chat_id, agent_id)
+        self._by_chat.pop(chat_id, None)
+
+    def remove_agent(self, agent_id: str) -> None:
+        agent_id = str(agent_id)
+        for chat_id in self.chats_of(agent_id):
+            self.remove(chat_id, agent_id)
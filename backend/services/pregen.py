@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+"""
+Спекулятивная предгенерация реплик агентов.
+
+Пока LLM простаивает, движок заранее генерирует следующую реплику в чат для
+агентов, которых планировщик, скорее всего, выберет следующими, и кладёт её в
+ограниченную очередь агента. Когда агент действительно просыпается,
+_try_agent_chat берёт готовую реплику, и шаг не ждёт LLM.
+
+Реплика устаревает и выбрасывается, если:
+- настроение агента ушло от того, с которым она генерировалась, больше чем
+  на SIMULATION_PREGEN_MOOD_THRESHOLD;
+- в чате с тех пор появилось больше SIMULATION_PREGEN_CONTEXT_DRIFT
+  новых сообщений;
+- она лежит дольше SIMULATION_PREGEN_TTL_SECONDS.
+"""
+
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Iterable, Optional
+
+
+@dataclass
+class Utterance:
+    chat_id: uuid.UUID
+    text: str
+    # Настроение агента и номер версии чата на момент генерации
+    mood: float
+    chat_version: int
+    created_at: float
+
+
+class UtterancePool:
+    """
+    Очереди готовых реплик по агентам и счётчики сообщений по чатам.
+    """
+
+    def __init__(
+            self,
+            per_agent: int = 2,
+            mood_threshold: float = 0.15,
+            context_drift: int = 2,
+            ttl_seconds: float = 120.0,
+            clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.per_agent = max(1, per_agent)
+        self.mood_threshold = mood_threshold
+        self.context_drift = max(0, context_drift)
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._queues: Dict[str, Deque[Utterance]] = {}
+        self._chat_versions: Dict[uuid.UUID, int] = {}
+        # Агенты, для которых реплика генерируется прямо сейчас
+        self.pending: set[str] = set()
+        self.generated = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def __len__(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def clear(self) -> None:
+        self._queues.clear()
+        self._chat_versions.clear()
+        self.pending.clear()
+
+    # ----- Чаты -----
+
+    def chat_version(self, chat_id: uuid.UUID) -> int:
+        return self._chat_versions.get(chat_id, 0)
+
+    def note_chat_message(self, chat_id: uuid.UUID) -> None:
+        """В чате новое сообщение: контекст реплик, сгенерированных раньше, сдвинулся."""
+        self._chat_versions[chat_id] = self.chat_version(chat_id) + 1
+
+    # ----- Агенты -----
+
+    def wants(self, agent_id: str) -> bool:
+        """Есть ли смысл генерировать агенту ещё одну реплику."""
+        queue = self._queues.get(agent_id)
+        return agent_id not in self.pending and (queue is None or len(queue) < self.per_agent)
+
+    def put(self, agent_id: str, chat_id: uuid.UUID, text: str, mood: float, chat_version: int) -> None:
+        queue = self._queues.setdefault(agent_id, deque(maxlen=self.per_agent))
+        queue.append(Utterance(chat_id, text, mood, chat_version, self.clock()))
+        self.generated += 1
+
+    def drop(self, agent_id: str) -> None:
+        self._queues.pop(agent_id, None)
+
+    def _valid(self, item: Utterance, mood: float, now: float) -> bool:
+        return (
+                abs(item.mood - mood) <= self.mood_threshold
+                and self.chat_version(item.chat_id) - item.chat_version <= self.context_drift
+                and now - item.created_at <= self.ttl_seconds
+        )
+
+    def take(self, agent_id: str, mood: float, chat_ids: Iterable[uuid.UUID]) -> Optional[Utterance]:
+        """
+        Достать самую старую пригодную реплику агента для одного из его чатов.
+        Устаревшие реплики по пути выбрасываются.
+        """
+        queue = self._queues.get(agent_id)
+        if not queue:
+            self.misses += 1
+            return None
+        allowed = set(chat_ids)
+        now = self.clock()
+        found: Optional[Utterance] = None
+        kept: Deque[Utterance] = deque(maxlen=self.per_agent)
+        for item in queue:
+            if item.chat_id not in allowed or not self._valid(item, mood, now):
+                self.invalidated += 1
+            elif found is None:
+                found = item
+            else:
+                kept.append(item)
+        if kept:
+            self._queues[agent_id] = kept
+        else:
+            del self._queues[agent_id]
+        if found is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return found
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "ready": len(self),
+            "generated": self.generated,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated": self.invalidated,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
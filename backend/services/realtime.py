@@ -1,6 +1,6 @@
 import asyncio
 import logging
-from typing import Dict, Set
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
 
 from fastapi import WebSocket
 
@@ -18,6 +18,12 @@ class EventBroker:
     def __init__(self) -> None:
         self._connections: Set[WebSocket] = set()
         self._lock = asyncio.Lock()
+        # В процессе-воркере (SIMULATION_MODE=workers) подключений нет: кадры уходят
+        # издателю, а рассылает их API-процесс (services.relay)
+        self._publisher: Optional[Callable[[Dict], Awaitable[None]]] = None
+
+    def set_publisher(self, publisher: Optional[Callable[[Dict], Awaitable[None]]]) -> None:
+        self._publisher = publisher
 
     async def connect(self, websocket: WebSocket) -> None:
         """
@@ -38,7 +44,17 @@ class EventBroker:
 
     async def broadcast(self, payload: Dict) -> None:
         """
-        Отправить событие всем активным WebSocket-подключениям.
+        Отправить событие всем активным WebSocket-подключениям
+        (или издателю, если он задан).
+        """
+        if self._publisher is not None:
+            await self._publisher(payload)
+            return
+        await self.deliver(payload)
+
+    async def deliver(self, payload: Dict) -> None:
+        """
+        Отправить событие подключениям этого процесса.
 
         Если отправка на конкретный сокет падает, соединение
         помечается как закрытое и удаляется.
@@ -59,6 +75,52 @@ class EventBroker:
                 await self.disconnect(ws)
 
 
+class TickBatch:
+    """
+    Накопитель WebSocket-обновлений, произошедших за один тик симуляции.
+
+    Вместо отдельного сообщения на каждое событие клиенту уходит один кадр
+    {"type": "tick_batch", "data": {...}}. Обновления агентов и отношений
+    дедуплицируются: для каждого id остаётся последнее состояние.
+    """
+
+    def __init__(self) -> None:
+        self.events: List[Dict] = []
+        self.memories: List[Dict] = []
+        self.agent_updates: Dict[str, Dict] = {}
+        self.relations: Dict[Tuple[str, str], Dict] = {}
+        self.other: List[Dict] = []
+
+    def add(self, payload: Dict) -> None:
+        kind = payload.get("type")
+        data = payload.get("data") or {}
+        if kind == "event_created":
+            self.events.append(data)
+        elif kind == "memory_created":
+            self.memories.append(data)
+        elif kind == "agent_update":
+            self.agent_updates[str(data.get("id"))] = data
+        elif kind == "relation_changed":
+            self.relations[(str(data.get("source")), str(data.get("target")))] = data
+        else:
+            self.other.append(payload)
+
+    def is_empty(self) -> bool:
+        return not (self.events or self.memories or self.agent_updates or self.relations or self.other)
+
+    def as_message(self) -> Dict:
+        return {
+            "type": "tick_batch",
+            "data": {
+                "events": self.events,
+                "agent_updates": list(self.agent_updates.values()),
+                "relations": list(self.relations.values()),
+                "memories": self.memories,
+                "messages": self.other,
+            },
+        }
+
+
 broker = EventBroker()
 
 
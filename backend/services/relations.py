@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+"""
+Пакетная работа с отношениями агентов (таблица relationships).
+
+Отношения читаются одним запросом на набор пар и записываются обратно одним
+upsert-ом по уникальной паре (source_agent_id, target_agent_id):
+ON CONFLICT DO UPDATE в PostgreSQL и SQLite, построчный fallback для прочих СУБД.
+"""
+
+import logging
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.database.postgr.models import Relationship
+
+logger = logging.getLogger(__name__)
+
+# Ограничение на размер одного INSERT ... VALUES, чтобы не упереться в лимит параметров драйвера
+UPSERT_CHUNK_SIZE = 500
+
+_UPSERT_DIALECTS = {
+    "postgresql": pg_insert,
+    "sqlite": sqlite_insert,
+}
+
+
+async def fetch_relationships(
+        session: AsyncSession, pairs: Iterable[Tuple[str, str]]
+) -> Dict[Tuple[str, str], Relationship]:
+    """
+    Загрузить отношения для набора пар (source, target) одним запросом.
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return {}
+    result = await session.execute(
+        select(Relationship).where(
+            tuple_(Relationship.source_agent_id, Relationship.target_agent_id).in_(pairs)
+        )
+    )
+    return {(r.source_agent_id, r.target_agent_id): r for r in result.scalars().all()}
+
+
+async def upsert_relationships(session: AsyncSession, rows: Sequence[dict]) -> int:
+    """
+    Записать отношения пачкой. Каждая строка содержит id, source_agent_id, target_agent_id,
+    affinity, strength и label; при конфликте по паре обновляются affinity, strength и label.
+    Коммит остаётся за вызывающим кодом.
+    """
+    if not rows:
+        return 0
+    dialect = session.get_bind().dialect.name
+    insert_fn = _UPSERT_DIALECTS.get(dialect)
+    if insert_fn is None:
+        await _upsert_row_by_row(session, rows)
+        return len(rows)
+
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        chunk: List[dict] = list(rows[start:start + UPSERT_CHUNK_SIZE])
+        stmt = insert_fn(Relationship).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Relationship.source_agent_id, Relationship.target_agent_id],
+            set_={
+                "affinity": stmt.excluded.affinity,
+                "strength": stmt.excluded.strength,
+                "label": stmt.excluded.label,
+                "updated_at": func.now(),
+            },
+        )
+        await session.execute(stmt)
+    return len(rows)
+
+
+async def _upsert_row_by_row(session: AsyncSession, rows: Sequence[dict]) -> None:
+    logger.debug("Диалект без ON CONFLICT — upsert отношений построчно")
+    existing = await fetch_relationships(
+        session, [(row["source_agent_id"], row["target_agent_id"]) for row in rows]
+    )
+    for row in rows:
+        rel = existing.get((row["source_agent_id"], row["target_agent_id"]))
+        if rel is None:
+            session.add(Relationship(**row))
+        else:
+            await session.execute(
+                update(Relationship)
+                .where(Relationship.id == rel.id)
+                .values(affinity=row["affinity"], strength=row["strength"], label=row["label"])
+            )
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+"""
+Доставка WebSocket-кадров из воркеров симуляции в API-процесс.
+
+При SIMULATION_MODE=workers SimulationEngine крутится в процессах-воркерах,
+а WebSocket-клиенты подключены к API. Воркер подменяет рассылку брокера
+издателем FrameOutbox: кадры (tick_batch, message_delta, ...) копятся в
+памяти и раз в SIMULATION_RELAY_POLL_SECONDS записываются одной транзакцией в
+таблицу realtime_frames. FrameRelay в API-процессе с тем же периодом читает
+новые кадры и рассылает их своим подключениям.
+
+Курсор чтения ведётся по каждому шарду отдельно: шард пишет один воркер и
+последовательно, поэтому внутри шарда id растут в порядке коммитов и кадр не
+проскочит мимо курсора. Воркер удаляет свои кадры старше
+SIMULATION_RELAY_RETENTION_SECONDS.
+
+LISTEN/NOTIFY не подходит из-за лимита 8000 байт на уведомление (кадр тика
+больше) и отсутствия в SQLite; таблица работает на любой БД проекта.
+"""
+
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, delete, func, insert, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from backend.database.postgr.models import RealtimeFrame
+from backend.services.realtime import EventBroker
+
+logger = logging.getLogger(__name__)
+
+# Сколько кадров API забирает за один опрос
+RELAY_BATCH = 500
+
+
+class FrameOutbox:
+    """
+    Издатель кадров воркера: буфер в памяти и периодическая запись в realtime_frames.
+    """
+
+    def __init__(
+            self,
+            session_factory: async_sessionmaker[AsyncSession],
+            shard_id: int,
+            flush_seconds: float = 0.25,
+            retention_seconds: float = 60.0,
+    ) -> None:
+        self.session_factory = session_factory
+        self.shard_id = shard_id
+        self.flush_seconds = max(0.05, flush_seconds)
+        self.retention_seconds = retention_seconds
+        self._buffer: List[dict] = []
+        self._task: Optional[asyncio.Task] = None
+        self._last_prune: Optional[datetime] = None
+        self.published = 0
+
+    async def publish(self, payload: Dict) -> None:
+        self._buffer.append({
+            "shard_id": self.shard_id,
+            "created_at": datetime.now(timezone.utc),
+            "payload": json.dumps(payload, ensure_ascii=False, default=str),
+        })
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name=f"relay-outbox-{self.shard_id}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Последние кадры тоже должны дойти
+        await self.flush()
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # pragma: no cover - защитный лог
+                logger.warning("Не удалось записать кадры шарда %d: %s", self.shard_id, exc)
+
+    async def flush(self) -> int:
+        """Записать накопленные кадры; при ошибке они остаются в буфере до следующей попытки."""
+        rows, self._buffer = self._buffer, []
+        now = datetime.now(timezone.utc)
+        prune = self._last_prune is None or (now - self._last_prune).total_seconds() >= self.retention_seconds / 2
+        if not rows and not prune:
+            return 0
+        try:
+            async with self.session_factory() as session:
+                if rows:
+                    await session.execute(insert(RealtimeFrame), rows)
+                if prune:
+                    await session.execute(
+                        delete(RealtimeFrame).where(
+                            RealtimeFrame.shard_id == self.shard_id,
+                            RealtimeFrame.created_at < now - timedelta(seconds=self.retention_seconds),
+                        )
+                    )
+                await session.commit()
+        except Exception:
+            self._buffer[:0] = rows
+            raise
+        if prune:
+            self._last_prune = now
+        self.published += len(rows)
+        return len(rows)
+
+
+class FrameRelay:
+    """
+    Читатель кадров в API-процессе: новые строки realtime_frames уходят подключениям брокера.
+    """
+
+    def __init__(
+            self,
+            session_factory: async_sessionmaker[AsyncSession],
+            broker: EventBroker,
+            shards: Iterable[int],
+            poll_seconds: float = 0.25,
+    ) -> None:
+        self.session_factory = session_factory
+        self.broker = broker
+        self.shards = list(shards)
+        self.poll_seconds = max(0.05, poll_seconds)
+        self._cursors: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.relayed = 0
+
+    async def start(self) -> None:
+        if self._task is None:
+            # Кадры, записанные до запуска API, клиентам уже не нужны
+            async with self.session_factory() as session:
+                await self.skip_backlog(session)
+            self._task = asyncio.create_task(self._loop(), name="relay-frames")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def skip_backlog(self, session: AsyncSession) -> None:
+        result = await session.execute(
+            select(RealtimeFrame.shard_id, func.max(RealtimeFrame.id)).group_by(RealtimeFrame.shard_id)
+        )
+        self._cursors = {shard_id: last_id for shard_id, last_id in result.all()}
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # pragma: no cover - защитный лог
+                logger.warning("Не удалось прочитать кадры воркеров: %s", exc)
+            await asyncio.sleep(self.poll_seconds)
+
+    async def poll(self) -> int:
+        """Разослать кадры, появившиеся с прошлого опроса. Возвращает их число."""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(RealtimeFrame.id, RealtimeFrame.shard_id, RealtimeFrame.payload)
+                .where(or_(*(
+                    and_(RealtimeFrame.shard_id == shard, RealtimeFrame.id > self._cursors.get(shard, 0))
+                    for shard in self.shards
+                )))
+                .order_by(RealtimeFrame.id)
+                .limit(RELAY_BATCH)
+            )
+            rows = result.all()
+        for frame_id, shard_id, payload in rows:
+            self._cursors[shard_id] = max(self._cursors.get(shard_id, 0), frame_id)
+            try:
+                await self.broker.deliver(json.loads(payload))
+            except ValueError:
+                logger.warning("Пропущен повреждённый кадр %s шарда %s", frame_id, shard_id)
+        self.relayed += len(rows)
+        return len(rows)
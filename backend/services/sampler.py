@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+"""
+Выбор агентов для очередного тика без обращения к БД.
+
+AgentSampler поддерживает плотный массив id активных агентов (удаление — обменом
+с последним элементом), дерево Фенвика по весам энергии и очередь
+"давно не действовавших" агентов. Поддерживаемые политики:
+
+- uniform — равновероятный выбор, O(k);
+- energy  — вероятность пропорциональна энергии агента, O(k log n);
+- lra     — least-recently-acted, в первую очередь агенты, которые дольше всех не ходили, O(k).
+"""
+
+import random
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+POLICIES = ("uniform", "energy", "lra")
+
+# Минимальный вес, чтобы агенты с нулевой энергией всё же иногда могли восстановиться
+_MIN_ENERGY_WEIGHT = 1.0
+
+
+class _FenwickTree:
+    """Дерево Фенвика для префиксных сумм весов и поиска по накопленному весу."""
+
+    def __init__(self, capacity: int = 16) -> None:
+        self._tree: List[float] = [0.0] * (capacity + 1)
+        self._values: List[float] = [0.0] * capacity
+
+    @property
+    def capacity(self) -> int:
+        return len(self._values)
+
+    def _grow(self, capacity: int) -> None:
+        values = self._values + [0.0] * (capacity - len(self._values))
+        self._values = [0.0] * capacity
+        self._tree = [0.0] * (capacity + 1)
+        for i, v in enumerate(values):
+            if v:
+                self.set(i, v)
+
+    def set(self, index: int, value: float) -> None:
+        if index >= self.capacity:
+            self._grow(max(index + 1, self.capacity * 2))
+        delta = value - self._values[index]
+        if not delta:
+            return
+        self._values[index] = value
+        i = index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def get(self, index: int) -> float:
+        return self._values[index] if index < self.capacity else 0.0
+
+    def total(self) -> float:
+        i = self.capacity
+        s = 0.0
+        while i > 0:
+            s += self._tree[i]
+            i -= i & -i
+        return s
+
+    def find(self, target: float) -> int:
+        """Индекс первого элемента, на котором префиксная сумма превышает target."""
+        pos = 0
+        step = 1 << self.capacity.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= target:
+                pos = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        return min(pos, self.capacity - 1)
+
+
+class AgentSampler:
+    """
+    Поддерживаемое множество активных агентов с выбором по политике.
+    """
+
+    def __init__(self, policy: str = "uniform", rng: Optional[random.Random] = None) -> None:
+        self.policy = policy if policy in POLICIES else "uniform"
+        self.rng = rng or random.Random()
+        self._ids: List[str] = []
+        self._slots: Dict[str, int] = {}
+        self._weights = _FenwickTree()
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, agent_id: str) -> bool:
+        return agent_id in self._slots
+
+    def clear(self) -> None:
+        self._ids.clear()
+        self._slots.clear()
+        self._weights = _FenwickTree()
+        self._recent.clear()
+
+    def add(self, agent_id: str, energy: float = 100.0) -> None:
+        if agent_id in self._slots:
+            self.update(agent_id, energy)
+            return
+        slot = len(self._ids)
+        self._ids.append(agent_id)
+        self._slots[agent_id] = slot
+        self._weights.set(slot, max(_MIN_ENERGY_WEIGHT, float(energy)))
+        # Новый агент ещё не действовал — ставим его в начало очереди lra
+        self._recent[agent_id] = None
+        self._recent.move_to_end(agent_id, last=False)
+
+    def remove(self, agent_id: str) -> None:
+        slot = self._slots.pop(agent_id, None)
+        if slot is None:
+            return
+        last_slot = len(self._ids) - 1
+        last_id = self._ids.pop()
+        if slot != last_slot:
+            # Переносим последний элемент на место удалённого
+            self._ids[slot] = last_id
+            self._slots[last_id] = slot
+            self._weights.set(slot, self._weights.get(last_slot))
+        else:
+            self._weights.set(slot, 0.0)
+        self._weights.set(last_slot, 0.0)
+        self._recent.pop(agent_id, None)
+
+    def update(self, agent_id: str, energy: float) -> None:
+        slot = self._slots.get(agent_id)
+        if slot is not None:
+            self._weights.set(slot, max(_MIN_ENERGY_WEIGHT, float(energy)))
+
+    def mark_acted(self, agent_ids: List[str]) -> None:
+        for agent_id in agent_ids:
+            if agent_id in self._recent:
+                self._recent.move_to_end(agent_id)
+
+    def sample(self, k: int) -> List[str]:
+        """Вернуть до k различных агентов согласно политике."""
+        n = len(self._ids)
+        k = min(k, n)
+        if k <= 0:
+            return []
+        if self.policy == "lra":
+            result = []
+            for agent_id in self._recent:
+                result.append(agent_id)
+                if len(result) == k:
+                    break
+            return result
+        if self.policy == "energy":
+            return self._sample_weighted(k)
+        return [self._ids[i] for i in self.rng.sample(range(n), k)]
+
+    def _sample_weighted(self, k: int) -> List[str]:
+        picked: List[int] = []
+        saved: List[float] = []
+        try:
+            for _ in range(k):
+                total = self._weights.total()
+                if total <= 0:
+                    break
+                slot = min(self._weights.find(self.rng.random() * total), len(self._ids) - 1)
+                if self._weights.get(slot) <= 0:
+                    break
+                picked.append(slot)
+                saved.append(self._weights.get(slot))
+                # Временно обнуляем вес, чтобы не выбрать агента повторно
+                self._weights.set(slot, 0.0)
+        finally:
+            for slot, weight in zip(picked, saved):
+                self._weights.set(slot, weight)
+        return [self._ids[slot] for slot in picked]
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+"""
+Сцены в групповых чатах: один запрос к LLM — несколько реплик подряд.
+
+Обычно каждая реплика в чате — отдельный запрос, и участники редко отвечают
+друг другу связно. В режиме сцен (SIMULATION_SCENES_ENABLED) агент, решивший
+написать в чат, запрашивает у модели короткий диалог из
+SIMULATION_SCENE_TURNS реплик между участниками чата в виде JSON. Первая
+реплика публикуется сразу, остальные лежат в ScenePool и выпускаются
+движком по одной на чат за тик — как обычные события chat_group от имени
+своих авторов.
+
+Пока сцена идёт, остальные агенты пишут в другие свои чаты. Сцена
+выбрасывается, если не доиграна за SIMULATION_SCENE_TTL_SECONDS.
+"""
+
+import json
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional
+from uuid import uuid4
+
+
+@dataclass
+class SceneTurn:
+    speaker_id: str
+    text: str
+
+
+@dataclass
+class Scene:
+    chat_id: uuid.UUID
+    turns: Deque[SceneTurn]
+    created_at: float
+    id: str = field(default_factory=lambda: str(uuid4()))
+    # Сколько реплик уже опубликовано и сколько было всего
+    released: int = 0
+    total: int = 0
+
+    def meta(self) -> dict:
+        """Поля для metadata_json события с репликой сцены."""
+        return {"scene_id": self.id, "scene_turn": self.released, "scene_turns": self.total}
+
+
+def parse_scene_reply(text: str, speakers: Dict[str, str]) -> Optional[List[SceneTurn]]:
+    """
+    Достать реплики из ответа модели: JSON-массив объектов {"speaker", "text"}.
+    speakers — имя участника -> id агента; реплики неизвестных участников
+    отбрасываются. None, если разобрать нечего.
+    """
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end <= start:
+        return None
+    try:
+        items = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(items, list):
+        return None
+
+    by_name = {name.strip().casefold(): agent_id for name, agent_id in speakers.items()}
+    turns: List[SceneTurn] = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        speaker, line = item.get("speaker"), item.get("text")
+        if not isinstance(speaker, str) or not isinstance(line, str) or not line.strip():
+            continue
+        agent_id = by_name.get(speaker.strip().casefold())
+        if agent_id is not None:
+            turns.append(SceneTurn(agent_id, line.strip()))
+    return turns or None
+
+
+class ScenePool:
+    """
+    Недоигранные сцены по чатам.
+    """
+
+    def __init__(self, ttl_seconds: float = 300.0, clock: Callable[[], float] = time.monotonic) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._scenes: Dict[uuid.UUID, Scene] = {}
+        self.started = 0
+        self.released = 0
+        self.skipped = 0
+        self.expired = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        return len(self._scenes)
+
+    def __contains__(self, chat_id: uuid.UUID) -> bool:
+        scene = self._scenes.get(chat_id)
+        return scene is not None and not self._expire(scene)
+
+    def clear(self) -> None:
+        self._scenes.clear()
+
+    def _expire(self, scene: Scene) -> bool:
+        if self.clock() - scene.created_at <= self.ttl_seconds:
+            return False
+        del self._scenes[scene.chat_id]
+        self.expired += 1
+        return True
+
+    def start(self, chat_id: uuid.UUID, turns: List[SceneTurn]) -> Scene:
+        """Новая сцена в чате (прежняя, если была, заменяется)."""
+        scene = Scene(chat_id, deque(turns), self.clock(), total=len(turns))
+        self._scenes[chat_id] = scene
+        self.started += 1
+        return scene
+
+    def note_failed(self) -> None:
+        """Модель не вернула разборчивую сцену — чат получит обычную реплику."""
+        self.failed += 1
+
+    def active(self) -> List[Scene]:
+        """Сцены, у которых есть невыпущенные реплики; просроченные выбрасываются."""
+        return [scene for scene in list(self._scenes.values()) if not self._expire(scene)]
+
+    def pop(self, scene: Scene, skip: bool = False) -> Optional[SceneTurn]:
+        """
+        Следующая реплика сцены. skip=True — реплику не публикуем (автор ушёл из чата
+        или удалён). Доигранная сцена убирается из пула.
+        """
+        if not scene.turns:
+            self._scenes.pop(scene.chat_id, None)
+            return None
+        turn = scene.turns.popleft()
+        if skip:
+            self.skipped += 1
+        else:
+            scene.released += 1
+            self.released += 1
+        if not scene.turns and self._scenes.get(scene.chat_id) is scene:
+            del self._scenes[scene.chat_id]
+        return turn
+
+    def drop(self, chat_id: uuid.UUID) -> None:
+        self._scenes.pop(chat_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self),
+            "started": self.started,
+            "released": self.released,
+            "skipped": self.skipped,
+            "expired": self.expired,
+            "failed": self.failed,
+        }
@@ -3,18 +3,40 @@ from __future__ import annotations
 """
 Утилиты инициализации схемы и стартовых данных.
 
-Сейчас init_schema отвечает только за создание таблиц на основе metadata,
+Сейчас init_schema отвечает за создание таблиц на основе metadata и за
+дополнения схемы, которые create_all не делает для уже существующих таблиц,
 а ensure_seed_data оставлена как "hook" для возможного будущего наполнения БД.
 """
 
 import logging
 
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, async_sessionmaker
 
 from backend.database.postgr.db import Base, engine
 
 logger = logging.getLogger(__name__)
 
+RELATIONSHIP_PAIR_COLUMNS = ["source_agent_id", "target_agent_id"]
+
+# Оставляем по одной строке на пару: самую свежую (строки без updated_at — в последнюю очередь)
+_DEDUP_RELATIONSHIPS_SQL = text("""
+    DELETE FROM relationships WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY source_agent_id, target_agent_id
+                ORDER BY CASE WHEN updated_at IS NULL THEN 1 ELSE 0 END, updated_at DESC, id DESC
+            ) AS rn
+            FROM relationships
+        ) ranked
+        WHERE rn > 1
+    )
+""")
+
+_CREATE_RELATIONSHIP_PAIR_INDEX_SQL = text(
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_relationships_pair ON relationships (source_agent_id, target_agent_id)"
+)
+
 
 async def init_schema() -> None:
     """
@@ -26,9 +48,37 @@ async def init_schema() -> None:
     logger.info("Инициализация схемы БД через Base.metadata.create_all")
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await ensure_relationship_pair_index(conn)
     logger.info("Инициализация схемы БД завершена")
 
 
+def _has_unique_pair(sync_conn) -> bool:
+    inspector = inspect(sync_conn)
+    if not inspector.has_table("relationships"):
+        return False
+    uniques = [c["column_names"] for c in inspector.get_unique_constraints("relationships")]
+    uniques += [i["column_names"] for i in inspector.get_indexes("relationships") if i.get("unique")]
+    return any(list(columns) == RELATIONSHIP_PAIR_COLUMNS for columns in uniques)
+
+
+async def ensure_relationship_pair_index(conn: AsyncConnection) -> bool:
+    """
+    Уникальность пары (source_agent_id, target_agent_id) в relationships.
+
+    create_all не меняет существующие таблицы, а пакетный upsert отношений опирается
+    на ON CONFLICT по паре. В БД, созданной до появления ограничения, дубли пар
+    удаляются и создаётся уникальный индекс. Возвращает True, если индекс пришлось создать.
+    """
+    if await conn.run_sync(_has_unique_pair):
+        return False
+    result = await conn.execute(_DEDUP_RELATIONSHIPS_SQL)
+    await conn.execute(_CREATE_RELATIONSHIP_PAIR_INDEX_SQL)
+    logger.warning(
+        "Создан уникальный индекс uq_relationships_pair; удалено дублей отношений: %d", result.rowcount or 0
+    )
+    return True
+
+
 async def ensure_seed_data(session_factory: async_sessionmaker[AsyncSession]) -> None:
     """
     Хук для наполнения БД начальными данными.
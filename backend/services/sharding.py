@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+"""
+Шардирование симуляции по пользователям и аренда шардов воркер-процессами.
+
+Пользователи (и их агенты и чаты) делятся на M шардов по UUID пользователя.
+Каждый воркер арендует один шард через таблицу simulation_shards: строка
+выбирается SELECT ... FOR UPDATE SKIP LOCKED (в PostgreSQL; SQLite блокировку
+строк не поддерживает и полагается на блокировку всей БД), после чего аренда
+фиксируется условным UPDATE-ом. Воркер продлевает аренду heartbeat-ом и заодно
+публикует скорость тиков; аренда, которую не продлили вовремя, переходит к
+следующему свободному воркеру.
+"""
+
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.database.postgr.models import SimulationShard
+
+logger = logging.getLogger(__name__)
+
+_INSERT_DIALECTS = {
+    "postgresql": pg_insert,
+    "sqlite": sqlite_insert,
+}
+
+
+def shard_of(user_id: Optional[str], shard_count: int) -> int:
+    """
+    Номер шарда для пользователя. Агенты и чаты без владельца всегда попадают в шард 0.
+    """
+    if shard_count <= 1 or not user_id:
+        return 0
+    try:
+        return uuid.UUID(str(user_id)).int % shard_count
+    except (ValueError, TypeError, AttributeError):
+        return 0
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _lease_free(owner: str, now: datetime):
+    """Условие: шард свободен, аренда истекла или уже принадлежит этому воркеру."""
+    return or_(
+        SimulationShard.owner.is_(None),
+        SimulationShard.lease_expires_at.is_(None),
+        SimulationShard.lease_expires_at < now,
+        SimulationShard.owner == owner,
+    )
+
+
+async def ensure_shards(session: AsyncSession, shard_count: int) -> None:
+    """
+    Создать строки шардов 0..shard_count-1, если их ещё нет. Коммит остаётся за вызывающим кодом.
+    """
+    rows = [{"shard_id": i, "shard_count": shard_count, "ticks": 0, "ticks_per_second": 0.0, "agents": 0}
+            for i in range(shard_count)]
+    insert_fn = _INSERT_DIALECTS.get(session.get_bind().dialect.name)
+    if insert_fn is not None:
+        stmt = insert_fn(SimulationShard).values(rows).on_conflict_do_nothing(
+            index_elements=[SimulationShard.shard_id]
+        )
+        await session.execute(stmt)
+        return
+
+    existing = set((await session.execute(select(SimulationShard.shard_id))).scalars().all())
+    session.add_all(SimulationShard(**row) for row in rows if row["shard_id"] not in existing)
+    await session.flush()
+
+
+async def claim_shard(
+        session: AsyncSession,
+        owner: str,
+        shard_count: int,
+        lease_seconds: float,
+        preferred: Optional[int] = None,
+) -> Optional[int]:
+    """
+    Арендовать свободный шард. Возвращает номер шарда или None, если все шарды заняты.
+    preferred — шард, который воркер пробует взять первым (например, свой прежний).
+    """
+    await ensure_shards(session, shard_count)
+    await session.commit()
+
+    tried: set[int] = set()
+    for _ in range(shard_count):
+        now = _utcnow()
+        stmt = (
+            select(SimulationShard.shard_id)
+            .where(SimulationShard.shard_id < shard_count, _lease_free(owner, now))
+            .order_by(SimulationShard.shard_id)
+            .with_for_update(skip_locked=True)
+        )
+        if tried:
+            stmt = stmt.where(SimulationShard.shard_id.not_in(tried))
+        candidates = list((await session.execute(stmt)).scalars().all())
+        if not candidates:
+            await session.rollback()
+            return None
+        shard_id = preferred if preferred in candidates else candidates[0]
+        tried.add(shard_id)
+
+        # Условный UPDATE: если шард успели забрать между SELECT и UPDATE, rowcount будет 0
+        result = await session.execute(
+            update(SimulationShard)
+            .where(SimulationShard.shard_id == shard_id, _lease_free(owner, now))
+            .values(
+                owner=owner,
+                shard_count=shard_count,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                heartbeat_at=now,
+                ticks=0,
+                ticks_per_second=0.0,
+            )
+        )
+        await session.commit()
+        if result.rowcount == 1:
+            logger.info("Воркер %s арендовал шард %d/%d", owner, shard_id, shard_count)
+            return shard_id
+    return None
+
+
+async def renew_lease(
+        session: AsyncSession,
+        shard_id: int,
+        owner: str,
+        lease_seconds: float,
+        ticks: int,
+        ticks_per_second: float,
+        agents: int,
+) -> bool:
+    """
+    Heartbeat: продлить аренду и записать статистику шарда.
+    Возвращает False, если аренда потеряна (шард забрал другой воркер).
+    """
+    now = _utcnow()
+    result = await session.execute(
+        update(SimulationShard)
+        .where(SimulationShard.shard_id == shard_id, SimulationShard.owner == owner)
+        .values(
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            heartbeat_at=now,
+            ticks=ticks,
+            ticks_per_second=ticks_per_second,
+            agents=agents,
+        )
+    )
+    await session.commit()
+    return result.rowcount == 1
+
+
+async def release_shard(session: AsyncSession, shard_id: int, owner: str) -> None:
+    """Освободить шард при штатной остановке воркера."""
+    await session.execute(
+        update(SimulationShard)
+        .where(SimulationShard.shard_id == shard_id, SimulationShard.owner == owner)
+        .values(owner=None, lease_expires_at=None, ticks_per_second=0.0)
+    )
+    await session.commit()
+
+
+async def fetch_shards(session: AsyncSession, shard_count: Optional[int] = None) -> List[SimulationShard]:
+    """Строки шардов (для отчёта координатора и API)."""
+    stmt = select(SimulationShard).order_by(SimulationShard.shard_id)
+    if shard_count is not None:
+        stmt = stmt.where(SimulationShard.shard_id < shard_count)
+    return list((await session.execute(stmt)).scalars().all())
+
+
+def lease_alive(shard: SimulationShard, now: Optional[datetime] = None) -> bool:
+    """Аренда шарда действительна (воркер жив и продлевает её)."""
+    if shard.owner is None or shard.lease_expires_at is None:
+        return False
+    expires = shard.lease_expires_at
+    if expires.tzinfo is None:
+        # SQLite возвращает время без часового пояса; пишем всегда в UTC
+        expires = expires.replace(tzinfo=timezone.utc)
+    return expires > (now or _utcnow())
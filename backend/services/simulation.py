@@ -1,24 +1,32 @@
 from __future__ import annotations
 
 import asyncio
+import itertools
 import json
 import logging
 import random
 import uuid
-from datetime import datetime, timedelta
-from typing import List, Optional
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, List, Optional
+from uuid import uuid4
 
-from sqlalchemy import func, select
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from backend.database.chrome.db import memory_store
-from backend.database.postgr.models import Agent, Event, GroupChat, Interaction, Memory, Plan, Relationship
-from backend.database.postgr.models.groupchat import group_chat_agents
+from backend.database.postgr.models import Event, Interaction, Memory, Plan
 
 from backend.project_config import settings
 from backend.schemas import SimulationStatus
 from backend.services.llm import llm_client
-from backend.services.realtime import broker
+from backend.services.llm_context import conversation_key
+from backend.services.llm_usage import llm_call_tags, usage_ledger
+from backend.services.realtime import TickBatch, broker
+from backend.services.scenes import Scene, parse_scene_reply
+from backend.services.ticker import TickClock
+from backend.services.wakeup import wake_interval
+from backend.services.world import AgentState, ChatState, WorldState, world
 
 logger = logging.getLogger(__name__)
 
@@ -34,85 +42,204 @@ def _canon_uuid_str(value: str) -> Optional[str]:
         return None
 
 
+@dataclass
+class _ReplyContext:
+    """Прочитанное в фазе чтения: сообщение, на которое агент отвечает, и история общения."""
+    event: Event
+    sender: AgentState
+    interactions: List[Interaction]
+
+
+@dataclass
+class _StepOutcome:
+    """Итог фазы генерации: новые строки для одной транзакции и обновления для клиентов."""
+    rows: List[Any] = field(default_factory=list)
+    updates: List[dict] = field(default_factory=list)
+
+
+def _new_event(**kwargs: Any) -> Event:
+    """
+    Событие с id и временем, заданными заранее: на него ссылаются воспоминания
+    и WebSocket-обновления, а перечитывать строку после коммита не нужно.
+    id можно передать явно, если он уже ушёл клиентам в message_delta.
+    """
+    kwargs.setdefault("id", str(uuid4()))
+    return Event(created_at=datetime.now(timezone.utc), **kwargs)
+
+
+def _event_created(event: Event) -> dict:
+    return {
+        "type": "event_created",
+        "data": {
+            "id": event.id,
+            "description": event.description,
+            "timestamp": event.created_at.isoformat(),
+        },
+    }
+
+
+def _chat_topic(group_chat: ChatState) -> str:
+    """Полный контекст чата для промпта: название и описание."""
+    topic = f"Чат: {group_chat.name}"
+    if group_chat.description:
+        topic += f" - {group_chat.description}"
+    else:
+        topic += " - общение в чате"
+    return topic
+
+
 class SimulationEngine:
     """
     Простой симулятор событий и настроений агентов.
     """
 
-    def __init__(self, session_factory: async_sessionmaker[AsyncSession]) -> None:
+    def __init__(
+            self,
+            session_factory: async_sessionmaker[AsyncSession],
+            world_state: Optional[WorldState] = None,
+    ) -> None:
         self.session_factory = session_factory
-        self.is_paused = False
+        self.world = world_state or world
+        self.flush_seconds = settings.SIMULATION_FLUSH_SECONDS
+        self._flush_task: Optional[asyncio.Task] = None
+        # Базовая скорость цикла; пользователи ускоряют или замедляют только своих агентов
         self.speed = settings.SIMULATION_DEFAULT_SPEED
         self.tick_seconds = settings.SIMULATION_TICK_SECONDS
+        # Расписание тиков по монотонным часам: длинный шаг не растягивает период
+        self.clock = TickClock(settings.SIMULATION_TICK_POLICY, settings.SIMULATION_MAX_CATCH_UP_TICKS)
+        self.agents_per_tick = max(1, settings.SIMULATION_AGENTS_PER_TICK)
+        self.scheduler = settings.SIMULATION_SCHEDULER
+        self.energy_recovery = settings.SIMULATION_ENERGY_RECOVERY_PER_TICK
+        # Когда событийному циклу пора выполнить очередной тик мира (world_tick)
+        self._next_world_tick: Optional[float] = None
+        # Ограничиваем число агентов, которые одновременно держат сессию и ждут LLM
+        self._step_semaphore = asyncio.Semaphore(max(1, settings.SIMULATION_MAX_CONCURRENCY))
         self._task: Optional[asyncio.Task] = None
         self._shutdown = False
+        # Счётчик выполненных тиков (для статистики шардов)
+        self.ticks = 0
+        # Обновления текущего тика; рассылаются клиентам одним кадром в конце step()
+        self._batch: Optional[TickBatch] = None
+        # Потоковая генерация реплик: клиенты видят текст по мере генерации
+        self.stream_messages = settings.LLM_STREAM_MESSAGES
+        # Предгенерация реплик агентов, которые скоро проснутся
+        self.pregen_enabled = settings.SIMULATION_PREGEN_ENABLED
+        self.pregen_batch = max(1, settings.SIMULATION_PREGEN_BATCH)
+        self._pregen_task: Optional[asyncio.Task] = None
+        # Сцены в групповых чатах: один запрос к LLM на несколько реплик
+        self.scenes_enabled = settings.SIMULATION_SCENES_ENABLED
+        self.scene_turns = max(2, settings.SIMULATION_SCENE_TURNS)
+        self.scene_max_speakers = max(2, settings.SIMULATION_SCENE_MAX_SPEAKERS)
 
     async def start(self) -> None:
         if self._task is None:
-            self._task = asyncio.create_task(self._run(), name="simulation-loop")
+            async with self.session_factory() as session:
+                await self.world.load(session)
+            self.world.live = True
+            loop = self._run_events() if self.scheduler == "events" else self._run()
+            self._task = asyncio.create_task(loop, name="simulation-loop")
+            self._flush_task = asyncio.create_task(self._flush_loop(), name="simulation-flush")
+            if self.pregen_enabled:
+                self._pregen_task = asyncio.create_task(self._pregen_loop(), name="simulation-pregen")
             logger.info("Цикл симуляции запущен")
 
     async def stop(self) -> None:
         self._shutdown = True
+        for task in (self._task, self._flush_task, self._pregen_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
         if self._task:
-            self._task.cancel()
-            try:
-                await self._task
-            except asyncio.CancelledError:
-                pass
+            # Последний сброс, чтобы не потерять изменения, накопленные в памяти
+            await self.flush()
+            self.world.live = False
             logger.info("Цикл симуляции остановлен")
 
-    async def control(self, action: Optional[str], speed: Optional[float]) -> SimulationStatus:
-        if action == "pause":
-            self.is_paused = True
-            logger.info("Симуляция поставлена на паузу")
-        elif action == "resume":
-            self.is_paused = False
-            logger.info("Симуляция возобновлена")
-
-        if speed is not None:
-            self.speed = max(0.1, min(speed, 10.0))
-            logger.info("Скорость симуляции установлена на %.2fx", self.speed)
+    async def flush(self) -> int:
+        """Сбросить накопленные изменения состояния мира в БД."""
+        async with self.session_factory() as session:
+            written = await self.world.flush(session)
+        # Учёт LLM пишется отдельной транзакцией: его сбой не откатывает состояние мира
+        async with self.session_factory() as session:
+            await usage_ledger.flush(session)
+        return written
 
+    async def _flush_loop(self) -> None:
+        while not self._shutdown:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # pragma: no cover - защитный лог
+                logger.exception("World state flush failed: %s", exc)
+
+    async def control(
+            self,
+            action: Optional[str],
+            speed: Optional[float],
+            user_id: str,
+    ) -> SimulationStatus:
+        """
+        Пауза и скорость симуляции пользователя: его агенты пропускаются
+        или получают большую долю тика. Общий цикл при этом не останавливается.
+        """
+        paused = {"pause": True, "resume": False}.get(action or "")
+        # Настройки сохраняются в БД: при SIMULATION_MODE=workers агентов двигают воркеры,
+        # и они подхватывают паузу и скорость при ближайшей синхронизации мира
+        if paused is not None or speed is not None:
+            async with self.session_factory() as session:
+                tenant = await self.world.save_tenant(session, str(user_id), paused=paused, speed=speed)
+                await session.commit()
+            logger.info(
+                "Симуляция пользователя %s: пауза=%s, скорость=%.2fx", user_id, tenant.paused, tenant.speed
+            )
+        return self.status(user_id)
+
+    def status(self, user_id: Optional[str] = None) -> SimulationStatus:
+        """Текущее состояние цикла; с user_id — пауза и скорость этого пользователя."""
+        speed, is_paused = self.speed, False
+        if user_id is not None:
+            tenant = self.world.sampler.tenant(str(user_id))
+            speed, is_paused = tenant.speed, tenant.paused
         return SimulationStatus(
-            speed=self.speed, is_paused=self.is_paused, tick_seconds=self.tick_seconds
+            speed=speed,
+            is_paused=is_paused,
+            tick_seconds=self.tick_seconds,
+            tick_lag_seconds=round(self.clock.lag_seconds, 3),
+            overruns=self.clock.overruns,
+            skipped_ticks=self.clock.skipped,
+            pregen_ready=len(self.world.utterances),
+            pregen_hit_rate=self.world.utterances.stats()["hit_rate"],
+            scenes_active=len(self.world.scenes),
+            llm_breaker=llm_client.breaker.state,
         )
 
-    async def _get_group_chat_topics(self, session: AsyncSession, agent1: Agent, agent2: Agent) -> List[str]:
+    @property
+    def tick_period(self) -> float:
+        return max(0.2, self.tick_seconds / max(self.speed, 0.1))
+
+    async def _get_group_chat_topics(self, agent1: AgentState, agent2: AgentState) -> List[str]:
         """
         Получить список тем из групповых чатов, в которых участвуют оба агента.
         """
-        # `Agent.id` хранится как String(64) (uuid-строка).
-        # Нормализуем формат UUID и работаем со строками, т.к. group_chat_agents.c.agent_id тоже String.
+        # `Agent.id` хранится как String(64) (uuid-строка), участники чатов в мире — тоже строки.
         agent1_id = _canon_uuid_str(agent1.id)
         agent2_id = _canon_uuid_str(agent2.id)
         if not agent1_id or not agent2_id:
             return ["общение в кибер-городе"]
 
-        # Получаем множества ID чатов для каждого агента через таблицу связей
-        result1 = await session.execute(
-            select(group_chat_agents.c.group_chat_id).where(
-                group_chat_agents.c.agent_id == agent1_id
-            )
-        )
-        chats1 = {row[0] for row in result1.fetchall()}
-
-        result2 = await session.execute(
-            select(group_chat_agents.c.group_chat_id).where(
-                group_chat_agents.c.agent_id == agent2_id
-            )
-        )
-        chats2 = {row[0] for row in result2.fetchall()}
-
-        common_chat_ids = list(chats1 & chats2)
-        if not common_chat_ids:
+        group_chats = [
+            self.world.chats[chat_id]
+            for chat_id in self.world.memberships.shared_chats(agent1_id, agent2_id)
+            if chat_id in self.world.chats
+        ]
+        if not group_chats:
             return ["общение в кибер-городе"]
 
-        result = await session.execute(
-            select(GroupChat).where(GroupChat.id.in_(common_chat_ids))
-        )
-        group_chats = result.scalars().all()
-
         # Создаем контекст из названия и описания чата
         contexts = []
         for chat in group_chats:
@@ -124,11 +251,9 @@ class SimulationEngine:
         return contexts if contexts else ["Чат: Кибер город - общение в кибер-городе"]
 
     async def _run(self) -> None:
+        self.clock.reset()
         while not self._shutdown:
-            if self.is_paused:
-                await asyncio.sleep(0.25)
-                continue
-
+            self.clock.tick_started()
             try:
                 await self.step()
             except asyncio.CancelledError:
@@ -136,102 +261,490 @@ class SimulationEngine:
             except Exception as exc:  # pragma: no cover - защитный лог
                 logger.exception("Simulation step failed: %s", exc)
 
-            await asyncio.sleep(max(0.2, self.tick_seconds / max(self.speed, 0.1)))
+            delay = self.clock.tick_finished(self.tick_period)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif self.clock.lag_seconds > self.tick_period:
+                logger.debug("Симуляция отстаёт от расписания на %.2f с", self.clock.lag_seconds)
 
-    async def step(self) -> None:
+    async def _run_events(self) -> None:
+        """
+        Событийный цикл: будит агентов по их собственному времени пробуждения
+        и спит до ближайшего из них (или до сигнала о новом сообщении).
+        Раз в tick_period выполняется тик мира — независимо от того, сколько
+        пачек агентов проснулось за это время.
+        """
+        wakeups = self.world.wakeups
+        self._next_world_tick = wakeups.clock() + self.tick_period
+        while not self._shutdown:
+            try:
+                await self._world_tick_if_due(wakeups.clock())
+            except asyncio.CancelledError:
+                break
+            except Exception as exc:  # pragma: no cover - защитный лог
+                logger.exception("World tick failed: %s", exc)
+
+            agent_ids = self._take_due_agents(wakeups.clock())
+            if agent_ids:
+                try:
+                    await self.step(agent_ids)
+                except asyncio.CancelledError:
+                    break
+                except Exception as exc:  # pragma: no cover - защитный лог
+                    logger.exception("Simulation step failed: %s", exc)
+                for agent_id in agent_ids:
+                    self._reschedule(agent_id)
+                continue
+
+            next_at = wakeups.next_wake_at()
+            timeout = self.flush_seconds if next_at is None else next_at - wakeups.clock()
+            await wakeups.wait(min(timeout, self._next_world_tick - wakeups.clock()))
+
+    async def _world_tick_if_due(self, now: float) -> bool:
+        """Выполнить тик мира, если подошло его время. Пропущенные тики не догоняются."""
+        if self._next_world_tick is not None and now < self._next_world_tick:
+            return False
+        self._next_world_tick = now + self.tick_period
+        await self.world_tick()
+        return True
+
+    async def world_tick(self) -> None:
+        """
+        Работа мира, привязанная к времени, а не к шагам агентов, в событийном режиме:
+        очередные реплики сцен и восстановление энергии. В тиковом режиме их выполняет
+        каждый step().
+        """
+        self._batch = TickBatch()
+        try:
+            if self.scenes_enabled:
+                await self._release_scene_turns()
+        finally:
+            batch, self._batch = self._batch, None
+        self.world.recover_energy(self.energy_recovery)
+
+        if not batch.is_empty():
+            await broker.broadcast(batch.as_message())
+
+    def _take_due_agents(self, now: float) -> List[str]:
+        """
+        Забрать до agents_per_tick агентов, чьё время пробуждения наступило,
+        с учётом паузы и бюджета каждого пользователя.
+        """
+        wakeups = self.world.wakeups
+        sampler = self.world.sampler
+        taken: List[str] = []
+        deferred = []
+        per_tenant: dict = {}
+        lag = 0.0
+        while len(taken) < self.agents_per_tick:
+            due = wakeups.pop_due(now)
+            if due is None:
+                break
+            agent_id, at = due
+            tenant_id = sampler.tenant_of(agent_id)
+            if sampler.tenant(tenant_id).paused:
+                # Агенты пользователя на паузе не просыпаются, но и не крутят цикл вхолостую
+                wakeups.schedule(agent_id, now + wakeups.base_seconds)
+                continue
+            if per_tenant.get(tenant_id, 0) >= sampler.budget_for(tenant_id):
+                deferred.append(due)
+                continue
+            per_tenant[tenant_id] = per_tenant.get(tenant_id, 0) + 1
+            taken.append(agent_id)
+            lag = max(lag, now - at)
+        for agent_id, at in deferred:
+            wakeups.schedule(agent_id, at)
+        if taken:
+            self.clock.lag_seconds = lag
+        return taken
+
+    def _predict_next_agents(self, limit: int) -> List[str]:
+        """
+        Агенты, которых планировщик, вероятно, выберет следующими: при событийном
+        планировщике — ближайшие по времени пробуждения, при тиковом (выбор случайный)
+        — случайные агенты, которым ещё нужна реплика.
+        """
+        pool = self.world.utterances
+        if self.scheduler == "events":
+            candidates = self.world.wakeups.upcoming(limit * 2)
+        else:
+            candidates = random.sample(list(self.world.agents), min(len(self.world.agents), limit * 2))
+        paused = {t for t, state in self.world.sampler.tenants.items() if state.paused}
+        return [
+            agent_id for agent_id in candidates
+            if pool.wants(agent_id) and self.world.sampler.tenant_of(agent_id) not in paused
+        ][:limit]
+
+    async def _pregenerate(self, agent_id: str) -> None:
+        agent = self.world.get_agent(agent_id)
+        if agent is None:
+            return
+        chats = [c for c in self.world.chats_of(agent_id) if set(self.world.members_of(c.id)) - {agent_id}]
+        if not chats:
+            return
+        pool = self.world.utterances
+        group_chat = random.choice(chats)
+        mood, version = agent.mood, pool.chat_version(group_chat.id)
+        pool.pending.add(agent_id)
+        try:
+            with llm_call_tags(agent.id, agent.user_id):
+                text = await self._generate_chat_message(agent, group_chat)
+        finally:
+            pool.pending.discard(agent_id)
+        if text:
+            pool.put(agent_id, group_chat.id, text, mood, version)
+
+    async def _pregen_loop(self) -> None:
+        """
+        Фоновый производитель реплик: работает, только пока LLM простаивает,
+        чтобы не отнимать у шагов места в очереди ограничителя.
+        """
+        interval = max(0.2, self.tick_period / 2)
+        while not self._shutdown:
+            await asyncio.sleep(interval)
+            if not llm_client.enabled or not llm_client.is_idle():
+                continue
+            agent_ids = self._predict_next_agents(self.pregen_batch)
+            try:
+                await asyncio.gather(*(self._pregenerate(agent_id) for agent_id in agent_ids))
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # pragma: no cover - защитный лог
+                logger.exception("Utterance pre-generation failed: %s", exc)
+
+    def _reschedule(self, agent_id: str) -> None:
+        """Назначить агенту следующее пробуждение по его энергии, настроению и активности чатов."""
+        agent = self.world.get_agent(agent_id)
+        if agent is None:
+            return
+        wakeups = self.world.wakeups
+        now = wakeups.clock()
+        activity = max(
+            (wakeups.chat_activity(chat_id, now) for chat_id in self.world.memberships.chats_of(agent_id)),
+            default=0.0,
+        )
+        tenant = self.world.sampler.tenant(self.world.sampler.tenant_of(agent_id))
+        interval = wake_interval(agent.energy, agent.mood, activity, wakeups.base_seconds, wakeups.rng)
+        wakeups.reschedule(agent_id, now + interval / (self.speed * tenant.speed))
+
+    async def step(self, agent_ids: Optional[List[str]] = None) -> None:
+        """
+        Один тик симуляции: выбирает до agents_per_tick агентов и продвигает их параллельно.
+        Каждый агент обрабатывается в собственной сессии, параллелизм ограничен семафором.
+        agent_ids — уже выбранные агенты (событийный планировщик).
+        """
+        if not self.world.loaded:
+            async with self.session_factory() as session:
+                await self.world.ensure_loaded(session)
+        if agent_ids is None:
+            agent_ids = self._pick_agent_ids(self.agents_per_tick)
+        self.ticks += 1
+        if not agent_ids:
+            return
+
+        self._batch = TickBatch()
+        try:
+            if self.scenes_enabled and self.scheduler != "events":
+                # Реплики начатых раньше сцен; сцены, начатые в этом тике, продолжатся в следующем.
+                # В событийном режиме реплики выпускает world_tick() по часам тиков
+                await self._release_scene_turns()
+            await asyncio.gather(*(self._step_agent_guarded(agent_id) for agent_id in agent_ids))
+        finally:
+            batch, self._batch = self._batch, None
+        self.world.sampler.mark_acted(agent_ids)
+        if self.scheduler != "events":
+            # Отдых: уставшие агенты понемногу восстанавливают энергию (одна операция на весь мир).
+            # В событийном режиме step() вызывается на каждую пачку проснувшихся агентов,
+            # поэтому там отдых идёт по часам тиков в world_tick()
+            self.world.recover_energy(self.energy_recovery)
+
+        if not batch.is_empty():
+            await broker.broadcast(batch.as_message())
+
+    async def _emit(self, payload: dict) -> None:
+        """
+        Отправить обновление клиентам: внутри тика — в общий пакет, вне тика — сразу.
+        """
+        if self._batch is not None:
+            self._batch.add(payload)
+        else:
+            await broker.broadcast(payload)
+
+    def _delta_sender(self, event_id: str, agent: AgentState, **meta: Any) -> Optional[Callable[[str], Awaitable[None]]]:
+        """
+        Колбэк для потоковой генерации: каждый фрагмент текста уходит клиентам кадром
+        message_delta с id будущего события. Кадры отправляются сразу, мимо пакета тика,
+        а итоговое event_created с тем же id приходит после коммита.
+        """
+        if not self.stream_messages:
+            return None
+        seq = itertools.count()
+
+        async def send(delta: str) -> None:
+            await broker.broadcast({
+                "type": "message_delta",
+                "data": {"id": event_id, "actor_id": agent.id, "seq": next(seq), "delta": delta, **meta},
+            })
+
+        return send
+
+    async def _step_agent_guarded(self, agent_id: str) -> None:
+        """
+        Обертка над _step_agent: ошибка одного агента не должна срывать весь тик.
+        """
+        agent = self.world.get_agent(agent_id)
+        async with self._step_semaphore:
+            try:
+                # Расход LLM за шаг записывается на агента и его владельца
+                with llm_call_tags(agent_id, agent.user_id if agent else None):
+                    await self._step_agent(agent_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:  # pragma: no cover - защитный лог
+                logger.exception("Simulation step failed for agent %s: %s", agent_id, exc)
+
+    async def _step_agent(self, agent_id: str) -> None:
+        """
+        Шаг агента в три фазы, чтобы соединение из пула не простаивало, пока ждём LLM:
+        1) короткое чтение контекста из БД;
+        2) генерация без открытой сессии;
+        3) одна короткая транзакция со всеми новыми строками (включая план).
+        """
+        agent = self.world.get_agent(agent_id)
+        if not agent:
+            return
+
+        # 60% вероятность общения, из них 40% — попытка ответить на недавнее сообщение.
+        # В остальных случаях агент пишет в групповой чат.
+        wants_reply = random.random() < 0.6 and random.random() < 0.4
+        # С небольшой вероятностью создаем или обновляем планы агента
+        wants_plan = random.random() < 0.15
+
+        # Фаза 1: чтение
+        reply_context: Optional[_ReplyContext] = None
+        needs_plan = False
+        if wants_reply or wants_plan:
+            async with self.session_factory() as session:
+                if wants_reply:
+                    reply_context = await self._load_reply_context(session, agent)
+                if wants_plan:
+                    needs_plan = await self._needs_new_plan(session, agent)
+
+        # Фаза 2: генерация, сессия не удерживается
+        outcome: Optional[_StepOutcome] = None
+        if reply_context is not None:
+            outcome = await self._try_reply_to_message(agent, reply_context)
+        if outcome is None:
+            # Если не удалось ответить, инициируем новое общение
+            outcome = await self._try_agent_chat(agent) or _StepOutcome()
+        plan = self._build_plan(agent) if needs_plan else None
+        if plan is not None:
+            outcome.rows.append(plan)
+
+        # Фаза 3: запись
+        if not outcome.rows:
+            return
         async with self.session_factory() as session:
-            agent = await self._pick_agent(session)
-            if not agent:
-                return
-
-            # 60% вероятность общения (инициация или ответ), 40% - одиночное действие
-            if random.random() < 0.6:
-                # Сначала проверяем, есть ли недавние сообщения для ответа
-                if random.random() < 0.4:
-                    replied = await self._try_reply_to_message(session, agent)
-                    if not replied:
-                        # Если не удалось ответить, инициируем новое общение
-                        await self._try_agent_chat(session, agent)
-                else:
-                    await self._try_agent_chat(session, agent)
-            else:
-                await self._try_agent_chat(session, agent)
+            session.add_all(outcome.rows)
+            await session.commit()
+        if plan is not None:
+            logger.info(f"Создан план для агента {agent.name}: {plan.title} (id: {plan.id})")
+
+        for payload in outcome.updates:
+            await self._emit(payload)
+
+    async def _generate_chat_message(
+            self,
+            agent: AgentState,
+            group_chat: ChatState,
+            on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+    ) -> Optional[str]:
+        """Реплика агента в групповой чат от LLM; None, если LLM выключен или не ответил."""
+        if not llm_client.enabled:
+            return None
+
+        # Воспоминания и недавняя история (по желанию можно добавить фильтр по чату)
+        memory_items = await memory_store.fetch_agent_memories(agent.id, limit=5)
+        memories = [m.description for m in memory_items]
 
-            # С небольшой вероятностью создаем или обновляем планы агента
-            if random.random() < 0.15:  # 15% вероятность создания плана
-                await self._create_or_update_plan(session, agent)
+        return await llm_client.generate_message(
+            sender_name=agent.name,
+            sender_mood=agent.mood,
+            sender_traits=agent.traits or [],
+            receiver_name="участники чата",
+            affinity=0.0,
+            recent_memories=memories,
+            # Вытесненные из бюджета сообщения сворачиваются в резюме чата по conversation_key
+            conversation_history=self.world.recent_chat_messages(group_chat.id),
+            sender_persona=agent.persona or "",
+            receiver_traits=[],
+            topic_hint=_chat_topic(group_chat),
+            on_delta=on_delta,
+            conversation_key=conversation_key("chat", group_chat.id),
+        )
 
-    async def _try_agent_chat(self, session: AsyncSession, agent: Agent) -> None:
+    async def _try_agent_chat(self, agent: AgentState) -> Optional[_StepOutcome]:
         """Попытка агента написать сообщение в общий групповой чат (не адресовано конкретному агенту)."""
         agent_id = _canon_uuid_str(agent.id)
         if not agent_id:
-            return
+            return None
 
         # Выбираем любой групповой чат, в котором состоит агент
-        result_chats = await session.execute(
-            select(group_chat_agents.c.group_chat_id).where(
-                group_chat_agents.c.agent_id == agent_id
-            )
-        )
-        chat_ids = [row[0] for row in result_chats.fetchall()]
-        if not chat_ids:
+        agent_chats = self.world.chats_of(agent_id)
+        if not agent_chats:
             # Если агент не состоит ни в одном чате — просто возвращаемся
             logger.info(f"Агент {agent.name} не состоит ни в одном групповом чате")
-            return
+            return None
 
-        # Берем один чат (можно расширить логикой выбора)
-        group_chat_id = random.choice(chat_ids)
+        # Чаты, где идёт сцена, говорят по сценарию — агент пишет в другие свои чаты
+        if self.scenes_enabled:
+            agent_chats = [c for c in agent_chats if c.id not in self.world.scenes]
+            if not agent_chats:
+                return None
+
+        # Готовая реплика из предгенерации определяет и чат; иначе берём любой чат агента
+        ready = None
+        if self.pregen_enabled:
+            ready = self.world.utterances.take(agent.id, agent.mood, (c.id for c in agent_chats))
+        if ready is not None:
+            group_chat: ChatState = next(c for c in agent_chats if c.id == ready.chat_id)
+        else:
+            group_chat = random.choice(agent_chats)
 
         # Проверяем, что в чате есть кроме него еще хотя бы один агент
-        members_rows = await session.execute(
-            select(group_chat_agents.c.agent_id).where(
-                group_chat_agents.c.group_chat_id == group_chat_id
-            )
-        )
-        member_ids = {str(row[0]) for row in members_rows.fetchall()}
+        member_ids = set(self.world.members_of(group_chat.id))
         # Если в чате только этот агент – считаем, что общаться не с кем и ничего не делаем
         if member_ids <= {agent.id}:
-            return
-        chat_result = await session.execute(
-            select(GroupChat).where(GroupChat.id == group_chat_id)
-        )
-        group_chat = chat_result.scalars().first()
+            return None
+
+        event_id = str(uuid4())
+        message_text: Optional[str] = None
+        scene_meta: Optional[dict] = None
+        if ready is not None:
+            message_text = ready.text
+        elif self.scenes_enabled:
+            # Сцена: одним запросом диалог на несколько тиков, первая реплика — сейчас
+            scene = await self._start_scene(agent, group_chat, member_ids)
+            turn = self.world.scenes.pop(scene) if scene is not None else None
+            if turn is not None:
+                speaker = self.world.get_agent(turn.speaker_id)
+                if speaker is not None:
+                    agent, message_text, scene_meta = speaker, turn.text, scene.meta()
+        if message_text is None:
+            message_text = await self._generate_chat_message(
+                agent,
+                group_chat,
+                on_delta=self._delta_sender(event_id, agent, group_chat_id=str(group_chat.id)),
+            )
+
+        return await self._post_chat_message(agent, group_chat, member_ids, message_text, event_id, scene_meta)
+
+    async def _start_scene(self, agent: AgentState, group_chat: ChatState, member_ids: set) -> Optional[Scene]:
+        """
+        Запросить у LLM сцену в чате: agent начинает, с ним до SIMULATION_SCENE_MAX_SPEAKERS - 1
+        случайных участников. None — LLM выключен или ответ не разобран.
+        """
+        if not llm_client.enabled:
+            return None
+        others = [a for a in (self.world.get_agent(m) for m in member_ids if m != agent.id) if a is not None]
+        if not others:
+            return None
+        speakers = [agent, *random.sample(others, min(len(others), self.scene_max_speakers - 1))]
 
-        # Воспоминания и недавняя история (по желанию можно добавить фильтр по чату)
         memory_items = await memory_store.fetch_agent_memories(agent.id, limit=5)
-        memories = [m.description for m in memory_items]
+        reply = await llm_client.generate_scene(
+            topic_hint=_chat_topic(group_chat),
+            speakers=[
+                {"name": a.name, "mood": a.mood, "traits": a.traits or [], "persona": a.persona or ""}
+                for a in speakers
+            ],
+            turns=self.scene_turns,
+            recent_memories=[m.description for m in memory_items],
+        )
+        turns = parse_scene_reply(reply, {a.name: a.id for a in speakers}) if reply else None
+        if turns is None:
+            if reply:
+                self.world.scenes.note_failed()
+                logger.info("Сцена для чата %s не разобрана, агент %s пишет обычную реплику", group_chat.name, agent.name)
+            return None
+        return self.world.scenes.start(group_chat.id, turns[:self.scene_turns])
 
-        # Генерируем сообщение через LLM на тему чата
-        message_text: Optional[str] = None
-        # Создаем полный контекст чата
-        topic = f"Чат: {group_chat.name}"
-        if group_chat.description:
-            topic += f" - {group_chat.description}"
-        else:
-            topic += " - общение в чате"
+    async def _release_scene_turns(self) -> None:
+        """
+        Выпустить по одной реплике каждой идущей сцены: событие от имени автора реплики,
+        как если бы он сам написал в чат. Авторы на паузе ждут, ушедшие из чата пропускаются.
+        """
+        scenes = self.world.scenes
+        sampler = self.world.sampler
+        releases = []
+        for scene in scenes.active():
+            group_chat = self.world.chats.get(scene.chat_id)
+            if group_chat is None:
+                scenes.drop(scene.chat_id)
+                continue
+            member_ids = set(self.world.members_of(scene.chat_id))
+            while scene.turns:
+                turn = scene.turns[0]
+                speaker = self.world.get_agent(turn.speaker_id)
+                if speaker is not None and speaker.id in member_ids:
+                    break
+                scenes.pop(scene, skip=True)
+            if not scene.turns:
+                scenes.drop(scene.chat_id)
+                continue
+            if sampler.tenant(sampler.tenant_of(speaker.id)).paused:
+                continue
+            scenes.pop(scene)
+            releases.append(self._release_scene_turn(speaker, group_chat, member_ids, turn.text, scene.meta()))
+        if releases:
+            await asyncio.gather(*releases)
+
+    async def _release_scene_turn(
+            self,
+            speaker: AgentState,
+            group_chat: ChatState,
+            member_ids: set,
+            text: str,
+            scene_meta: dict,
+    ) -> None:
+        try:
+            outcome = await self._post_chat_message(speaker, group_chat, member_ids, text, str(uuid4()), scene_meta)
+            async with self.session_factory() as session:
+                session.add_all(outcome.rows)
+                await session.commit()
+            for payload in outcome.updates:
+                await self._emit(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # pragma: no cover - защитный лог
+            logger.exception("Scene turn release failed in chat %s: %s", group_chat.id, exc)
+
+    async def _post_chat_message(
+            self,
+            agent: AgentState,
+            group_chat: ChatState,
+            member_ids: set,
+            message_text: Optional[str],
+            event_id: str,
+            scene_meta: Optional[dict] = None,
+    ) -> _StepOutcome:
+        """
+        Сообщение агента в групповой чат: событие, отношения и настроение участников,
+        взаимодействия и воспоминание. scene_meta — поля реплики сцены для metadata_json.
+        """
+        topic = _chat_topic(group_chat)
         topic_source = "групповой чат"
 
-        if llm_client.enabled:
-            message_text = await llm_client.generate_message(
-                sender_name=agent.name,
-                sender_mood=agent.mood,
-                sender_traits=agent.traits or [],
-                receiver_name="участники чата",
-                affinity=0.0,
-                recent_memories=memories,
-                conversation_history=[],
-                sender_persona=agent.persona or "",
-                receiver_traits=[],
-                topic_hint=topic,
-            )
-
         # Fallback если LLM не сработал
         if not message_text:
             message_text = f"Поделился мыслью в чате: {topic}"
 
+        outcome = _StepOutcome()
+
         # Создаем групповое событие общения (без конкретного получателя)
         event_text = f"{agent.name} написал в чат «{group_chat.name}»: «{message_text}»"
-        event = Event(
+        event = _new_event(
+            id=event_id,
             description=event_text,
             actor_id=agent.id,
             target_id=None,
@@ -241,6 +754,7 @@ class SimulationEngine:
                     "topic": topic,
                     "topic_source": topic_source,
                     "group_chat_id": str(group_chat.id),
+                    **(scene_meta or {}),
                 }
             ),
         )
@@ -251,33 +765,30 @@ class SimulationEngine:
         agent.mood = max(0.0, min(1.0, agent.mood + mood_delta))
         agent.energy = max(0, min(100, agent.energy + energy_delta))
         agent.current_task = f"общается в чате «{group_chat.name}»"
+        self.world.mark_agent_dirty(agent.id)
+        # Оживлённый чат будит своих участников чаще, а заготовленные реплики в нём устаревают
+        self.world.note_chat_message(group_chat.id, agent.name, message_text)
 
-        session.add(agent)
-        session.add(event)
+        outcome.rows.append(event)
 
         # Создаем/обновляем отношения между отправителем и всеми участниками чата
         # Также создаем взаимодействия для всех участников и обновляем их настроение
         relationships_to_update = []
-        interactions_to_create = []
 
-        # Получаем объекты всех участников чата для обновления их настроения
-        member_agents_result = await session.execute(
-            select(Agent).where(Agent.id.in_([mid for mid in member_ids if mid != agent.id]))
-        )
-        member_agents = member_agents_result.scalars().all()
+        # Участники чата (кроме отправителя) и их отношение к отправителю — для обновления настроения
+        member_agents: List[AgentState] = []
+        member_affinities: List[float] = []
 
         for member_id in member_ids:
             if member_id != agent.id:
                 try:
                     # Получаем объект участника
-                    member_agent = next((a for a in member_agents if str(a.id) == member_id), None)
+                    member_agent = self.world.get_agent(member_id)
                     if not member_agent:
                         continue
 
                     # Создаем/обновляем отношения
-                    relationship = await self._get_or_create_relationship(
-                        session, agent.id, member_id
-                    )
+                    relationship = self.world.get_or_create_relation(agent.id, member_id)
 
                     # Влияние сообщения на настроение и отношения зависит от контекста
                     # Положительные сообщения улучшают отношения, отрицательные - ухудшают
@@ -290,35 +801,36 @@ class SimulationEngine:
 
                     relationship.affinity = max(-1.0, min(1.0, relationship.affinity + affinity_delta))
                     relationship.strength = min(1.0, relationship.strength + 0.01)
-                    session.add(relationship)
+                    self.world.mark_relation_dirty(relationship)
                     relationships_to_update.append((member_id, relationship))
+                    member_agents.append(member_agent)
+                    member_affinities.append(relationship.affinity)
 
                     # Создаем взаимодействие для участника чата
-                    interaction = Interaction(
-                        agent_id=member_id,
-                        partner=agent.name,
-                        description=f"Услышал сообщение в чате «{group_chat.name}»: {message_text[:100]}",
+                    outcome.rows.append(
+                        Interaction(
+                            agent_id=member_id,
+                            partner=agent.name,
+                            description=f"Услышал сообщение в чате «{group_chat.name}»: {message_text[:100]}",
+                        )
                     )
-                    session.add(interaction)
-                    interactions_to_create.append(interaction)
-
-                    # Обновляем настроение участника на основе отношения к отправителю
-                    # Если отношения хорошие, настроение улучшается, если плохие - ухудшается
-                    mood_influence = relationship.affinity * 0.02  # Влияние от -0.02 до +0.02
-                    member_agent.mood = max(0.0, min(1.0, member_agent.mood + mood_influence))
-                    member_agent.energy = max(0, min(100, member_agent.energy - 1))  # Небольшая трата энергии
-                    session.add(member_agent)
 
                 except Exception as e:
                     logger.warning(f"Ошибка при обновлении отношения с {member_id}: {e}")
 
+        # Обновляем настроение участников на основе отношения к отправителю одной операцией:
+        # если отношения хорошие, настроение улучшается, если плохие — ухудшается (от -0.02 до +0.02),
+        # плюс небольшая трата энергии
+        self.world.apply_chat_influence([m.id for m in member_agents], member_affinities)
+
         # Создаем взаимодействие для отправителя
-        sender_interaction = Interaction(
-            agent_id=agent.id,
-            partner=f"участники чата «{group_chat.name}»",
-            description=f"Написал в чат «{group_chat.name}»: {message_text[:100]}",
+        outcome.rows.append(
+            Interaction(
+                agent_id=agent.id,
+                partner=f"участники чата «{group_chat.name}»",
+                description=f"Написал в чат «{group_chat.name}»: {message_text[:100]}",
+            )
         )
-        session.add(sender_interaction)
 
         # Улучшаем влияние сообщения на настроение отправителя на основе успешного общения
         # Если в чате много участников, настроение улучшается больше
@@ -334,7 +846,7 @@ class SimulationEngine:
                 description=f"Общался в чате «{group_chat.name}»: {message_text}",
                 emotion=self._emotion_from_mood(agent.mood),
             )
-            session.add(
+            outcome.rows.append(
                 Memory(
                     agent_id=agent.id,
                     description=memory_payload.description,
@@ -344,30 +856,18 @@ class SimulationEngine:
                 )
             )
 
-        await session.commit()
-        await session.refresh(event)
-
-        # Broadcast события
-        await broker.broadcast(
-            {
-                "type": "event_created",
-                "data": {
-                    "id": event.id,
-                    "description": event.description,
-                    "timestamp": event.created_at.isoformat(),
-                },
-            }
-        )
-        await broker.broadcast(
+        # Обновления для клиентов; рассылаются после коммита
+        outcome.updates.append(_event_created(event))
+        outcome.updates.append(
             {
                 "type": "agent_update",
                 "data": {"id": agent.id, "mood": agent.mood, "energy": agent.energy},
             }
         )
 
-        # Broadcast обновления отношений
+        # Обновления отношений
         for member_id, relationship in relationships_to_update:
-            await broker.broadcast(
+            outcome.updates.append(
                 {
                     "type": "relation_changed",
                     "data": {
@@ -379,9 +879,9 @@ class SimulationEngine:
                 }
             )
 
-        # Broadcast обновления настроения для всех участников чата
+        # Обновления настроения для всех участников чата
         for member_agent in member_agents:
-            await broker.broadcast(
+            outcome.updates.append(
                 {
                     "type": "agent_update",
                     "data": {"id": str(member_agent.id), "mood": member_agent.mood, "energy": member_agent.energy},
@@ -389,16 +889,17 @@ class SimulationEngine:
             )
 
         if memory_payload:
-            await broker.broadcast(
+            outcome.updates.append(
                 {
                     "type": "memory_created",
                     "data": {"agent_id": agent.id, **memory_payload.as_response()},
                 }
             )
+        return outcome
 
-    async def _pick_agent(self, session: AsyncSession) -> Optional[Agent]:
-        result = await session.execute(select(Agent).order_by(func.random()).limit(1))
-        return result.scalars().first()
+    def _pick_agent_ids(self, limit: int) -> List[str]:
+        """Выбирает до limit различных агентов для текущего тика (без запросов к БД)."""
+        return self.world.sampler.sample(limit)
 
     @staticmethod
     def _emotion_from_mood(mood: float) -> str:
@@ -408,51 +909,29 @@ class SimulationEngine:
             return "нейтральное"
         return "отрицательное"
 
-    async def _pick_chat_target(self, session: AsyncSession, agent: Agent) -> Optional[Agent]:
+    async def _pick_chat_target(self, agent: AgentState) -> Optional[AgentState]:
         """Выбирает собеседника для агента на основе отношений и случайности."""
         # Сначала пытаемся общаться с агентами, с которыми есть общий групповой чат
-        # Получаем ID чатов, в которых состоит агент
         agent_id = _canon_uuid_str(agent.id) or str(agent.id)
-        result_chats = await session.execute(
-            select(group_chat_agents.c.group_chat_id).where(
-                group_chat_agents.c.agent_id == agent_id
-            )
-        )
-        chat_ids = [row[0] for row in result_chats.fetchall()]
-
-        chat_peers: List[Agent] = []
-        if chat_ids:
-            # Получаем ID агентов из этих чатов (кроме самого агента)
-            result_peers = await session.execute(
-                select(group_chat_agents.c.agent_id).where(
-                    group_chat_agents.c.group_chat_id.in_(chat_ids)
-                )
-            )
-            peer_ids = {str(row[0]) for row in result_peers.fetchall() if str(row[0]) != agent.id}
-
-            if peer_ids:
-                result_agents = await session.execute(
-                    select(Agent).where(Agent.id.in_(list(peer_ids)))
-                )
-                chat_peers = result_agents.scalars().all()
+        peer_ids: set[str] = set()
+        for chat_id in self.world.memberships.chats_of(agent_id):
+            peer_ids.update(self.world.members_of(chat_id))
+        peer_ids.discard(agent.id)
+        chat_peers = [a for a in (self.world.get_agent(pid) for pid in peer_ids) if a is not None]
 
         # Если есть собеседники по чату — используем только их, иначе все остальные
         if chat_peers:
             candidates = chat_peers
         else:
-            result = await session.execute(
-                select(Agent).where(Agent.id != agent.id)
-            )
-            candidates = result.scalars().all()
+            candidates = [a for a in self.world.agents.values() if a.id != agent.id]
 
         if not candidates:
             return None
 
         # Получаем отношения
-        rel_result = await session.execute(
-            select(Relationship).where(Relationship.source_agent_id == agent.id)
-        )
-        relationships = {rel.target_agent_id: rel.affinity for rel in rel_result.scalars().all()}
+        relationships = {
+            target_id: rel.affinity for target_id, rel in self.world.relations_from(agent.id).items()
+        }
 
         # Взвешенный выбор: предпочитаем агентов с положительными отношениями,
         # но иногда выбираем случайно для разнообразия
@@ -475,29 +954,8 @@ class SimulationEngine:
         # Если по каким-то причинам не удалось выбрать по весам — возвращаем случайного кандидата
         return random.choice(candidates) if candidates else None
 
-    async def _get_or_create_relationship(
-            self, session: AsyncSession, source_id: str, target_id: str
-    ) -> Relationship:
-        """Получает или создает отношение между агентами."""
-        result = await session.execute(
-            select(Relationship).where(
-                Relationship.source_agent_id == source_id,
-                Relationship.target_agent_id == target_id,
-            )
-        )
-        rel = result.scalars().first()
-        if not rel:
-            rel = Relationship(
-                source_agent_id=source_id,
-                target_agent_id=target_id,
-                affinity=0.0,
-                strength=0.5,
-            )
-            session.add(rel)
-        return rel
-
-    async def _try_reply_to_message(self, session: AsyncSession, agent: Agent) -> bool:
-        """Пытается ответить на недавнее сообщение от другого агента."""
+    async def _load_reply_context(self, session: AsyncSession, agent: AgentState) -> Optional[_ReplyContext]:
+        """Читает последнее адресованное агенту сообщение и историю общения с его автором."""
         # Ищем недавние события-чаты, где этот агент был получателем
         recent_time = datetime.utcnow() - timedelta(minutes=5)
 
@@ -514,24 +972,27 @@ class SimulationEngine:
         recent_event = result.scalars().first()
 
         if not recent_event or not recent_event.actor_id:
-            return False
+            return None
 
         # Получаем отправителя
-        sender_result = await session.execute(
-            select(Agent).where(Agent.id == recent_event.actor_id)
-        )
-        sender = sender_result.scalars().first()
+        sender = self.world.get_agent(recent_event.actor_id)
         if not sender:
-            return False
-
-        # Получаем или создаем отношение
-        relationship = await self._get_or_create_relationship(session, agent.id, sender.id)
+            return None
 
         # Получаем историю общения
         recent_interactions = await self._get_recent_interactions(session, agent.id, sender.name)
+        return _ReplyContext(event=recent_event, sender=sender, interactions=recent_interactions)
+
+    async def _try_reply_to_message(self, agent: AgentState, context: _ReplyContext) -> Optional[_StepOutcome]:
+        """Отвечает на недавнее сообщение от другого агента (контекст прочитан в фазе чтения)."""
+        recent_event, sender = context.event, context.sender
+
+        # Получаем или создаем отношение
+        relationship = self.world.get_or_create_relation(agent.id, sender.id)
+
         conversation_history = [
             {"from": i.partner or sender.name, "text": i.description}
-            for i in recent_interactions[-5:]
+            for i in context.interactions[-5:]
         ]
         # Добавляем последнее сообщение от отправителя
         if recent_event.description:
@@ -547,6 +1008,7 @@ class SimulationEngine:
 
         # Генерируем ответ через LLM
         reply_text: Optional[str] = None
+        event_id = str(uuid4())
         if llm_client.enabled:
             reply_text = await llm_client.generate_message(
                 sender_name=agent.name,
@@ -558,6 +1020,8 @@ class SimulationEngine:
                 conversation_history=conversation_history,
                 sender_persona=agent.persona or "",
                 receiver_traits=sender.traits or [],
+                on_delta=self._delta_sender(event_id, agent, target_id=sender.id),
+                conversation_key=conversation_key(agent.id, sender.id),
             )
 
         # Fallback
@@ -571,7 +1035,8 @@ class SimulationEngine:
 
         # Создаем событие ответа
         event_text = f"{agent.name} ответил {sender.name}: «{reply_text}»"
-        event = Event(
+        event = _new_event(
+            id=event_id,
             description=event_text,
             actor_id=agent.id,
             target_id=sender.id,
@@ -596,11 +1061,12 @@ class SimulationEngine:
         affinity_delta = random.uniform(0.02, 0.08) if relationship.affinity >= 0 else random.uniform(-0.05, 0.02)
         relationship.affinity = max(-1.0, min(1.0, relationship.affinity + affinity_delta))
         relationship.strength = min(1.0, relationship.strength + 0.01)
+        self.world.mark_agent_dirty(agent.id)
+        self.world.mark_relation_dirty(relationship)
+        # Собеседник получил ответ — будим его, чтобы он мог продолжить разговор
+        self.world.wakeups.wake_now([sender.id])
 
-        session.add(agent)
-        session.add(event)
-        session.add(interaction)
-        session.add(relationship)
+        outcome = _StepOutcome(rows=[event, interaction])
 
         # Сохраняем в память
         memory_payload = None
@@ -610,7 +1076,7 @@ class SimulationEngine:
                 description=f"Ответил {sender.name}: {reply_text}",
                 emotion=self._emotion_from_mood(agent.mood),
             )
-            session.add(
+            outcome.rows.append(
                 Memory(
                     agent_id=agent.id,
                     description=memory_payload.description,
@@ -620,27 +1086,15 @@ class SimulationEngine:
                 )
             )
 
-        await session.commit()
-        await session.refresh(event)
-
-        # Broadcast
-        await broker.broadcast(
-            {
-                "type": "event_created",
-                "data": {
-                    "id": event.id,
-                    "description": event.description,
-                    "timestamp": event.created_at.isoformat(),
-                },
-            }
-        )
-        await broker.broadcast(
+        # Обновления для клиентов; рассылаются после коммита
+        outcome.updates.append(_event_created(event))
+        outcome.updates.append(
             {
                 "type": "agent_update",
                 "data": {"id": agent.id, "mood": agent.mood, "energy": agent.energy},
             }
         )
-        await broker.broadcast(
+        outcome.updates.append(
             {
                 "type": "relation_changed",
                 "data": {
@@ -653,14 +1107,14 @@ class SimulationEngine:
         )
 
         if memory_payload:
-            await broker.broadcast(
+            outcome.updates.append(
                 {
                     "type": "memory_created",
                     "data": {"agent_id": agent.id, **memory_payload.as_response()},
                 }
             )
 
-        return True
+        return outcome
 
     async def _get_recent_interactions(
             self, session: AsyncSession, agent_id: str, partner_name: str, limit: int = 5
@@ -676,7 +1130,7 @@ class SimulationEngine:
         )
         return list(result.scalars().all())
 
-    async def _build_action_text(self, session: AsyncSession, agent: Agent) -> str:
+    async def _build_action_text(self, session: AsyncSession, agent: AgentState) -> str:
         """
         Пытаемся получить действие от LLM, иначе fallback на рандом.
         """
@@ -697,95 +1151,86 @@ class SimulationEngine:
             return f"{agent.name} {llm_text}"
         return f"{agent.name} {agent.current_task}"
 
-    async def _create_or_update_plan(self, session: AsyncSession, agent: Agent) -> None:
+    async def _needs_new_plan(self, session: AsyncSession, agent: AgentState) -> bool:
         """
-        Создает или обновляет план для агента на основе его текущего состояния и воспоминаний.
+        Нужен ли агенту новый план: активных планов нет или (с небольшой вероятностью) пора сменить.
         """
         # Проверяем, есть ли у агента активные планы
         result = await session.execute(
-            select(Plan).where(
+            select(Plan.id).where(
                 Plan.agent_id == agent.id,
                 Plan.status.in_(["active", "planned", "in-progress"])
             ).limit(1)
         )
         existing_plan = result.scalars().first()
+        return not existing_plan or random.random() < 0.1
 
-        # Если планов нет или с небольшой вероятностью создаем новый
-        if not existing_plan or random.random() < 0.1:
-            # Получаем контекст чата для более релевантных планов
-            group_chat = await self._get_agent_chat(session, agent)
-            chat_name = group_chat.name if group_chat else "город"
-
-            # Генерируем план на основе текущего состояния агента
-            plan_titles_positive = [
-                "Изучить новые технологии",
-                "Улучшить отношения с другими агентами",
-                f"Исследовать {chat_name}",
-                "Развить навыки общения",
-                "Найти интересные места в городе",
-                "Помочь другим агентам",
-                "Изучить историю кибер-города",
-            ]
-
-            plan_titles_neutral = [
-                "Изучить новые технологии",
-                "Улучшить отношения с другими агентами",
-                f"Исследовать {chat_name}",
-                "Развить навыки общения",
-                "Найти интересные места",
-            ]
-
-            plan_titles_negative = [
-                "Улучшить настроение",
-                "Найти поддержку",
-                "Отдохнуть",
-                "Разобраться в проблемах",
-                "Восстановить энергию",
-            ]
-
-            plan_descriptions = [
-                "Агент планирует изучить новые технологии и улучшить свои навыки",
-                "Агент хочет улучшить отношения с другими участниками города",
-                "Агент планирует исследовать различные места и найти что-то интересное",
-                "Агент хочет развить свои навыки общения и взаимодействия",
-                "Агент планирует помочь другим агентам в их делах",
-            ]
-
-            # Выбираем план на основе настроения и энергии
-            if agent.mood > 0.7:
-                plan_title = random.choice(plan_titles_positive)
-            elif agent.mood < 0.4:
-                plan_title = random.choice(plan_titles_negative)
-            else:
-                plan_title = random.choice(plan_titles_neutral)
+    def _build_plan(self, agent: AgentState) -> Plan:
+        """
+        Создает план для агента на основе его текущего состояния.
+        Строка записывается в БД в общей транзакции шага агента.
+        """
+        # Получаем контекст чата для более релевантных планов
+        group_chat = self._get_agent_chat(agent)
+        chat_name = group_chat.name if group_chat else "город"
+
+        # Генерируем план на основе текущего состояния агента
+        plan_titles_positive = [
+            "Изучить новые технологии",
+            "Улучшить отношения с другими агентами",
+            f"Исследовать {chat_name}",
+            "Развить навыки общения",
+            "Найти интересные места в городе",
+            "Помочь другим агентам",
+            "Изучить историю кибер-города",
+        ]
 
-            plan_description = random.choice(plan_descriptions)
+        plan_titles_neutral = [
+            "Изучить новые технологии",
+            "Улучшить отношения с другими агентами",
+            f"Исследовать {chat_name}",
+            "Развить навыки общения",
+            "Найти интересные места",
+        ]
 
-            plan = Plan(
-                agent_id=agent.id,
-                title=plan_title,
-                description=plan_description,
-                status="active" if random.random() < 0.7 else "planned",
-            )
-            session.add(plan)
-            await session.commit()
-            await session.refresh(plan)
-            logger.info(f"Создан план для агента {agent.name}: {plan_title} (id: {plan.id})")
+        plan_titles_negative = [
+            "Улучшить настроение",
+            "Найти поддержку",
+            "Отдохнуть",
+            "Разобраться в проблемах",
+            "Восстановить энергию",
+        ]
+
+        plan_descriptions = [
+            "Агент планирует изучить новые технологии и улучшить свои навыки",
+            "Агент хочет улучшить отношения с другими участниками города",
+            "Агент планирует исследовать различные места и найти что-то интересное",
+            "Агент хочет развить свои навыки общения и взаимодействия",
+            "Агент планирует помочь другим агентам в их делах",
+        ]
 
-    async def _get_agent_chat(self, session: AsyncSession, agent: Agent) -> Optional[GroupChat]:
+        # Выбираем план на основе настроения и энергии
+        if agent.mood > 0.7:
+            plan_title = random.choice(plan_titles_positive)
+        elif agent.mood < 0.4:
+            plan_title = random.choice(plan_titles_negative)
+        else:
+            plan_title = random.choice(plan_titles_neutral)
+
+        plan_description = random.choice(plan_descriptions)
+
+        plan = Plan(
+            agent_id=agent.id,
+            title=plan_title,
+            description=plan_description,
+            status="active" if random.random() < 0.7 else "planned",
+        )
+        return plan
+
+    def _get_agent_chat(self, agent: AgentState) -> Optional[ChatState]:
         """Получает первый групповой чат агента для контекста."""
         agent_id = _canon_uuid_str(agent.id)
         if not agent_id:
             return None
-        result_chats = await session.execute(
-            select(group_chat_agents.c.group_chat_id).where(
-                group_chat_agents.c.agent_id == agent_id
-            ).limit(1)
-        )
-        chat_ids = [row[0] for row in result_chats.fetchall()]
-        if chat_ids:
-            chat_result = await session.execute(
-                select(GroupChat).where(GroupChat.id == chat_ids[0])
-            )
-            return chat_result.scalars().first()
-        return None
+        chats = self.world.chats_of(agent_id)
+        return chats[0] if chats else None
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+"""
+Планировщик тиков с компенсацией дрейфа.
+
+Тики привязаны к расписанию t0 + k * period по монотонным часам, а не к
+"period после окончания предыдущего тика": длинный шаг не растягивает период.
+Если тик не уложился в период (overrun), политика решает, что делать с
+пропущенными дедлайнами:
+
+- catch_up — выполнять пропущенные тики подряд без пауз, но не больше
+  max_catch_up штук; остальные пропускаются;
+- skip     — пропустить все просроченные дедлайны и продолжить со следующего.
+"""
+
+import math
+import time
+from typing import Callable
+
+POLICIES = ("catch_up", "skip")
+
+
+class TickClock:
+    """
+    Расписание тиков и метрики отставания от реального времени.
+    """
+
+    def __init__(
+            self,
+            policy: str = "skip",
+            max_catch_up: int = 5,
+            clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.policy = policy if policy in POLICIES else "skip"
+        self.max_catch_up = max(0, max_catch_up)
+        self._clock = clock
+        self._deadline = clock()
+        # Насколько последний тик начался позже своего дедлайна
+        self.lag_seconds = 0.0
+        # Тики, которые не уложились в период, и пропущенные политикой дедлайны
+        self.overruns = 0
+        self.skipped = 0
+
+    def reset(self) -> None:
+        """Начать расписание заново (после паузы), не считая паузу отставанием."""
+        self._deadline = self._clock()
+        self.lag_seconds = 0.0
+
+    def tick_started(self) -> None:
+        self.lag_seconds = max(0.0, self._clock() - self._deadline)
+
+    def tick_finished(self, period: float) -> float:
+        """
+        Сдвинуть дедлайн на следующий тик. Возвращает, сколько ждать до него.
+        """
+        now = self._clock()
+        self._deadline += period
+        late = now - self._deadline
+        if late <= 0:
+            return -late
+
+        self.overruns += 1
+        if self.policy == "skip":
+            missed = math.ceil(late / period)
+            self.skipped += missed
+            self._deadline += missed * period
+            return self._deadline - now
+
+        # catch_up: догоняем без пауз, но отставание не больше max_catch_up периодов
+        missed = int(late // period)
+        if missed > self.max_catch_up:
+            dropped = missed - self.max_catch_up
+            self.skipped += dropped
+            self._deadline += dropped * period
+        return 0.0
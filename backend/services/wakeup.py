@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+"""
+Дискретно-событийное планирование агентов (SIMULATION_SCHEDULER=events).
+
+Вместо опроса случайных агентов каждый тик у каждого агента есть время
+следующего пробуждения. Время хранится в куче с ленивым удалением устаревших
+записей: перепланирование — это новая запись в куче, а старая пропускается при
+извлечении. Интервал до пробуждения зависит от энергии и настроения агента и от
+активности в его чатах; агент, которому пришло сообщение, будится сразу.
+Цикл симуляции спит до ближайшего пробуждения или до сигнала wake_now().
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Период полураспада счётчика активности чата, секунды
+ACTIVITY_HALF_LIFE = 60.0
+
+
+def wake_interval(
+        energy: float,
+        mood: float,
+        chat_activity: float,
+        base_seconds: float,
+        rng: Optional[random.Random] = None,
+) -> float:
+    """
+    Интервал до следующего пробуждения агента:
+    - энергичные агенты просыпаются чаще (x0.5 при 100 энергии, x1.5 при 0);
+    - сильные эмоции в обе стороны ускоряют агента (до x0.7);
+    - оживлённые чаты ускоряют пропорционально недавним сообщениям;
+    - ±20% случайного разброса, чтобы агенты не просыпались строем.
+    """
+    rng = rng or random
+    energy_factor = 1.5 - max(0.0, min(100.0, energy)) / 100.0
+    mood_factor = 1.0 - 0.6 * abs(max(0.0, min(1.0, mood)) - 0.5)
+    activity_factor = 1.0 / (1.0 + max(0.0, chat_activity))
+    return base_seconds * energy_factor * mood_factor * activity_factor * rng.uniform(0.8, 1.2)
+
+
+class WakeScheduler:
+    """
+    Куча времён пробуждения агентов и сигнал для спящего цикла симуляции.
+    """
+
+    def __init__(
+            self,
+            base_seconds: float = 20.0,
+            clock: Callable[[], float] = time.monotonic,
+            rng: Optional[random.Random] = None,
+    ) -> None:
+        self.base_seconds = max(0.1, base_seconds)
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        # Актуальное время пробуждения; агент, которого сейчас обрабатывают, здесь отсутствует
+        self._wake_at: Dict[str, float] = {}
+        self._agents: set[str] = set()
+        self._activity: Dict[uuid.UUID, Tuple[float, float]] = {}
+        self._signal = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+    def __contains__(self, agent_id: str) -> bool:
+        return agent_id in self._agents
+
+    def clear(self) -> None:
+        self._heap.clear()
+        self._wake_at.clear()
+        self._agents.clear()
+        self._activity.clear()
+
+    # ----- Агенты -----
+
+    def add(self, agent_id: str) -> None:
+        """Новый агент просыпается в случайный момент в пределах базового интервала."""
+        if agent_id in self._agents:
+            return
+        self._agents.add(agent_id)
+        self.schedule(agent_id, self.clock() + self.rng.uniform(0.0, self.base_seconds))
+
+    def remove(self, agent_id: str) -> None:
+        self._agents.discard(agent_id)
+        self._wake_at.pop(agent_id, None)
+
+    def schedule(self, agent_id: str, at: float) -> None:
+        if agent_id not in self._agents:
+            return
+        earliest = self.next_wake_at()
+        self._wake_at[agent_id] = at
+        heapq.heappush(self._heap, (at, next(self._seq), agent_id))
+        if earliest is None or at < earliest:
+            # Цикл спит дольше, чем нужно, — будим его пересчитать паузу
+            self._signal.set()
+
+    def reschedule(self, agent_id: str, at: float) -> None:
+        """Запланировать после шага, не откладывая уже назначенное более раннее пробуждение."""
+        current = self._wake_at.get(agent_id)
+        if current is None or at < current:
+            self.schedule(agent_id, at)
+
+    def wake_now(self, agent_ids: Iterable[str]) -> None:
+        """Агентам пришло сообщение: разбудить их немедленно."""
+        now = self.clock()
+        for agent_id in agent_ids:
+            agent_id = str(agent_id)
+            current = self._wake_at.get(agent_id)
+            if current is None or current > now:
+                self.schedule(agent_id, now)
+
+    def wake_at_of(self, agent_id: str) -> Optional[float]:
+        return self._wake_at.get(agent_id)
+
+    # ----- Извлечение -----
+
+    def _drop_stale(self) -> None:
+        heap = self._heap
+        while heap and self._wake_at.get(heap[0][2]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def next_wake_at(self) -> Optional[float]:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def upcoming(self, limit: int) -> List[str]:
+        """До limit агентов с ближайшими временами пробуждения (без извлечения)."""
+        found: List[str] = []
+        # Устаревшие записи кучи тоже попадут в выборку — берём с запасом на них
+        stale = len(self._heap) - len(self._wake_at)
+        for at, _, agent_id in heapq.nsmallest(limit + stale, self._heap):
+            if self._wake_at.get(agent_id) == at and agent_id not in found:
+                found.append(agent_id)
+                if len(found) >= limit:
+                    break
+        return found
+
+    def pop_due(self, now: float) -> Optional[Tuple[str, float]]:
+        """Извлечь агента, чьё время пробуждения наступило: (agent_id, время пробуждения)."""
+        self._drop_stale()
+        if not self._heap or self._heap[0][0] > now:
+            return None
+        at, _, agent_id = heapq.heappop(self._heap)
+        del self._wake_at[agent_id]
+        return agent_id, at
+
+    async def wait(self, timeout: float) -> None:
+        """Спать timeout секунд или до сигнала (новое раннее пробуждение)."""
+        if timeout > 0 and not self._signal.is_set():
+            try:
+                await asyncio.wait_for(self._signal.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._signal.clear()
+
+    # ----- Активность чатов -----
+
+    def note_chat_activity(self, chat_id: uuid.UUID, weight: float = 1.0) -> None:
+        now = self.clock()
+        self._activity[chat_id] = (self.chat_activity(chat_id, now) + weight, now)
+
+    def chat_activity(self, chat_id: uuid.UUID, now: Optional[float] = None) -> float:
+        """Число недавних сообщений в чате с экспоненциальным затуханием."""
+        value, stamp = self._activity.get(chat_id, (0.0, 0.0))
+        if not value:
+            return 0.0
+        now = self.clock() if now is None else now
+        return value * math.pow(0.5, max(0.0, now - stamp) / ACTIVITY_HALF_LIFE)
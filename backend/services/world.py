@@ -0,0 +1,559 @@
+from __future__ import annotations
+
+"""
+In-memory модель мира для цикла симуляции.
+
+WorldState держит агентов, групповые чаты с индексом участников и отношения между агентами.
+Симуляция читает и изменяет их напрямую в памяти, а изменённые ("грязные")
+строки периодически сбрасываются в БД пачкой (write-behind).
+Роутеры, меняющие эти данные через API, поддерживают модель в актуальном
+состоянии через хуки upsert_*/remove_*.
+"""
+
+import logging
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+from uuid import uuid4
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.database.postgr.models import Agent, GroupChat, Relationship, SimulationTenant
+from backend.database.postgr.models.groupchat import group_chat_agents
+from backend.project_config import settings
+from backend.services.dynamics import AgentArrays
+from backend.services.membership import MembershipIndex
+from backend.services.pregen import UtterancePool
+from backend.services.relations import upsert_relationships
+from backend.services.scenes import ScenePool
+from backend.services.fairshare import FairShareScheduler, TenantState
+from backend.services.sharding import shard_of
+from backend.services.wakeup import WakeScheduler
+
+logger = logging.getLogger(__name__)
+
+RelationKey = Tuple[str, str]
+
+# Сколько последних сообщений группового чата держим в памяти для истории промпта
+CHAT_HISTORY_SIZE = 20
+
+
+class AgentState:
+    """
+    Агент в памяти. Пока агент принадлежит миру, mood и energy хранятся в общих
+    массивах WorldState.arrays по его слоту; отдельный AgentState держит их в себе.
+    """
+
+    __slots__ = ("id", "user_id", "name", "traits", "persona", "current_task", "_mood", "_energy", "_arrays")
+
+    def __init__(
+            self,
+            id: str,
+            user_id: Optional[str],
+            name: str,
+            mood: float,
+            energy: int,
+            traits: Optional[List[str]] = None,
+            persona: Optional[str] = None,
+            current_task: Optional[str] = None,
+    ) -> None:
+        self.id = id
+        self.user_id = user_id
+        self.name = name
+        self.traits = traits if traits is not None else []
+        self.persona = persona
+        self.current_task = current_task
+        self._mood = mood
+        self._energy = energy
+        self._arrays: Optional[AgentArrays] = None
+
+    @property
+    def mood(self) -> float:
+        if self._arrays is not None:
+            return float(self._arrays.mood[self._arrays.slots[self.id]])
+        return self._mood
+
+    @mood.setter
+    def mood(self, value: float) -> None:
+        if self._arrays is not None:
+            self._arrays.mood[self._arrays.slots[self.id]] = value
+        else:
+            self._mood = value
+
+    @property
+    def energy(self) -> int:
+        if self._arrays is not None:
+            return int(self._arrays.energy[self._arrays.slots[self.id]])
+        return self._energy
+
+    @energy.setter
+    def energy(self, value: int) -> None:
+        if self._arrays is not None:
+            self._arrays.energy[self._arrays.slots[self.id]] = value
+        else:
+            self._energy = value
+
+    def attach(self, arrays: AgentArrays) -> None:
+        """Перенести mood и energy в массивы мира."""
+        arrays.add(self.id, self._mood, self._energy)
+        self._arrays = arrays
+
+    def detach(self) -> None:
+        """Забрать mood и energy из массивов мира обратно в объект (агент удалён)."""
+        if self._arrays is not None:
+            self._mood, self._energy = self.mood, self.energy
+            self._arrays.remove(self.id)
+            self._arrays = None
+
+    def assign(self, other: AgentState) -> None:
+        """Обновить агента на месте значениями другого состояния."""
+        self.user_id = other.user_id
+        self.name = other.name
+        self.traits = list(other.traits)
+        self.persona = other.persona
+        self.current_task = other.current_task
+        self.mood = other.mood
+        self.energy = other.energy
+
+    def __repr__(self) -> str:
+        return f"AgentState(id={self.id!r}, name={self.name!r}, mood={self.mood:.2f}, energy={self.energy})"
+
+
+@dataclass
+class ChatState:
+    id: uuid.UUID
+    name: str
+    description: Optional[str]
+    created_by_user_id: Optional[str]
+
+
+@dataclass
+class RelationState:
+    id: str
+    source_agent_id: str
+    target_agent_id: str
+    affinity: float = 0.0
+    strength: float = 0.5
+    label: Optional[str] = None
+
+
+def _agent_state(agent: Agent) -> AgentState:
+    return AgentState(
+        id=str(agent.id),
+        user_id=str(agent.user_id) if agent.user_id else None,
+        name=agent.name,
+        mood=agent.mood if agent.mood is not None else 0.5,
+        energy=agent.energy if agent.energy is not None else 100,
+        traits=list(agent.traits or []),
+        persona=agent.persona,
+        current_task=agent.current_task,
+    )
+
+
+class WorldState:
+    """
+    Авторитетное in-process состояние мира для SimulationEngine.
+    """
+
+    def __init__(self, shard: Optional[Tuple[int, int]] = None) -> None:
+        self.agents: Dict[str, AgentState] = {}
+        # Настроение и энергия агентов мира (struct-of-arrays для векторных обновлений)
+        self.arrays = AgentArrays()
+        self.chats: Dict[uuid.UUID, ChatState] = {}
+        # Индекс участников чатов, общий для движка и роутеров
+        self.memberships = MembershipIndex()
+        self.relations: Dict[RelationKey, RelationState] = {}
+        # Последние сообщения групповых чатов ({"from", "text"} от старых к новым)
+        self.chat_history: Dict[uuid.UUID, Deque[Dict[str, str]]] = {}
+        # Выборка активных агентов для планировщика тиков с разделением тика между пользователями
+        self.sampler = FairShareScheduler(settings.SIMULATION_PICK_POLICY, settings.SIMULATION_TENANT_TICK_BUDGET)
+        # Времена пробуждения агентов для событийного планировщика (SIMULATION_SCHEDULER=events)
+        self.wakeups = WakeScheduler(settings.SIMULATION_AGENT_WAKE_SECONDS)
+        # Заранее сгенерированные реплики агентов (SIMULATION_PREGEN_ENABLED)
+        self.utterances = UtterancePool(
+            per_agent=settings.SIMULATION_PREGEN_PER_AGENT,
+            mood_threshold=settings.SIMULATION_PREGEN_MOOD_THRESHOLD,
+            context_drift=settings.SIMULATION_PREGEN_CONTEXT_DRIFT,
+            ttl_seconds=settings.SIMULATION_PREGEN_TTL_SECONDS,
+        )
+        # Недоигранные сцены групповых чатов (SIMULATION_SCENES_ENABLED)
+        self.scenes = ScenePool(ttl_seconds=settings.SIMULATION_SCENE_TTL_SECONDS)
+        # (номер шарда, всего шардов): воркер держит в памяти только пользователей своего шарда
+        self.shard = shard
+        self.loaded = False
+        # True, пока по этому состоянию крутится SimulationEngine (значения в памяти новее, чем в БД)
+        self.live = False
+        self._dirty_agents: Set[str] = set()
+        self._dirty_relations: Set[RelationKey] = set()
+
+    def owns_user(self, user_id: Optional[str]) -> bool:
+        """Относится ли пользователь к шарду этого состояния."""
+        if self.shard is None:
+            return True
+        index, total = self.shard
+        return shard_of(user_id, total) == index
+
+    # ----- Загрузка -----
+
+    async def _read(self, session: AsyncSession):
+        """
+        Прочитать агентов, чаты, участников чатов и отношения своего шарда из БД.
+        """
+        agents_result = await session.execute(select(Agent))
+        agents = {
+            str(a.id): _agent_state(a)
+            for a in agents_result.scalars().all()
+            if self.owns_user(a.user_id)
+        }
+
+        chats_result = await session.execute(select(GroupChat))
+        chats = {
+            chat.id: ChatState(
+                id=chat.id,
+                name=chat.name,
+                description=chat.description,
+                created_by_user_id=str(chat.created_by_user_id) if chat.created_by_user_id else None,
+            )
+            for chat in chats_result.scalars().all()
+            if self.owns_user(chat.created_by_user_id)
+        }
+
+        members_result = await session.execute(
+            select(group_chat_agents.c.group_chat_id, group_chat_agents.c.agent_id)
+        )
+        member_rows = [
+            (chat_id, agent_id)
+            for chat_id, agent_id in members_result.fetchall()
+            if chat_id in chats and agent_id is not None and (self.shard is None or agent_id in agents)
+        ]
+
+        relations_result = await session.execute(select(Relationship))
+        relations: Dict[RelationKey, RelationState] = {}
+        for rel in relations_result.scalars().all():
+            key = (str(rel.source_agent_id), str(rel.target_agent_id))
+            if self.shard is not None and key[0] not in agents:
+                continue
+            relations[key] = RelationState(
+                id=rel.id,
+                source_agent_id=key[0],
+                target_agent_id=key[1],
+                affinity=rel.affinity if rel.affinity is not None else 0.0,
+                strength=rel.strength if rel.strength is not None else 0.5,
+                label=rel.label,
+            )
+        return agents, chats, member_rows, relations
+
+    async def _read_tenants(self, session: AsyncSession) -> None:
+        """
+        Применить к выборке паузу и скорость пользователей своего шарда, сохранённые через API.
+        """
+        result = await session.execute(select(SimulationTenant))
+        for row in result.scalars().all():
+            if self.owns_user(row.user_id):
+                self.sampler.configure(row.user_id, paused=bool(row.paused), speed=row.speed)
+
+    async def save_tenant(
+            self,
+            session: AsyncSession,
+            user_id: str,
+            paused: Optional[bool] = None,
+            speed: Optional[float] = None,
+    ) -> TenantState:
+        """
+        Изменить паузу и скорость пользователя в памяти и в БД, чтобы их подхватили
+        воркеры шардов. Коммит остаётся за вызывающим кодом.
+        """
+        tenant = self.sampler.configure(user_id, paused=paused, speed=speed)
+        row = await session.get(SimulationTenant, user_id)
+        if row is None:
+            session.add(SimulationTenant(user_id=user_id, paused=tenant.paused, speed=tenant.speed))
+        else:
+            row.paused, row.speed = tenant.paused, tenant.speed
+        return tenant
+
+    async def load(self, session: AsyncSession) -> None:
+        """
+        Полностью перечитать агентов, чаты, участников чатов и отношения из БД.
+        """
+        agents, chats, member_rows, relations = await self._read(session)
+
+        self.agents = agents
+        self.arrays.clear()
+        self.sampler.clear()
+        self.wakeups.clear()
+        self.utterances.clear()
+        self.scenes.clear()
+        for state in agents.values():
+            state.attach(self.arrays)
+            self.sampler.add(state.id, state.energy, tenant=state.user_id)
+            self.wakeups.add(state.id)
+        self.chats = chats
+        self.memberships.clear()
+        for chat_id, agent_id in member_rows:
+            self.memberships.add(chat_id, agent_id)
+        self.relations = relations
+        self._dirty_agents.clear()
+        self._dirty_relations.clear()
+        await self._read_tenants(session)
+        self.loaded = True
+        logger.info(
+            "Состояние мира загружено: шард=%s, агентов=%d, чатов=%d, отношений=%d",
+            self.shard,
+            len(agents),
+            len(chats),
+            len(relations),
+        )
+
+    async def sync(self, session: AsyncSession) -> None:
+        """
+        Подтянуть изменения, сделанные в БД другими процессами (API при работе воркеров).
+
+        Новые агенты, чаты и отношения добавляются, удалённые убираются, состав чатов
+        заменяется, пауза и скорость пользователей берутся из БД. Агенты и отношения, изменённые в памяти и ещё не сброшенные,
+        сохраняют свои значения: симуляция в этом процессе для них авторитетна.
+        """
+        agents, chats, member_rows, relations = await self._read(session)
+
+        for agent_id in [a for a in self.agents if a not in agents]:
+            self.remove_agent(agent_id)
+        for agent_id, fresh in agents.items():
+            current = self.agents.get(agent_id)
+            if current is None:
+                self.agents[agent_id] = fresh
+                fresh.attach(self.arrays)
+                self.sampler.add(agent_id, fresh.energy, tenant=fresh.user_id)
+                self.wakeups.add(agent_id)
+            elif agent_id not in self._dirty_agents:
+                current.assign(fresh)
+                self.sampler.update(agent_id, fresh.energy)
+
+        self.chats = chats
+        self.memberships.clear()
+        for chat_id, agent_id in member_rows:
+            self.memberships.add(chat_id, agent_id)
+
+        for key, fresh in relations.items():
+            current = self.relations.get(key)
+            if current is None:
+                self.relations[key] = fresh
+            elif key not in self._dirty_relations:
+                current.__dict__.update(fresh.__dict__)
+        await self._read_tenants(session)
+        self.loaded = True
+
+    async def ensure_loaded(self, session: AsyncSession) -> None:
+        if not self.loaded:
+            await self.load(session)
+
+    def reset(self) -> None:
+        """Сбросить состояние; следующая ensure_loaded перечитает его из БД."""
+        self.__init__(self.shard)
+
+    # ----- Чтение -----
+
+    def get_agent(self, agent_id: str) -> Optional[AgentState]:
+        return self.agents.get(str(agent_id))
+
+    def get_chat(self, chat_id: uuid.UUID) -> Optional[ChatState]:
+        return self.chats.get(chat_id)
+
+    def chats_of(self, agent_id: str) -> List[ChatState]:
+        """Групповые чаты, в которых состоит агент."""
+        return [self.chats[c] for c in self.memberships.chats_of(agent_id) if c in self.chats]
+
+    def members_of(self, chat_id: uuid.UUID) -> List[str]:
+        """ID агентов-участников чата."""
+        return self.memberships.members_of(chat_id)
+
+    def get_relation(self, source_id: str, target_id: str) -> Optional[RelationState]:
+        return self.relations.get((source_id, target_id))
+
+    def get_or_create_relation(self, source_id: str, target_id: str) -> RelationState:
+        key = (source_id, target_id)
+        rel = self.relations.get(key)
+        if rel is None:
+            rel = RelationState(id=str(uuid4()), source_agent_id=source_id, target_agent_id=target_id)
+            self.relations[key] = rel
+            self._dirty_relations.add(key)
+        return rel
+
+    def relations_from(self, source_id: str) -> Dict[str, RelationState]:
+        return {
+            target: rel for (source, target), rel in self.relations.items() if source == source_id
+        }
+
+    # ----- Изменения со стороны симуляции -----
+
+    def mark_agent_dirty(self, agent_id: str) -> None:
+        state = self.agents.get(agent_id)
+        if state is not None:
+            self._dirty_agents.add(agent_id)
+            self.sampler.update(agent_id, state.energy)
+
+    def mark_agents_dirty(self, agent_ids: Iterable[str]) -> None:
+        """
+        Пометить изменёнными агентов мира пачкой (после векторных операций над arrays).
+        Веса выборки зависят от энергии только при политике energy — только тогда их и обновляем.
+        """
+        agent_ids = list(agent_ids)
+        self._dirty_agents.update(agent_ids)
+        if self.sampler.policy == "energy":
+            for agent_id in agent_ids:
+                self.sampler.update(agent_id, self.agents[agent_id].energy)
+
+    def apply_chat_influence(self, agent_ids: List[str], affinities: List[float]) -> None:
+        """
+        Участники чата услышали сообщение: настроение каждого сдвигается по его отношению
+        к отправителю, энергия немного тратится. Одна векторная операция на весь чат.
+        """
+        if not agent_ids:
+            return
+        self.arrays.chat_influence(self.arrays.slots_of(agent_ids), affinities)
+        self.mark_agents_dirty(agent_ids)
+
+    def note_chat_message(self, chat_id: uuid.UUID, speaker: str = "", text: str = "") -> None:
+        """
+        В чате новое сообщение: участники просыпаются чаще, заготовленные реплики устаревают,
+        а текст попадает в историю чата для следующих промптов.
+        """
+        self.wakeups.note_chat_activity(chat_id)
+        self.utterances.note_chat_message(chat_id)
+        if text:
+            history = self.chat_history.get(chat_id)
+            if history is None:
+                history = self.chat_history[chat_id] = deque(maxlen=CHAT_HISTORY_SIZE)
+            history.append({"from": speaker, "text": text})
+
+    def recent_chat_messages(self, chat_id: uuid.UUID) -> List[Dict[str, str]]:
+        """Последние сообщения чата от старых к новым."""
+        return list(self.chat_history.get(chat_id, ()))
+
+    def recover_energy(self, amount: int) -> int:
+        """Восстановить энергию всем уставшим агентам мира. Возвращает число изменённых агентов."""
+        if amount <= 0:
+            return 0
+        slots = self.arrays.recover(amount)
+        self.mark_agents_dirty(self.arrays.ids_of(slots))
+        return int(slots.size)
+
+    def mark_relation_dirty(self, rel: RelationState) -> None:
+        key = (rel.source_agent_id, rel.target_agent_id)
+        if key in self.relations:
+            self._dirty_relations.add(key)
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty_agents) + len(self._dirty_relations)
+
+    async def flush(self, session: AsyncSession) -> int:
+        """
+        Записать изменённых агентов и отношения в БД одной транзакцией.
+        Возвращает количество записанных строк.
+        """
+        if not self._dirty_agents and not self._dirty_relations:
+            return 0
+
+        # Снимок берём синхронно, чтобы изменения во время await попали в следующий сброс
+        agent_keys, self._dirty_agents = self._dirty_agents, set()
+        relation_keys, self._dirty_relations = self._dirty_relations, set()
+
+        agent_rows = [
+            {
+                "id": a.id,
+                "mood": a.mood,
+                "energy": a.energy,
+                "current_task": a.current_task,
+            }
+            for a in (self.agents.get(k) for k in agent_keys)
+            if a is not None
+        ]
+        relation_rows = [
+            {
+                "id": rel.id,
+                "source_agent_id": rel.source_agent_id,
+                "target_agent_id": rel.target_agent_id,
+                "affinity": rel.affinity,
+                "strength": rel.strength,
+                "label": rel.label,
+            }
+            for rel in (self.relations.get(k) for k in relation_keys)
+            if rel is not None
+        ]
+
+        try:
+            if agent_rows:
+                await session.execute(update(Agent), agent_rows)
+            # Новые и изменённые отношения пишутся одним upsert-ом по паре агентов
+            await upsert_relationships(session, relation_rows)
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            # Возвращаем ключи в очередь, кроме уже удалённых из мира
+            self._dirty_agents |= {k for k in agent_keys if k in self.agents}
+            self._dirty_relations |= {k for k in relation_keys if k in self.relations}
+            raise
+
+        written = len(agent_rows) + len(relation_rows)
+        logger.debug("Сброс состояния мира: записано строк=%d", written)
+        return written
+
+    # ----- Хуки для роутеров -----
+
+    def upsert_agent(self, agent: Agent) -> None:
+        """
+        Агент создан или изменён через API.
+        Существующий AgentState обновляется на месте: на него могут ссылаться шаги симуляции.
+        """
+        state = _agent_state(agent)
+        current = self.agents.get(state.id)
+        if current is None:
+            self.agents[state.id] = state
+            state.attach(self.arrays)
+        else:
+            current.assign(state)
+        self.sampler.add(state.id, state.energy, tenant=state.user_id)
+        self.wakeups.add(state.id)
+
+    def remove_agent(self, agent_id: str) -> None:
+        """Агент удалён через API: убираем его, его членство в чатах и отношения."""
+        agent_id = str(agent_id)
+        state = self.agents.pop(agent_id, None)
+        if state is not None:
+            state.detach()
+        self.sampler.remove(agent_id)
+        self.wakeups.remove(agent_id)
+        self.utterances.drop(agent_id)
+        self._dirty_agents.discard(agent_id)
+        self.memberships.remove_agent(agent_id)
+        for key in [k for k in self.relations if agent_id in k]:
+            del self.relations[key]
+            self._dirty_relations.discard(key)
+
+    def upsert_chat(self, chat: GroupChat, member_ids: Optional[Iterable[str]] = None) -> None:
+        """
+        Чат создан или изменён через API.
+        member_ids=None оставляет текущий состав участников без изменений.
+        """
+        state = self.chats.get(chat.id)
+        if state is None:
+            state = ChatState(id=chat.id, name=chat.name, description=chat.description, created_by_user_id=None)
+            self.chats[chat.id] = state
+        state.name = chat.name
+        state.description = chat.description
+        state.created_by_user_id = str(chat.created_by_user_id) if chat.created_by_user_id else None
+        if member_ids is not None:
+            self.memberships.set_members(chat.id, member_ids)
+
+    def add_chat_member(self, chat_id: uuid.UUID, agent_id: str) -> None:
+        self.memberships.add(chat_id, agent_id)
+
+    def remove_chat(self, chat_id: uuid.UUID) -> None:
+        self.chats.pop(chat_id, None)
+        self.scenes.drop(chat_id)
+        self.chat_history.pop(chat_id, None)
+        self.memberships.remove_chat(chat_id)
+
+
+world = WorldState()
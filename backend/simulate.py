@@ -0,0 +1,244 @@
+# ---------------------------------------------------------
+# Headless-прогон симуляции: бенчмарки и what-if прогоны
+# Запуск: python -m backend.simulate --ticks 500 --agents 200 --llm stub
+# ---------------------------------------------------------
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+IN_MEMORY_URL = "sqlite+aiosqlite:///:memory:"
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m backend.simulate",
+        description="Прогнать K тиков SimulationEngine без пауз и вывести метрики производительности.",
+    )
+    parser.add_argument("--db-url", default=None, help="URL БД (по умолчанию SQLALCHEMY_URL или in-memory SQLite)")
+    parser.add_argument("--ticks", type=int, default=100, help="Сколько тиков прогнать")
+    parser.add_argument("--seed", type=int, default=42, help="Seed генератора случайных чисел")
+    parser.add_argument("--agents", type=int, default=50, help="Сколько агентов создать, если в БД их нет")
+    parser.add_argument("--chats", type=int, default=5, help="Сколько дополнительных чатов создать при генерации")
+    parser.add_argument("--agents-per-tick", type=int, default=None, help="Переопределить SIMULATION_AGENTS_PER_TICK")
+    parser.add_argument("--llm", choices=["off", "stub", "real"], default="off", help="Режим LLM")
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0, help="Задержка ответа stub-LLM")
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0, help="Разброс задержки stub-LLM (±)")
+    parser.add_argument("--flush-every", type=int, default=10, help="Сбрасывать состояние мира в БД раз в N тиков")
+    parser.add_argument(
+        "--no-persist",
+        action="store_true",
+        help="Не сбрасывать состояние мира в БД (без --db-url используется in-memory SQLite)",
+    )
+    return parser.parse_args(argv)
+
+
+def _prepare_env(args: argparse.Namespace) -> str:
+    """
+    Выставляет переменные окружения ДО импорта backend.*: settings читаются при импорте.
+    """
+    db_url = args.db_url or (IN_MEMORY_URL if args.no_persist else os.getenv("SQLALCHEMY_URL")) or IN_MEMORY_URL
+    os.environ["SQLALCHEMY_URL"] = db_url
+    os.environ.setdefault("SECRET_KEY", "headless-simulation")
+    if args.llm != "real":
+        os.environ["OPENAI_API_KEY"] = ""
+        os.environ["LLM_PROVIDER"] = "off"
+    if args.agents_per_tick is not None:
+        os.environ["SIMULATION_AGENTS_PER_TICK"] = str(args.agents_per_tick)
+    if db_url == IN_MEMORY_URL:
+        # In-memory SQLite живёт в одном соединении, поэтому шаги агентов выполняются по очереди
+        os.environ["SIMULATION_MAX_CONCURRENCY"] = "1"
+    return db_url
+
+
+@dataclass
+class RunStats:
+    ticks: int = 0
+    elapsed: float = 0.0
+    statements: int = 0
+    step_latencies: List[float] = field(default_factory=list)
+
+    @property
+    def ticks_per_second(self) -> float:
+        return self.ticks / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def statements_per_tick(self) -> float:
+        return self.statements / self.ticks if self.ticks else 0.0
+
+    def percentile(self, q: float) -> float:
+        if not self.step_latencies:
+            return 0.0
+        ordered = sorted(self.step_latencies)
+        index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def report(self) -> str:
+        mean = statistics.fmean(self.step_latencies) if self.step_latencies else 0.0
+        return (
+            f"ticks={self.ticks} elapsed={self.elapsed:.2f}s ticks/s={self.ticks_per_second:.1f}\n"
+            f"db statements={self.statements} per tick={self.statements_per_tick:.1f}\n"
+            f"step latency ms: mean={mean * 1000:.1f} "
+            f"p50={self.percentile(50) * 1000:.1f} p99={self.percentile(99) * 1000:.1f}"
+        )
+
+
+def install_stub_llm(latency: float, rng: random.Random, jitter: float = 0.0) -> None:
+    from backend.services.llm import llm_client
+    from backend.services.llm_providers import StubProvider
+
+    llm_client.use_provider(StubProvider(latency=latency, jitter=jitter, rng=rng))
+
+
+async def seed_city(session_factory, agents: int, chats: int, rng: random.Random) -> int:
+    """
+    Создать синтетический город (пользователь, чаты, агенты), если агентов в БД нет.
+    Возвращает количество агентов в БД.
+    """
+    from sqlalchemy import func, insert, select
+
+    from backend.database.postgr.models import Agent, GroupChat, User
+    from backend.database.postgr.models.groupchat import group_chat_agents
+
+    async with session_factory() as session:
+        existing = (await session.execute(select(func.count()).select_from(Agent))).scalar_one()
+        if existing or agents <= 0:
+            return existing
+
+        username = f"headless-{rng.getrandbits(32):08x}"
+        user = User(username=username, email=f"{username}@headless.local", hashed_password="!")
+        session.add(user)
+        await session.flush()
+
+        city = GroupChat(name="Кибер город", description="Город, в котором живут ваши агенты", created_by_user_id=user.id)
+        extra = [
+            GroupChat(name=f"Чат {i + 1}", description=None, created_by_user_id=user.id) for i in range(chats)
+        ]
+        session.add_all([city, *extra])
+        trait_pool = ["любопытный", "осторожный", "весёлый", "упрямый", "дружелюбный", "скептичный"]
+        created = [
+            Agent(
+                name=f"Агент {i + 1}",
+                mood=rng.random(),
+                energy=rng.randint(20, 100),
+                traits=rng.sample(trait_pool, 2),
+                persona="Житель кибер-города",
+                user_id=user.id,
+            )
+            for i in range(agents)
+        ]
+        session.add_all(created)
+        await session.flush()
+
+        links = [{"group_chat_id": city.id, "agent_id": a.id} for a in created]
+        for chat in extra:
+            members = rng.sample(created, k=min(len(created), rng.randint(2, 8)))
+            links.extend({"group_chat_id": chat.id, "agent_id": a.id} for a in members)
+        await session.execute(insert(group_chat_agents), links)
+        await session.commit()
+        return agents
+
+
+async def run_headless(
+        session_factory,
+        ticks: int,
+        rng: random.Random,
+        flush_every: int = 10,
+        persist: bool = True,
+        statement_counter: Optional[List[int]] = None,
+) -> RunStats:
+    """
+    Прогнать ticks тиков SimulationEngine подряд, без пауз цикла _run.
+    """
+    from backend.services.simulation import SimulationEngine
+    from backend.services.world import WorldState
+
+    world_state = WorldState()
+    world_state.sampler.rng = rng
+    engine = SimulationEngine(session_factory, world_state=world_state)
+    async with session_factory() as session:
+        await world_state.load(session)
+
+    stats = RunStats()
+    counted_from = statement_counter[0] if statement_counter else 0
+    started = time.perf_counter()
+    for tick in range(1, ticks + 1):
+        t0 = time.perf_counter()
+        await engine.step()
+        stats.step_latencies.append(time.perf_counter() - t0)
+        if persist and flush_every > 0 and tick % flush_every == 0:
+            await engine.flush()
+    if persist:
+        await engine.flush()
+    stats.elapsed = time.perf_counter() - started
+    stats.ticks = ticks
+    if statement_counter:
+        stats.statements = statement_counter[0] - counted_from
+    return stats
+
+
+async def _main(args: argparse.Namespace, db_url: str) -> RunStats:
+    from sqlalchemy import event
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlalchemy.pool import StaticPool
+
+    from backend.database.postgr import models as _models  # noqa: F401
+    from backend.database.postgr.db import Base
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+
+    engine_kwargs = {}
+    if db_url == IN_MEMORY_URL:
+        # Одна общая in-memory БД для всех сессий
+        engine_kwargs = {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+    db_engine = create_async_engine(db_url, **engine_kwargs)
+    session_factory = async_sessionmaker(db_engine, expire_on_commit=False)
+
+    counter = [0]
+
+    def _count(*_args, **_kwargs) -> None:
+        counter[0] += 1
+
+    event.listen(db_engine.sync_engine, "before_cursor_execute", _count)
+
+    async with db_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    if args.llm == "stub":
+        install_stub_llm(args.llm_latency_ms / 1000, rng, jitter=args.llm_jitter_ms / 1000)
+
+    agents = await seed_city(session_factory, args.agents, args.chats, rng)
+    print(f"db={db_url} agents={agents} llm={args.llm} seed={args.seed}")
+
+    try:
+        return await run_headless(
+            session_factory,
+            ticks=args.ticks,
+            rng=rng,
+            flush_every=args.flush_every,
+            persist=not args.no_persist,
+            statement_counter=counter,
+        )
+    finally:
+        await db_engine.dispose()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    db_url = _prepare_env(args)
+    stats = asyncio.run(_main(args, db_url))
+    print(stats.report())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
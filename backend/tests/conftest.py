@@ -34,6 +34,7 @@ def _test_env(tmp_path_factory: pytest.TempPathFactory) -> dict[str, str]:
     os.environ.setdefault("SECRET_KEY", "test-secret-key")
     os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
     os.environ.setdefault("OPENAI_API_KEY", "")
+    os.environ.setdefault("LLM_PROVIDER", "off")
     os.environ.setdefault("CHROMA_API_KEY", "")
     os.environ.setdefault("CHROMA_TENANT", "")
     os.environ.setdefault("CHROMA_DB_NAME", "")
@@ -82,6 +83,10 @@ async def _reset_db(_init_db: None) -> AsyncIterator[None]:
         for table in reversed(Base.metadata.sorted_tables):
             await conn.execute(table.delete())
         await conn.execute(text("PRAGMA foreign_keys=ON"))
+
+    # In-memory состояние мира симуляции тоже начинаем с чистого листа
+    from backend.services.world import world
+    world.reset()
     yield
 
 
@@ -0,0 +1,39 @@
+def test_agent_arrays_kernels_and_slot_reuse() -> None:
+    import numpy as np
+
+    from backend.services.dynamics import AgentArrays
+
+    arrays = AgentArrays(capacity=2)
+    for i, (mood, energy) in enumerate([(0.5, 50), (0.99, 1), (0.01, 100)]):
+        arrays.add(f"a{i}", mood, energy)
+    assert len(arrays) == 3
+
+    arrays.chat_influence(arrays.slots_of(["a1", "a2"]), np.array([1.0, -1.0]))
+    # Настроение и энергия не выходят за допустимые границы
+    assert arrays.mood[arrays.slot("a1")] == 1.0 and arrays.energy[arrays.slot("a1")] == 0
+    assert abs(arrays.mood[arrays.slot("a2")] - 0.0) < 1e-9 and arrays.energy[arrays.slot("a2")] == 99
+
+    changed = arrays.recover(5)
+    assert sorted(arrays.ids_of(changed)) == ["a0", "a1", "a2"]
+    assert arrays.energy[arrays.slot("a2")] == 100
+
+    # Удаление переносит последний слот на место удалённого, значения сохраняются
+    arrays.remove("a0")
+    assert arrays.slot("a2") == 0 and arrays.energy[0] == 100
+
+
+def test_agent_state_reads_and_writes_world_arrays() -> None:
+    from backend.services.world import AgentState, WorldState
+
+    world_state = WorldState()
+    state = AgentState(id="a", user_id=None, name="A", mood=0.5, energy=50)
+    world_state.agents["a"] = state
+    state.attach(world_state.arrays)
+
+    world_state.apply_chat_influence(["a"], [1.0])
+    assert abs(state.mood - 0.52) < 1e-9 and state.energy == 49
+    assert world_state.dirty_count == 1
+
+    world_state.remove_agent("a")
+    # После удаления из мира агент хранит последние значения сам
+    assert abs(state.mood - 0.52) < 1e-9 and state.energy == 49
@@ -0,0 +1,90 @@
+import httpx
+
+
+async def _create_agent(client: httpx.AsyncClient, headers: dict[str, str], name: str) -> str:
+    r = await client.post("/api/agents", json={"name": name, "persona": "Житель города"}, headers=headers)
+    assert r.status_code == 201, r.text
+    return r.json()["id"]
+
+
+async def test_group_chat_membership_follows_changes(
+        client: httpx.AsyncClient, auth_headers: dict[str, str]
+) -> None:
+    a1 = await _create_agent(client, auth_headers, "Alpha")
+    a2 = await _create_agent(client, auth_headers, "Beta")
+    a3 = await _create_agent(client, auth_headers, "Gamma")
+
+    r = await client.post(
+        "/api/group-chats", json={"name": "Штаб", "agent_ids": [a1, a2]}, headers=auth_headers
+    )
+    assert r.status_code == 201, r.text
+    chat_id = r.json()["id"]
+
+    r = await client.get("/api/group-chats", headers=auth_headers)
+    assert r.status_code == 200, r.text
+    chats = {c["name"]: sorted(c["agent_ids"]) for c in r.json()}
+    # Новые агенты автоматически попадают в дефолтный чат пользователя
+    assert chats["Кибер город"] == sorted([a1, a2, a3])
+    assert chats["Штаб"] == sorted([a1, a2])
+
+    r = await client.put(f"/api/group-chats/{chat_id}", json={"agent_ids": [a2, a3]}, headers=auth_headers)
+    assert r.status_code == 200, r.text
+    assert sorted(r.json()["agent_ids"]) == sorted([a2, a3])
+
+    r = await client.delete(f"/api/agents/{a3}", headers=auth_headers)
+    assert r.status_code == 204, r.text
+    r = await client.get(f"/api/group-chats/{chat_id}", headers=auth_headers)
+    assert r.json()["agent_ids"] == [a2]
+
+    r = await client.delete(f"/api/group-chats/{chat_id}", headers=auth_headers)
+    assert r.status_code == 204, r.text
+    r = await client.get("/api/group-chats", headers=auth_headers)
+    assert [c["name"] for c in r.json()] == ["Кибер город"]
+
+
+async def test_chat_prompt_gets_recent_chat_messages(
+        client: httpx.AsyncClient, auth_headers: dict[str, str], monkeypatch
+) -> None:
+    import uuid
+
+    from backend.database.postgr.db import async_session
+    from backend.services import simulation as simulation_module
+    from backend.services.llm_context import conversation_key
+    from backend.services.simulation import SimulationEngine
+    from backend.services.world import CHAT_HISTORY_SIZE
+
+    a1 = await _create_agent(client, auth_headers, "Alpha")
+    await _create_agent(client, auth_headers, "Beta")
+    chat_id = next(c["id"] for c in (await client.get("/api/group-chats", headers=auth_headers)).json())
+
+    r = await client.post(f"/api/group-chats/{chat_id}/message", json={"message": "Всем привет!"}, headers=auth_headers)
+    assert r.status_code == 200, r.text
+
+    engine = SimulationEngine(async_session)
+    async with async_session() as session:
+        await engine.world.ensure_loaded(session)
+    chat = engine.world.get_chat(uuid.UUID(chat_id))
+    assert engine.world.recent_chat_messages(chat.id) == [{"from": "Пользователь", "text": "Всем привет!"}]
+    for i in range(CHAT_HISTORY_SIZE):
+        engine.world.note_chat_message(chat.id, "Beta", f"Сообщение {i}")
+
+    captured = {}
+
+    async def fake_generate_message(**kwargs):
+        captured.update(kwargs)
+        return "Ответ"
+
+    monkeypatch.setattr(simulation_module.llm_client, "enabled", True)
+    monkeypatch.setattr(simulation_module.llm_client, "generate_message", fake_generate_message)
+    assert await engine._generate_chat_message(engine.world.get_agent(a1), chat) == "Ответ"
+
+    # В промпт идут последние сообщения чата; самые старые вытеснены лимитом истории
+    history = captured["conversation_history"]
+    assert len(history) == CHAT_HISTORY_SIZE
+    assert history[0] == {"from": "Beta", "text": "Сообщение 0"}
+    assert history[-1] == {"from": "Beta", "text": f"Сообщение {CHAT_HISTORY_SIZE - 1}"}
+    assert captured["conversation_key"] == conversation_key("chat", chat.id)
+
+    engine.world.note_chat_message(chat.id, "Пользователь", "Ещё раз привет")
+    engine.world.remove_chat(chat.id)
+    assert engine.world.recent_chat_messages(chat.id) == []
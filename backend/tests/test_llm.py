@@ -0,0 +1,345 @@
+import asyncio
+from types import SimpleNamespace
+
+
+class _CountingCompletions:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def create(self, model: str, messages: list, **kwargs):
+        self.calls += 1
+        text = f"ответ {self.calls}"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+def _client(monkeypatch, **cache_kwargs):
+    from backend.services.llm import LLMClient
+    from backend.services.llm_cache import ResponseCache
+
+    client = LLMClient()
+    completions = _CountingCompletions()
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    client.model = "stub"
+    client.enabled = True
+    client.cache = ResponseCache(**cache_kwargs)
+    return client, completions
+
+
+def _message_kwargs(**overrides):
+    kwargs = dict(
+        sender_name="Агент",
+        sender_mood=0.5,
+        sender_traits=["весёлый"],
+        receiver_name="участники чата",
+        affinity=0.0,
+        recent_memories=[],
+        conversation_history=[],
+        topic_hint="Чат: Кибер город",
+    )
+    kwargs.update(overrides)
+    return kwargs
+
+
+def test_identical_prompts_are_served_from_cache(monkeypatch) -> None:
+    client, completions = _client(monkeypatch, max_entries=8, ttl_seconds=60)
+
+    async def scenario():
+        first = await client.generate_action("Агент", 0.5, 80, None, ["память"])
+        # Лишние пробелы не меняют ключ кэша
+        second = await client.generate_action("Агент", 0.5, 80, None, ["память  "])
+        third = await client.generate_action("Агент", 0.9, 80, None, ["память"])
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert first == second == "ответ 1"
+    assert third == "ответ 2"
+    assert completions.calls == 2
+    assert client.cache.stats()["hits"] == 1 and client.cache.stats()["misses"] == 2
+
+
+def test_replies_are_not_replayed_from_cache(monkeypatch) -> None:
+    client, completions = _client(monkeypatch, max_entries=8, ttl_seconds=60)
+
+    async def scenario():
+        return [
+            await client.generate_message(**_message_kwargs()),
+            await client.generate_chat([], "память"),
+            await client.generate_message(**_message_kwargs()),
+            await client.generate_chat([], "память"),
+        ]
+
+    # Тот же промпт — новая реплика, а не дословный повтор
+    assert asyncio.run(scenario()) == ["ответ 1", "ответ 2", "ответ 3", "ответ 4"]
+    assert client.cache.stats()["hits"] == 0 and client.cache.stats()["size"] == 0
+
+
+def test_cache_ttl_lru_and_disk_tier(monkeypatch, tmp_path) -> None:
+    from backend.services import llm_cache
+    from backend.services.llm_cache import ResponseCache
+
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+
+    async def scenario():
+        cache = ResponseCache(max_entries=1, ttl_seconds=10, disk_dir=str(tmp_path))
+        await cache.set("a", "A")
+        await cache.set("b", "B")
+        # "a" вытеснен из памяти, но найден на диске
+        assert await cache.get("a") == "A" and cache.disk_hits == 1
+        now[0] += 11
+        assert await cache.get("a") is None
+
+        # Новый экземпляр (перезапуск процесса) видит непросроченные записи с диска
+        await cache.set("c", "C")
+        restarted = ResponseCache(max_entries=4, ttl_seconds=10, disk_dir=str(tmp_path))
+        assert await restarted.get("c") == "C"
+
+    asyncio.run(scenario())
+
+
+class _BatchCompletions:
+    def __init__(self, reply) -> None:
+        self.reply = reply
+        self.prompts: list = []
+
+    async def create(self, model: str, messages: list, **kwargs):
+        self.prompts.append(messages)
+        text = self.reply(messages)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+def _batched_client(reply):
+    from backend.services.llm import LLMClient
+    from backend.services.llm_batch import MessageBatcher
+    from backend.services.llm_cache import ResponseCache
+
+    client = LLMClient()
+    completions = _BatchCompletions(reply)
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    client.model = "stub"
+    client.enabled = True
+    client.cache = ResponseCache(max_entries=0)
+    client.batcher = MessageBatcher(client._request, window_seconds=0.01, max_size=8)
+    return client, completions
+
+
+def test_concurrent_messages_share_one_request() -> None:
+    import json
+
+    def reply(messages):
+        # Пакетный промпт — ответ JSON-массивом по числу диалогов
+        count = messages[-1]["content"].count("### Диалог")
+        return "```json\n" + json.dumps([f"реплика {i}" for i in range(1, count + 1)], ensure_ascii=False) + "\n```"
+
+    client, completions = _batched_client(reply)
+
+    async def scenario():
+        return await asyncio.gather(*(
+            client.generate_message(**_message_kwargs(sender_name=f"Агент {i}")) for i in range(3)
+        ))
+
+    assert asyncio.run(scenario()) == ["реплика 1", "реплика 2", "реплика 3"]
+    assert len(completions.prompts) == 1
+    assert client.batcher.stats()["batched_requests"] == 3
+
+
+def test_unparsable_batch_falls_back_to_single_requests() -> None:
+    def reply(messages):
+        if "### Диалог" in messages[-1]["content"]:
+            return "не JSON"
+        return "одиночный ответ"
+
+    client, completions = _batched_client(reply)
+
+    async def scenario():
+        return await asyncio.gather(*(
+            client.generate_message(**_message_kwargs(sender_name=f"Агент {i}")) for i in range(2)
+        ))
+
+    assert asyncio.run(scenario()) == ["одиночный ответ", "одиночный ответ"]
+    assert len(completions.prompts) == 3
+    assert client.batcher.stats()["fallbacks"] == 1
+
+
+def test_stream_passes_chunks_to_callback() -> None:
+    from backend.services.llm import LLMClient
+    from backend.services.llm_cache import ResponseCache
+
+    calls = []
+
+    class _StreamCompletions:
+        async def create(self, model: str, messages: list, stream: bool = False, **kwargs):
+            calls.append(stream)
+
+            async def chunks():
+                for part in ("При", "вет", None):
+                    yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))])
+
+            return chunks()
+
+    client = LLMClient()
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=_StreamCompletions()))
+    client.model = "stub"
+    client.enabled = True
+    client.cache = ResponseCache(max_entries=8)
+    deltas = []
+
+    async def on_delta(text: str) -> None:
+        deltas.append(text)
+
+    async def scenario():
+        first = await client.generate_message(**_message_kwargs(), on_delta=on_delta)
+        second = await client.generate_message(**_message_kwargs(), on_delta=on_delta)
+        return first, second
+
+    assert asyncio.run(scenario()) == ("Привет", "Привет")
+    # Реплики не кэшируются: каждая генерируется потоком заново
+    assert deltas == ["При", "вет", "При", "вет"]
+    assert calls == [True, True]
+
+
+def test_context_builder_fits_budget_and_folds_old_turns() -> None:
+    from backend.services.llm_context import ContextBuilder, conversation_key, count_tokens
+
+    builder = ContextBuilder(budget_tokens=120, summary_tokens=40)
+    key = conversation_key("agent-b", "agent-a")
+    assert key == conversation_key("agent-a", "agent-b")
+
+    history = [{"from": "Аня" if i % 2 else "Борис", "text": f"Реплика номер {i}. " + "слово " * 10} for i in range(8)]
+    first = builder.build(history[:6], ["память " * 5] * 5, "Житель города. " * 40, key=key)
+
+    assert first.tokens <= 120
+    assert len(first.persona) < len("Житель города. " * 40) and first.persona.endswith("…")
+    assert 0 < len(first.history) < 6 and first.history[-1] is history[5]
+    # В резюме — вытесненные реплики до последней из оставленных, старейшие забыты по лимиту
+    assert first.summary.endswith("Борис: Реплика номер 4.") and "номер 0." not in first.summary
+    folded = builder.stats()["folded_turns"]
+
+    # Следующий вызов дополняет резюме только новыми вытесненными репликами
+    second = builder.build(history[2:], [], "", key=key)
+    assert builder.stats()["folded_turns"] > folded
+    assert count_tokens(second.summary) <= 40
+    assert second.summary.count("Реплика номер 2.") <= 1
+
+
+def test_provider_selection_and_stub_round_trip() -> None:
+    import random
+
+    from backend.project_config import settings
+    from backend.services.llm import LLMClient
+    from backend.services.llm_batch import MessageBatcher
+    from backend.services.llm_providers import StubProvider, make_provider
+
+    def provider_for(**overrides):
+        return make_provider(settings.model_copy(update=overrides)).name
+
+    assert provider_for(LLM_PROVIDER="auto", OPENAI_API_KEY="") == "off"
+    assert provider_for(LLM_PROVIDER="auto", OPENAI_API_KEY="sk-test") == "openai"
+    assert provider_for(LLM_PROVIDER="compatible", LLM_BASE_URL=None) == "off"
+    assert provider_for(LLM_PROVIDER="compatible", LLM_BASE_URL="http://localhost:8080/v1") == "compatible"
+    assert provider_for(LLM_PROVIDER="stub") == "stub"
+
+    def run(seed: int):
+        client = LLMClient(StubProvider(latency=0.001, jitter=0.001, rng=random.Random(seed)))
+        client.batcher = MessageBatcher(client._request, window_seconds=0.01, max_size=8)
+
+        async def scenario():
+            return await asyncio.gather(*(
+                client.generate_message(**_message_kwargs(sender_name=f"Агент {i}")) for i in range(3)
+            ))
+
+        return client, asyncio.run(scenario())
+
+    client, replies = run(seed=1)
+    assert client.enabled and client.stats()["provider"] == "stub"
+    # Заглушка понимает пакетный промпт: три реплики одним вызовом
+    assert client.provider.completions.calls == 1 and len(set(replies)) == 3
+    assert run(seed=1)[1] == replies
+
+
+def test_adaptive_timeout_and_hedged_request() -> None:
+    from backend.services.llm import LLMClient
+    from backend.services.llm_cache import ResponseCache
+    from backend.services.llm_latency import LatencyTracker
+
+    tracker = LatencyTracker(default_timeout=4.0, min_timeout=0.05, max_timeout=10.0, p95_factor=2.0)
+    assert tracker.timeout_for("m") == 4.0 and tracker.hedge_after("m") is None
+    for i in range(100):
+        tracker.observe("m", 0.01 * (i + 1))
+    assert tracker.hedge_after("m") == 0.9
+    assert abs(tracker.timeout_for("m") - 1.9) < 1e-9
+
+    class _SlowFirst:
+        def __init__(self) -> None:
+            self.calls = 0
+            self.cancelled = 0
+
+        async def create(self, model: str, messages: list, **kwargs):
+            self.calls += 1
+            delay = 1.0 if self.calls == 1 else 0.0
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+            text = f"ответ {self.calls}"
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+    completions = _SlowFirst()
+    client = LLMClient()
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    client.model = "stub"
+    client.enabled = True
+    client.cache = ResponseCache(max_entries=0)
+    for _ in range(30):
+        client.latency.observe("stub", 0.02)
+
+    text = asyncio.run(client._request([{"role": "user", "content": "привет"}]))
+    # Первый запрос завис дольше p90 — дубль ответил раньше, а исходный отменён
+    assert text == "ответ 2"
+    assert completions.cancelled == 1
+    assert client.stats()["latency"]["hedges"] == 1 and client.stats()["latency"]["hedge_wins"] == 1
+
+
+def test_sync_chat_runs_on_bridge_loop_with_bounded_concurrency() -> None:
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    from backend.services.llm import LLMClient
+    from backend.services.llm_bridge import LoopBridge
+    from backend.services.llm_cache import ResponseCache
+    from backend.services.llm_providers import StubProvider
+
+    client = LLMClient(provider=StubProvider(latency=0.05))
+    client.cache = ResponseCache(max_entries=0)
+    client.bridge = LoopBridge(max_concurrency=2)
+    completions = client.provider.completions
+    create = completions.create
+    seen = {"active": 0, "peak": 0, "threads": set()}
+
+    async def tracked(**kwargs):
+        seen["threads"].add(threading.current_thread().name)
+        seen["active"] += 1
+        seen["peak"] = max(seen["peak"], seen["active"])
+        try:
+            return await create(**kwargs)
+        finally:
+            seen["active"] -= 1
+
+    completions.create = tracked
+    try:
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            replies = list(pool.map(lambda i: client.sync_generate_chat([], f"память {i}"), range(6)))
+
+        # Из потока с уже запущенным циклом синхронный вызов тоже работает
+        async def inside_loop():
+            return client.sync_generate_chat([], "память внутри цикла")
+
+        replies.append(asyncio.run(inside_loop()))
+    finally:
+        client.close()
+
+    assert all(r and r.startswith("Тестовая реплика") for r in replies)
+    assert completions.calls == 7
+    assert seen["peak"] <= 2 and seen["threads"] == {"llm-bridge"}
+    assert client.bridge.stats()["calls"] == 7 and not client.bridge.running
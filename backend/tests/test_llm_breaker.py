@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+
+
+def test_breaker_opens_probes_and_closes() -> None:
+    from backend.services.llm_breaker import CircuitBreaker
+
+    now = [0.0]
+    breaker = CircuitBreaker(
+        window=10, min_calls=4, failure_rate=0.5, slow_seconds=2.0,
+        cooldown_seconds=30.0, probe_seconds=5.0, clock=lambda: now[0],
+    )
+    breaker.record_success(0.1)
+    breaker.record_success(3.0)  # слишком медленно — считается неудачей
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    now[0] += 30
+    assert breaker.state == "half_open"
+    assert breaker.allow() and not breaker.allow()  # одна проба за probe_seconds
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] += 30
+    assert breaker.allow()
+    breaker.record_success(0.1)
+    assert breaker.state == "closed" and breaker.stats()["opened"] == 2
+
+
+def test_open_breaker_skips_provider_and_returns_fallback() -> None:
+    from backend.services.llm import LLMClient
+    from backend.services.llm_breaker import CircuitBreaker
+    from backend.services.llm_cache import ResponseCache
+
+    class _Down:
+        calls = 0
+
+        async def create(self, model: str, messages: list, **kwargs):
+            self.calls += 1
+            raise ConnectionError("provider is down")
+
+    completions = _Down()
+    client = LLMClient()
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    client.model = "stub"
+    client.enabled = True
+    client.cache = ResponseCache(max_entries=0)
+    client.batcher.window_seconds = 0
+    client.breaker = CircuitBreaker(window=10, min_calls=3, failure_rate=0.5, cooldown_seconds=60)
+
+    async def scenario():
+        return [
+            await client.generate_action("Агент", 0.5, 50, None, [])
+            for _ in range(10)
+        ]
+
+    assert asyncio.run(scenario()) == [None] * 10
+    assert completions.calls == 3
+    assert client.breaker.stats()["rejected"] == 7
+    assert not client.is_idle()
@@ -0,0 +1,89 @@
+import asyncio
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_bucket_paces_requests_in_arrival_order() -> None:
+    from backend.services.llm_limiter import TokenBucket
+
+    clock = _FakeClock()
+    bucket = TokenBucket(per_minute=60, clock=clock)  # 1 запрос в секунду, запас на минуту
+    bucket.reserve(59)
+    assert bucket.reserve(1) == 0.0
+    assert bucket.reserve(1) == 1.0
+    assert bucket.reserve(1) == 2.0
+
+    clock.now += 2.0
+    bucket.refund(1)  # один запрос отменён
+    assert bucket.reserve(1) == 0.0
+
+    bucket.pause(5)
+    assert bucket.reserve(1) == 6.0
+
+
+def test_limiter_caps_in_flight_and_reports_queue() -> None:
+    from backend.services.llm_limiter import LLMRateLimiter
+
+    limiter = LLMRateLimiter(max_in_flight=2)
+    peak = 0
+    depths = []
+
+    async def call():
+        nonlocal peak
+        async with limiter.slot(100) as lease:
+            peak = max(peak, limiter.in_flight)
+            depths.append(limiter.stats()["queue_depth"])
+            await asyncio.sleep(0.01)
+            lease.used(50)
+
+    async def scenario():
+        await asyncio.gather(*(call() for _ in range(5)))
+
+    asyncio.run(scenario())
+    stats = limiter.stats()
+    assert peak == 2
+    assert max(depths) > 0
+    assert stats["admitted"] == 5 and stats["delayed"] == 3
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+
+
+def test_limiter_is_shared_safely_with_bridge_loop() -> None:
+    import threading
+
+    from backend.services.llm_bridge import LoopBridge
+    from backend.services.llm_limiter import LLMRateLimiter
+
+    limiter = LLMRateLimiter(tokens_per_minute=10 ** 9, max_in_flight=2)
+    bridge = LoopBridge(max_concurrency=4)
+    peak = 0
+    peak_lock = threading.Lock()
+
+    async def call():
+        nonlocal peak
+        async with limiter.slot(10):
+            with peak_lock:
+                peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0)
+
+    async def burst(n: int):
+        await asyncio.gather(*(call() for _ in range(n)))
+
+    # Основной цикл и цикл моста в другом потоке гоняют один ограничитель одновременно
+    threads = [threading.Thread(target=bridge.run, args=(burst(200),)) for _ in range(3)]
+    try:
+        for thread in threads:
+            thread.start()
+        asyncio.run(burst(200))
+        for thread in threads:
+            thread.join(10)
+    finally:
+        bridge.close()
+
+    assert peak <= 2
+    assert limiter.in_flight == 0 and limiter.queued == 0 and limiter.admitted == 800
@@ -0,0 +1,136 @@
+import asyncio
+from types import SimpleNamespace
+
+
+class _UsageCompletions:
+    async def create(self, model: str, messages: list, **kwargs):
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="ответ"))],
+            usage=SimpleNamespace(prompt_tokens=30, completion_tokens=5, total_tokens=35),
+        )
+
+
+def test_client_records_tokens_per_agent_and_method(monkeypatch) -> None:
+    import backend.services.llm as llm_module
+    from backend.services.llm import LLMClient
+    from backend.services.llm_cache import ResponseCache
+    from backend.services.llm_usage import UsageLedger, llm_call_tags
+
+    client = LLMClient()
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=_UsageCompletions()))
+    client.model = "stub"
+    client.enabled = True
+    client.cache = ResponseCache(max_entries=8, ttl_seconds=60)
+    ledger = UsageLedger()
+    monkeypatch.setattr(llm_module, "usage_ledger", ledger)
+
+    async def scenario():
+        with llm_call_tags("a1", "u1"):
+            await client.generate_action("Агент", 0.5, 80, None, [])
+            await client.generate_action("Агент", 0.5, 80, None, [])  # из кэша
+        with llm_call_tags("a2", "u1"):
+            await client.generate_chat([], "память")
+
+    asyncio.run(scenario())
+
+    totals = {(agent, user, method): t for (_, agent, user, method), t in ledger.pending().items()}
+    action = totals[("a1", "u1", "action")]
+    assert (action.calls, action.cached, action.prompt_tokens, action.completion_tokens) == (2, 1, 30, 5)
+    chat = totals[("a2", "u1", "chat")]
+    assert (chat.calls, chat.prompt_tokens) == (1, 30)
+
+
+async def test_ledger_flush_adds_up_and_fetch_merges_pending(_reset_db: None) -> None:
+    from backend.database.postgr.db import async_session
+    from backend.services.llm_usage import UsageLedger, fetch_usage, llm_call_tags
+
+    ledger = UsageLedger()
+    with llm_call_tags("a1", "u1"):
+        ledger.record("message", 0.2, prompt_tokens=100, completion_tokens=20)
+    with llm_call_tags("a2", "u1"):
+        ledger.record("action", 0.1, prompt_tokens=40, completion_tokens=10)
+    with llm_call_tags("a3", "u2"):
+        ledger.record("message", 0.1, prompt_tokens=500, completion_tokens=50)
+
+    async with async_session() as session:
+        assert await ledger.flush(session) == 3
+    assert len(ledger) == 0
+
+    # Второй сброс той же корзины складывается с уже записанным
+    with llm_call_tags("a1", "u1"):
+        ledger.record("message", 0.5, prompt_tokens=100, completion_tokens=30, error=True)
+    async with async_session() as session:
+        assert await ledger.flush(session) == 1
+
+    # Ещё не сброшенные счётчики тоже видны
+    with llm_call_tags("a2", "u1"):
+        ledger.record("action", 0.1, prompt_tokens=40, completion_tokens=10)
+
+    async with async_session() as session:
+        by_agent = await fetch_usage(session, "u1", group_by="agent", ledger=ledger)
+        by_method = await fetch_usage(session, "u1", group_by="method", ledger=ledger)
+
+    assert [row["key"] for row in by_agent] == ["a1", "a2"]
+    a1 = by_agent[0]
+    assert (a1["calls"], a1["errors"], a1["total_tokens"]) == (2, 1, 250)
+    assert a1["latency_ms_max"] == 500.0 and a1["avg_latency_ms"] == 350.0
+    assert by_agent[1]["calls"] == 2 and by_agent[1]["total_tokens"] == 100
+    assert {row["key"]: row["total_tokens"] for row in by_method} == {"message": 250, "action": 100}
+
+
+def test_batch_usage_is_split_between_callers(monkeypatch) -> None:
+    import json
+
+    import backend.services.llm as llm_module
+    from backend.services.llm import LLMClient
+    from backend.services.llm_batch import MessageBatcher
+    from backend.services.llm_cache import ResponseCache
+    from backend.services.llm_usage import UsageLedger, llm_call_tags
+
+    class _BatchCompletions:
+        async def create(self, model: str, messages: list, **kwargs):
+            count = messages[-1]["content"].count("### Диалог")
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(
+                    content=json.dumps(["коротко", "ответ подлиннее"][:count], ensure_ascii=False)
+                ))],
+                usage=SimpleNamespace(prompt_tokens=101, completion_tokens=9, total_tokens=110),
+            )
+
+    # Пакетирование по умолчанию выключено: реплика не ждёт окна сбора
+    assert LLMClient().batcher.enabled is False
+
+    client = LLMClient()
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=_BatchCompletions()))
+    client.model = "stub"
+    client.enabled = True
+    client.cache = ResponseCache(max_entries=0)
+    client.batcher = MessageBatcher(client._request, window_seconds=0.01, max_size=8)
+    ledger = UsageLedger()
+    monkeypatch.setattr(llm_module, "usage_ledger", ledger)
+
+    async def speak(agent_id: str, sender: str):
+        with llm_call_tags(agent_id, "u1"):
+            return await client.generate_message(
+                sender_name=sender, sender_mood=0.5, sender_traits=[], receiver_name="чат",
+                affinity=0.0, recent_memories=[], conversation_history=[],
+            )
+
+    async def scenario():
+        return await asyncio.gather(speak("a1", "Агент"), speak("a2", "Агент " + "с очень длинным именем " * 10))
+
+    assert asyncio.run(scenario()) == ["коротко", "ответ подлиннее"]
+    totals = {agent: t for (_, agent, _, _), t in ledger.pending().items()}
+    # Один запрос на двоих: токены пакета разделены, а не потеряны
+    assert sum(t.prompt_tokens for t in totals.values()) == 101
+    assert sum(t.completion_tokens for t in totals.values()) == 9
+    assert 0 < totals["a1"].prompt_tokens < totals["a2"].prompt_tokens
+    assert totals["a1"].completion_tokens < totals["a2"].completion_tokens
+
+
+async def test_usage_endpoint_rejects_out_of_range_params(client, auth_headers) -> None:
+    r = await client.get("/api/simulation/llm/usage", params={"hours": 24, "limit": 10}, headers=auth_headers)
+    assert r.status_code == 200, r.text
+    for params in ({"limit": 0}, {"limit": -1}, {"limit": 10 ** 6}, {"hours": 0}, {"hours": 10 ** 6}):
+        r = await client.get("/api/simulation/llm/usage", params=params, headers=auth_headers)
+        assert r.status_code == 422, params
@@ -0,0 +1,71 @@
+import uuid
+
+
+def test_pool_invalidates_on_mood_and_chat_drift() -> None:
+    from backend.services.pregen import UtterancePool
+
+    now = [0.0]
+    pool = UtterancePool(per_agent=2, mood_threshold=0.1, context_drift=1, ttl_seconds=60, clock=lambda: now[0])
+    chat, other = uuid.uuid4(), uuid.uuid4()
+
+    pool.put("a", chat, "первая", mood=0.5, chat_version=pool.chat_version(chat))
+    pool.put("a", chat, "вторая", mood=0.5, chat_version=pool.chat_version(chat))
+    assert not pool.wants("a")
+    # Одно новое сообщение в чате — в пределах допуска
+    pool.note_chat_message(chat)
+    assert pool.take("a", mood=0.55, chat_ids=[chat]).text == "первая"
+    # Настроение ушло слишком далеко — реплика выброшена
+    assert pool.take("a", mood=0.9, chat_ids=[chat]) is None
+    assert pool.stats()["invalidated"] == 1 and len(pool) == 0
+
+    pool.put("a", chat, "третья", mood=0.5, chat_version=pool.chat_version(chat))
+    pool.note_chat_message(chat)
+    pool.note_chat_message(chat)
+    assert pool.take("a", mood=0.5, chat_ids=[chat, other]) is None
+
+    pool.put("a", other, "четвёртая", mood=0.5, chat_version=0)
+    now[0] += 61
+    assert pool.take("a", mood=0.5, chat_ids=[other]) is None
+    assert pool.stats()["hits"] == 1
+
+
+async def test_agent_chat_uses_pregenerated_utterance(client, auth_headers, monkeypatch) -> None:
+    from sqlalchemy import select
+
+    from backend.database.postgr.db import async_session
+    from backend.database.postgr.models import Event
+    from backend.services import simulation as simulation_module
+    from backend.services.simulation import SimulationEngine
+
+    for i in range(2):
+        r = await client.post("/api/agents", json={"name": f"Agent {i}", "persona": "Житель"}, headers=auth_headers)
+        assert r.status_code == 201, r.text
+
+    calls = []
+
+    async def fake_generate_message(**kwargs):
+        calls.append(kwargs["sender_name"])
+        return f"Заготовка от {kwargs['sender_name']}"
+
+    monkeypatch.setattr(simulation_module.llm_client, "enabled", True)
+    monkeypatch.setattr(simulation_module.llm_client, "generate_message", fake_generate_message)
+    monkeypatch.setattr(simulation_module.random, "random", lambda: 0.9)
+
+    engine = SimulationEngine(async_session)
+    engine.pregen_enabled = True
+    async with async_session() as session:
+        await engine.world.ensure_loaded(session)
+
+    agent_ids = engine._predict_next_agents(2)
+    assert len(agent_ids) == 2
+    for agent_id in agent_ids:
+        await engine._pregenerate(agent_id)
+    assert len(calls) == 2 and len(engine.world.utterances) == 2
+
+    # Шаг берёт готовые реплики и не обращается к LLM
+    await engine.step(agent_ids)
+    assert len(calls) == 2
+    assert engine.status().pregen_hit_rate == 1.0
+    async with async_session() as session:
+        texts = (await session.execute(select(Event.description).where(Event.type == "chat_group"))).scalars().all()
+    assert len(texts) == 2 and all("Заготовка от" in t for t in texts)
@@ -0,0 +1,85 @@
+import random
+from collections import Counter
+
+
+def _sampler(policy: str, count: int):
+    # Импорт внутри: backend.* читает settings при импорте, env выставляет conftest
+    from backend.services.sampler import AgentSampler
+
+    sampler = AgentSampler(policy, rng=random.Random(42))
+    for i in range(count):
+        sampler.add(f"a{i}", energy=50)
+    return sampler
+
+
+def test_uniform_returns_distinct_agents_and_tracks_removal() -> None:
+    sampler = _sampler("uniform", 10)
+    picked = sampler.sample(5)
+    assert len(picked) == len(set(picked)) == 5
+
+    for i in range(0, 10, 2):
+        sampler.remove(f"a{i}")
+    assert len(sampler) == 5
+    assert set(sampler.sample(10)) == {f"a{i}" for i in range(1, 10, 2)}
+
+
+def test_energy_policy_prefers_energetic_agents() -> None:
+    sampler = _sampler("energy", 3)
+    sampler.update("a0", 1000)
+    sampler.update("a1", 0)
+
+    counts = Counter(sampler.sample(1)[0] for _ in range(2000))
+    assert counts["a0"] > counts["a2"] > counts["a1"]
+    # Выбор без повторов и после временного обнуления веса восстанавливаются
+    assert sorted(sampler.sample(3)) == ["a0", "a1", "a2"]
+
+
+def test_lra_policy_rotates_through_agents() -> None:
+    sampler = _sampler("lra", 4)
+    seen = []
+    for _ in range(4):
+        batch = sampler.sample(1)
+        sampler.mark_acted(batch)
+        seen.extend(batch)
+    assert sorted(seen) == ["a0", "a1", "a2", "a3"]
+
+    sampler.add("new")
+    assert sampler.sample(1) == ["new"]
+
+
+def _fair_share(heavy: int, light: int, budget: int = 8):
+    from backend.services.fairshare import FairShareScheduler
+
+    scheduler = FairShareScheduler("uniform", tenant_budget=budget, rng=random.Random(42))
+    for i in range(heavy):
+        scheduler.add(f"h{i}", energy=50, tenant="heavy")
+    for i in range(light):
+        scheduler.add(f"l{i}", energy=50, tenant="light")
+    return scheduler
+
+
+def test_fair_share_splits_tick_between_tenants() -> None:
+    scheduler = _fair_share(heavy=5000, light=5)
+    counts = Counter()
+    for _ in range(100):
+        counts.update(agent_id[0] for agent_id in scheduler.sample(8))
+    # Поровну, несмотря на разницу в 1000 раз по числу агентов
+    assert counts["h"] == counts["l"] == 400
+
+    scheduler.configure("light", speed=3.0)
+    picked = scheduler.sample(8)
+    # Повышенная скорость даёт большую долю, но не больше числа агентов тенанта
+    assert sum(a.startswith("l") for a in picked) == 5
+
+
+def test_fair_share_per_tenant_pause_and_budget() -> None:
+    scheduler = _fair_share(heavy=50, light=5, budget=2)
+    assert len(scheduler.sample(8)) == 4
+
+    scheduler.configure("heavy", paused=True)
+    assert all(a.startswith("l") for a in scheduler.sample(8))
+    scheduler.configure("heavy", paused=False, speed=2.0)
+    assert sum(a.startswith("h") for a in scheduler.sample(8)) == 4
+
+    scheduler.remove("l0")
+    assert "l0" not in scheduler and len(scheduler) == 54
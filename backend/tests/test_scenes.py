@@ -0,0 +1,167 @@
+import json
+import uuid
+
+
+def test_parse_scene_reply_and_pool_release_order() -> None:
+    from backend.services.scenes import ScenePool, parse_scene_reply
+
+    reply = "```json\n" + json.dumps([
+        {"speaker": "Нео", "text": "Кто-нибудь видел сбой в метро?"},
+        {"speaker": "тринити", "text": "Видела, это не сбой."},
+        {"speaker": "Агент Смит", "text": "Лишний участник"},
+        {"speaker": "Нео", "text": ""},
+        {"speaker": "Морфеус", "text": "Значит, началось."},
+    ], ensure_ascii=False) + "\n```"
+    turns = parse_scene_reply(reply, {"Нео": "a1", "Тринити": "a2", "Морфеус": "a3"})
+    assert [(t.speaker_id, t.text) for t in turns] == [
+        ("a1", "Кто-нибудь видел сбой в метро?"),
+        ("a2", "Видела, это не сбой."),
+        ("a3", "Значит, началось."),
+    ]
+    assert parse_scene_reply("не JSON", {"Нео": "a1"}) is None
+
+    now = [0.0]
+    pool = ScenePool(ttl_seconds=60, clock=lambda: now[0])
+    chat_id = uuid.uuid4()
+    scene = pool.start(chat_id, turns)
+    assert chat_id in pool
+    assert pool.pop(scene).speaker_id == "a1" and scene.meta()["scene_turn"] == 1
+    assert pool.pop(scene, skip=True).speaker_id == "a2"
+    assert pool.pop(scene).speaker_id == "a3"
+    assert chat_id not in pool and len(pool) == 0
+
+    pool.start(chat_id, turns)
+    now[0] += 61
+    assert pool.active() == [] and pool.stats()["expired"] == 1
+
+
+async def test_scene_turns_are_released_over_following_ticks(client, auth_headers, monkeypatch) -> None:
+    from sqlalchemy import select
+
+    from backend.database.postgr.db import async_session
+    from backend.database.postgr.models import Event
+    from backend.services import simulation as simulation_module
+    from backend.services.simulation import SimulationEngine
+
+    for i in range(3):
+        r = await client.post("/api/agents", json={"name": f"Agent {i}", "persona": "Житель"}, headers=auth_headers)
+        assert r.status_code == 201, r.text
+
+    scene_calls = []
+
+    async def fake_generate_scene(topic_hint, speakers, turns, recent_memories, timeout=None):
+        scene_calls.append([s["name"] for s in speakers])
+        return json.dumps(
+            [{"speaker": speakers[i % len(speakers)]["name"], "text": f"Реплика {i + 1}"} for i in range(turns)],
+            ensure_ascii=False,
+        )
+
+    async def fail_generate_message(**kwargs):
+        raise AssertionError("в режиме сцен отдельные реплики не запрашиваются")
+
+    monkeypatch.setattr(simulation_module.llm_client, "enabled", True)
+    monkeypatch.setattr(simulation_module.llm_client, "generate_scene", fake_generate_scene)
+    monkeypatch.setattr(simulation_module.llm_client, "generate_message", fail_generate_message)
+    monkeypatch.setattr(simulation_module.random, "random", lambda: 0.9)
+
+    engine = SimulationEngine(async_session)
+    engine.scenes_enabled = True
+    engine.scene_turns = 4
+    async with async_session() as session:
+        await engine.world.ensure_loaded(session)
+    agent_id = next(iter(engine.world.agents))
+
+    # Первый тик начинает сцену и публикует первую реплику, каждый следующий — ещё по одной.
+    # Пока сцена идёт, агент не пишет в этот чат сам; в четвёртом тике сцена доиграна,
+    # и чат свободен для следующей
+    for _ in range(4):
+        await engine.step([agent_id])
+    assert len(scene_calls) == 2 and scene_calls[0][0] == engine.world.agents[agent_id].name
+    assert engine.status().scenes_active == 1
+
+    async with async_session() as session:
+        events = (
+            await session.execute(select(Event).where(Event.type == "chat_group").order_by(Event.created_at))
+        ).scalars().all()
+    metas = [json.loads(e.metadata_json) for e in events]
+    assert [m["scene_turn"] for m in metas] == [1, 2, 3, 4, 1]
+    assert len({m["scene_id"] for m in metas[:4]}) == 1 and metas[4]["scene_id"] != metas[0]["scene_id"]
+    texts = [e.description.split("«")[-1].rstrip("»") for e in events]
+    assert texts == ["Реплика 1", "Реплика 2", "Реплика 3", "Реплика 4", "Реплика 1"]
+    # Реплики идут от разных участников по сценарию
+    assert len({e.actor_id for e in events[:4]}) == 3
+
+
+async def test_events_mode_releases_scene_turns_on_tick_clock(client, auth_headers, monkeypatch) -> None:
+    from sqlalchemy import select
+
+    from backend.database.postgr.db import async_session
+    from backend.database.postgr.models import Event
+    from backend.services import simulation as simulation_module
+    from backend.services.simulation import SimulationEngine
+
+    for i in range(3):
+        r = await client.post("/api/agents", json={"name": f"Agent {i}", "persona": "Житель"}, headers=auth_headers)
+        assert r.status_code == 201, r.text
+
+    scene_calls = []
+
+    async def fake_generate_scene(topic_hint, speakers, turns, recent_memories, timeout=None):
+        scene_calls.append(topic_hint)
+        return json.dumps(
+            [{"speaker": speakers[i % len(speakers)]["name"], "text": f"Реплика {i + 1}"} for i in range(turns)],
+            ensure_ascii=False,
+        )
+
+    async def fail_generate_message(**kwargs):
+        raise AssertionError("в режиме сцен отдельные реплики не запрашиваются")
+
+    monkeypatch.setattr(simulation_module.llm_client, "enabled", True)
+    monkeypatch.setattr(simulation_module.llm_client, "generate_scene", fake_generate_scene)
+    monkeypatch.setattr(simulation_module.llm_client, "generate_message", fail_generate_message)
+    monkeypatch.setattr(simulation_module.random, "random", lambda: 0.9)
+
+    engine = SimulationEngine(async_session)
+    engine.scheduler = "events"
+    engine.scenes_enabled = True
+    engine.scene_turns = 4
+    async with async_session() as session:
+        await engine.world.ensure_loaded(session)
+    agent_id = next(iter(engine.world.agents))
+
+    async def released() -> list:
+        async with async_session() as session:
+            events = (
+                await session.execute(select(Event).where(Event.type == "chat_group").order_by(Event.created_at))
+            ).scalars().all()
+        return [json.loads(e.metadata_json)["scene_turn"] for e in events]
+
+    # Пачки проснувшихся агентов следуют одна за другой, но сцена от этого не ускоряется
+    for _ in range(3):
+        await engine.step([agent_id])
+    assert len(scene_calls) == 1 and await released() == [1]
+
+    # Следующие реплики выходят по одной за тик мира
+    now = engine.world.wakeups.clock()
+    assert await engine._world_tick_if_due(now) is True
+    assert await engine._world_tick_if_due(now + engine.tick_period / 2) is False
+    assert await released() == [1, 2]
+    assert await engine._world_tick_if_due(now + engine.tick_period) is True
+    assert await released() == [1, 2, 3]
+
+
+def test_stub_provider_answers_scene_prompt() -> None:
+    import asyncio
+
+    from backend.services.llm import LLMClient
+    from backend.services.llm_providers import StubProvider
+    from backend.services.scenes import parse_scene_reply
+
+    client = LLMClient(provider=StubProvider(latency=0))
+    speakers = [
+        {"name": "Нео", "mood": 0.6, "traits": ["любопытный"], "persona": "Хакер"},
+        {"name": "Тринити", "mood": 0.4, "traits": [], "persona": ""},
+    ]
+    reply = asyncio.run(client.generate_scene("Чат: Метро", speakers, turns=3, recent_memories=[]))
+    turns = parse_scene_reply(reply, {"Нео": "a1", "Тринити": "a2"})
+    assert [t.speaker_id for t in turns] == ["a1", "a2", "a1"]
@@ -0,0 +1,152 @@
+import uuid
+
+import httpx
+
+
+async def test_shard_lease_claim_renew_release(_reset_db: None) -> None:
+    from backend.database.postgr.db import async_session
+    from backend.services.sharding import claim_shard, fetch_shards, release_shard, renew_lease
+
+    async with async_session() as session:
+        first = await claim_shard(session, "worker-a", 2, lease_seconds=30)
+        second = await claim_shard(session, "worker-b", 2, lease_seconds=30)
+        # Оба шарда заняты действующей арендой
+        third = await claim_shard(session, "worker-c", 2, lease_seconds=30)
+    assert {first, second} == {0, 1}
+    assert third is None
+
+    async with async_session() as session:
+        assert await renew_lease(session, first, "worker-a", 30, ticks=10, ticks_per_second=2.5, agents=3)
+        # Чужую аренду продлить нельзя
+        assert not await renew_lease(session, first, "worker-b", 30, ticks=0, ticks_per_second=0.0, agents=0)
+        await release_shard(session, first, "worker-a")
+        assert await claim_shard(session, "worker-c", 2, lease_seconds=30) == first
+        shards = await fetch_shards(session, 2)
+    assert [s.owner for s in shards if s.shard_id == first] == ["worker-c"]
+
+
+async def test_sharded_world_loads_only_own_users(client: httpx.AsyncClient, auth_headers: dict[str, str]) -> None:
+    from backend.database.postgr.db import async_session
+    from backend.services.sharding import shard_of
+    from backend.services.world import WorldState
+
+    for i in range(2):
+        r = await client.post("/api/agents", json={"name": f"Agent {i}", "persona": "Житель"}, headers=auth_headers)
+        assert r.status_code == 201, r.text
+    user_id = (await client.get("/api/users/me", headers=auth_headers)).json()["id"]
+
+    # Номер шарда стабилен и одинаков для всех процессов
+    own = shard_of(user_id, 3)
+    assert own == uuid.UUID(user_id).int % 3
+    assert shard_of(None, 3) == 0
+
+    async with async_session() as session:
+        counts = []
+        for index in range(3):
+            state = WorldState(shard=(index, 3))
+            await state.load(session)
+            counts.append((len(state.agents), len(state.chats)))
+    assert counts[own] == (2, 1)
+    assert sum(agents for agents, _ in counts) == 2
+
+
+async def test_world_sync_keeps_unflushed_changes(client: httpx.AsyncClient, auth_headers: dict[str, str]) -> None:
+    from backend.database.postgr.db import async_session
+    from backend.services.world import WorldState
+
+    r = await client.post("/api/agents", json={"name": "Agent 0", "persona": "Житель"}, headers=auth_headers)
+    first_id = r.json()["id"]
+
+    state = WorldState(shard=(0, 1))
+    async with async_session() as session:
+        await state.load(session)
+    state.agents[first_id].mood = 0.99
+    state.mark_agent_dirty(first_id)
+
+    # Второй агент создан через API уже после загрузки мира воркером
+    r = await client.post("/api/agents", json={"name": "Agent 1", "persona": "Житель"}, headers=auth_headers)
+    second_id = r.json()["id"]
+
+    async with async_session() as session:
+        await state.sync(session)
+    assert set(state.agents) == {first_id, second_id}
+    assert second_id in state.sampler
+    assert state.agents[first_id].mood == 0.99
+
+
+async def test_worker_frames_reach_api_websockets(client: httpx.AsyncClient, auth_headers: dict[str, str]) -> None:
+    from backend.database.postgr.db import async_session
+    from backend.services.realtime import EventBroker, broker
+    from backend.services.relay import FrameOutbox, FrameRelay
+    from backend.services.simulation import SimulationEngine
+    from backend.services.world import WorldState
+
+    for i in range(2):
+        r = await client.post("/api/agents", json={"name": f"Agent {i}", "persona": "Житель"}, headers=auth_headers)
+        assert r.status_code == 201, r.text
+
+    class _Socket:
+        def __init__(self) -> None:
+            self.frames = []
+
+        async def accept(self) -> None:
+            pass
+
+        async def send_json(self, payload) -> None:
+            self.frames.append(payload)
+
+    # API-процесс: свой брокер с подключённым клиентом, кадры до запуска не рассылаются
+    api_broker = EventBroker()
+    socket = _Socket()
+    await api_broker.connect(socket)
+    relay = FrameRelay(async_session, api_broker, shards=[0])
+    async with async_session() as session:
+        await relay.skip_backlog(session)
+
+    # Воркер шарда 0: рассылка движка уходит в outbox
+    outbox = FrameOutbox(async_session, shard_id=0)
+    broker.set_publisher(outbox.publish)
+    try:
+        engine = SimulationEngine(async_session, world_state=WorldState(shard=(0, 1)))
+        await engine.step()
+    finally:
+        broker.set_publisher(None)
+    assert await outbox.flush() == 1
+
+    assert await relay.poll() == 1
+    assert [frame["type"] for frame in socket.frames] == ["tick_batch"]
+    assert socket.frames[0]["data"]["events"]
+    # Повторный опрос не рассылает уже отправленное
+    assert await relay.poll() == 0
+
+
+async def test_tenant_control_reaches_worker_world(client: httpx.AsyncClient, auth_headers: dict[str, str]) -> None:
+    from backend.database.postgr.db import async_session
+    from backend.services.simulation import SimulationEngine
+    from backend.services.world import WorldState
+
+    r = await client.post("/api/agents", json={"name": "Воркерный", "persona": "Житель"}, headers=auth_headers)
+    assert r.status_code == 201, r.text
+    user_id = (await client.get("/api/users/me", headers=auth_headers)).json()["id"]
+
+    # Воркер шарда уже загрузил мир, а пауза приходит через API-процесс
+    worker = SimulationEngine(async_session, WorldState(shard=(0, 1)))
+    async with async_session() as session:
+        await worker.world.load(session)
+    assert len(worker._pick_agent_ids(8)) == 1
+
+    r = await client.post("/api/simulation/control", json={"action": "pause", "speed": 3.0}, headers=auth_headers)
+    assert r.status_code == 200, r.text
+    assert r.json()["is_paused"] is True
+
+    async with async_session() as session:
+        await worker.world.sync(session)
+    tenant = worker.world.sampler.tenant(user_id)
+    assert tenant.paused is True and tenant.speed == 3.0
+    assert worker._pick_agent_ids(8) == []
+
+    # Новый воркер (например, после переезда шарда) тоже начинает с сохранённых настроек
+    fresh = WorldState(shard=(0, 1))
+    async with async_session() as session:
+        await fresh.load(session)
+    assert fresh.sampler.tenant(user_id).paused is True
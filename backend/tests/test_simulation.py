@@ -0,0 +1,279 @@
+import httpx
+from sqlalchemy import func, select
+
+
+async def _create_agents(client: httpx.AsyncClient, headers: dict[str, str], count: int) -> list[str]:
+    ids = []
+    for i in range(count):
+        r = await client.post("/api/agents", json={"name": f"Agent {i}", "persona": "Житель города"}, headers=headers)
+        assert r.status_code == 201, r.text
+        ids.append(r.json()["id"])
+    return ids
+
+
+async def test_step_advances_batch_of_agents(client: httpx.AsyncClient, auth_headers: dict[str, str]) -> None:
+    from backend.database.postgr.db import async_session
+    from backend.database.postgr.models import Event
+    from backend.services.simulation import SimulationEngine
+
+    agent_ids = await _create_agents(client, auth_headers, 3)
+
+    engine = SimulationEngine(async_session)
+    engine.agents_per_tick = 3
+    await engine.step()
+
+    async with async_session() as session:
+        result = await session.execute(
+            select(Event.actor_id, func.count()).where(Event.type == "chat_group").group_by(Event.actor_id)
+        )
+        actors = {row[0] for row in result.fetchall()}
+
+    # За один тик каждый из трёх агентов должен написать в общий чат «Кибер город»
+    assert actors == set(agent_ids)
+
+
+async def test_world_changes_are_written_behind(client: httpx.AsyncClient, auth_headers: dict[str, str]) -> None:
+    from backend.database.postgr.db import async_session
+    from backend.database.postgr.models import Agent, Relationship
+    from backend.services.simulation import SimulationEngine
+
+    agent_ids = await _create_agents(client, auth_headers, 2)
+
+    engine = SimulationEngine(async_session)
+    await engine.step()
+
+    # До сброса изменения живут только в памяти
+    async with async_session() as session:
+        tasks = (await session.execute(select(Agent.current_task))).scalars().all()
+        assert tasks == [None, None]
+    assert engine.world.dirty_count > 0
+
+    assert await engine.flush() > 0
+    assert engine.world.dirty_count == 0
+
+    async with async_session() as session:
+        agents = (await session.execute(select(Agent))).scalars().all()
+        assert {a.current_task for a in agents} == {"общается в чате «Кибер город»"}
+        relations = (await session.execute(select(Relationship))).scalars().all()
+        assert {(r.source_agent_id, r.target_agent_id) for r in relations} == {
+            (agent_ids[0], agent_ids[1]),
+            (agent_ids[1], agent_ids[0]),
+        }
+
+
+async def test_relationship_upsert_merges_on_pair(client: httpx.AsyncClient, auth_headers: dict[str, str]) -> None:
+    from backend.database.postgr.db import async_session
+    from backend.database.postgr.models import Relationship
+    from backend.services.relations import fetch_relationships, upsert_relationships
+
+    a1, a2 = await _create_agents(client, auth_headers, 2)
+
+    def row(rel_id: str, affinity: float) -> dict:
+        return {
+            "id": rel_id, "source_agent_id": a1, "target_agent_id": a2,
+            "affinity": affinity, "strength": 0.5, "label": None,
+        }
+
+    async with async_session() as session:
+        await upsert_relationships(session, [row("first", 0.1)])
+        await session.commit()
+        # Другой id, та же пара — должна обновиться существующая строка
+        await upsert_relationships(session, [row("second", 0.7)])
+        await session.commit()
+
+    async with async_session() as session:
+        relations = (await session.execute(select(Relationship))).scalars().all()
+        assert [(r.id, r.affinity) for r in relations] == [("first", 0.7)]
+        found = await fetch_relationships(session, [(a1, a2), (a2, a1)])
+        assert list(found) == [(a1, a2)]
+
+
+async def test_legacy_relationships_table_gets_pair_index() -> None:
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    from backend.services.relations import upsert_relationships
+    from backend.services.seed import ensure_relationship_pair_index
+
+    # Таблица в том виде, в каком её создавали до появления уникальности пары
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            "CREATE TABLE relationships (id VARCHAR(64) PRIMARY KEY, source_agent_id VARCHAR(64), "
+            "target_agent_id VARCHAR(64), affinity FLOAT, label VARCHAR(64), strength FLOAT, "
+            "updated_at DATETIME)"
+        ))
+        await conn.execute(text(
+            "INSERT INTO relationships VALUES "
+            "('old', 'a', 'b', 0.1, NULL, 0.5, '2024-01-01 00:00:00'), "
+            "('new', 'a', 'b', 0.4, NULL, 0.5, '2024-06-01 00:00:00'), "
+            "('other', 'b', 'a', 0.2, NULL, 0.5, NULL)"
+        ))
+        assert await ensure_relationship_pair_index(conn) is True
+        assert await ensure_relationship_pair_index(conn) is False
+
+    async with AsyncSession(engine) as session:
+        await upsert_relationships(session, [{
+            "id": "x", "source_agent_id": "a", "target_agent_id": "b",
+            "affinity": 0.9, "strength": 0.5, "label": None,
+        }])
+        await session.commit()
+        rows = (await session.execute(text("SELECT id, affinity FROM relationships ORDER BY id"))).all()
+    await engine.dispose()
+    assert [tuple(r) for r in rows] == [("new", 0.9), ("other", 0.2)]
+
+
+async def test_tick_updates_are_sent_as_one_batch(
+        client: httpx.AsyncClient, auth_headers: dict[str, str], monkeypatch
+) -> None:
+    from backend.database.postgr.db import async_session
+    from backend.services.realtime import broker
+    from backend.services.simulation import SimulationEngine
+
+    agent_ids = await _create_agents(client, auth_headers, 3)
+
+    sent = []
+
+    async def _capture(payload: dict) -> None:
+        sent.append(payload)
+
+    monkeypatch.setattr(broker, "broadcast", _capture)
+
+    engine = SimulationEngine(async_session)
+    engine.agents_per_tick = 3
+    await engine.step()
+
+    assert [p["type"] for p in sent] == ["tick_batch"]
+    data = sent[0]["data"]
+    assert len(data["events"]) == 3
+    # Каждый агент и обновлял себя, и был слушателем — но в пакете он встречается один раз
+    assert sorted(u["id"] for u in data["agent_updates"]) == sorted(agent_ids)
+    assert len(data["relations"]) == 6
+
+
+async def test_headless_runner_seeds_city_and_reports_stats(client: httpx.AsyncClient) -> None:
+    import random
+
+    from backend.database.postgr.db import async_session
+    from backend.database.postgr.models import Agent, Event
+    from backend.simulate import run_headless, seed_city
+
+    rng = random.Random(7)
+    assert await seed_city(async_session, agents=6, chats=2, rng=rng) == 6
+    # Повторный вызов не создаёт второй город
+    assert await seed_city(async_session, agents=6, chats=2, rng=rng) == 6
+
+    stats = await run_headless(async_session, ticks=3, rng=rng, flush_every=1)
+    assert stats.ticks == 3
+    assert len(stats.step_latencies) == 3
+    assert stats.percentile(50) <= stats.percentile(99)
+
+    async with async_session() as session:
+        assert (await session.execute(select(func.count()).select_from(Agent))).scalar_one() == 6
+        assert (await session.execute(select(func.count()).select_from(Event))).scalar_one() > 0
+
+
+async def test_control_pauses_only_current_user(client: httpx.AsyncClient, auth_headers: dict[str, str]) -> None:
+    from backend.database.postgr.db import async_session
+    from backend.services.simulation import SimulationEngine
+    from backend.routers import simulation as simulation_router
+
+    await _create_agents(client, auth_headers, 2)
+    engine = SimulationEngine(async_session)
+    async with async_session() as session:
+        await engine.world.load(session)
+    simulation_router.set_sim_engine(engine)
+    try:
+        r = await client.post("/api/simulation/control", json={"action": "pause", "speed": 2.0}, headers=auth_headers)
+        assert r.status_code == 200, r.text
+        assert r.json()["is_paused"] is True and r.json()["speed"] == 2.0
+        # Общий цикл не остановлен, но агенты пользователя в тик не попадают
+        assert engine._pick_agent_ids(8) == []
+
+        await client.post("/api/simulation/control", json={"action": "resume"}, headers=auth_headers)
+        assert len(engine._pick_agent_ids(8)) == 2
+    finally:
+        from backend.main import sim_engine
+        simulation_router.set_sim_engine(sim_engine)
+
+
+async def test_step_holds_no_session_while_waiting_for_llm(
+        client: httpx.AsyncClient, auth_headers: dict[str, str], monkeypatch
+) -> None:
+    import asyncio
+    import contextlib
+
+    from backend.database.postgr.db import async_session
+    from backend.database.postgr.models import Event, Plan
+    from backend.services import simulation as simulation_module
+    from backend.services.simulation import SimulationEngine
+
+    await _create_agents(client, auth_headers, 2)
+    open_sessions = [0]
+    seen_during_llm = []
+
+    @contextlib.asynccontextmanager
+    async def counting_session():
+        open_sessions[0] += 1
+        try:
+            async with async_session() as session:
+                yield session
+        finally:
+            open_sessions[0] -= 1
+
+    async def fake_generate_message(**kwargs):
+        seen_during_llm.append(open_sessions[0])
+        return "Привет всем"
+
+    monkeypatch.setattr(simulation_module.llm_client, "enabled", True)
+    monkeypatch.setattr(simulation_module.llm_client, "generate_message", fake_generate_message)
+    # Шаг всегда создаёт план: он должен попасть в ту же транзакцию, что и событие
+    monkeypatch.setattr(simulation_module.random, "random", lambda: 0.0)
+
+    engine = SimulationEngine(counting_session)
+    engine.agents_per_tick = 2
+    # По одному агенту за раз, чтобы считать только сессии шага, который ждёт LLM
+    engine._step_semaphore = asyncio.Semaphore(1)
+    await engine.step()
+
+    assert seen_during_llm and set(seen_during_llm) == {0}
+    async with async_session() as session:
+        events = (await session.execute(select(Event))).scalars().all()
+        plans = (await session.execute(select(Plan))).scalars().all()
+    assert {e.description.split(": «")[-1] for e in events} == {"Привет всем»"}
+    assert len(plans) == 2
+
+
+async def test_streamed_message_sends_deltas_before_event(
+        client: httpx.AsyncClient, auth_headers: dict[str, str], monkeypatch
+) -> None:
+    from backend.database.postgr.db import async_session
+    from backend.services import simulation as simulation_module
+    from backend.services.realtime import broker
+    from backend.services.simulation import SimulationEngine
+
+    await _create_agents(client, auth_headers, 2)
+    sent = []
+
+    async def _capture(payload: dict) -> None:
+        sent.append(payload)
+
+    async def fake_generate_message(on_delta=None, **kwargs):
+        for part in ("Всем ", "привет"):
+            await on_delta(part)
+        return "Всем привет"
+
+    monkeypatch.setattr(broker, "broadcast", _capture)
+    monkeypatch.setattr(simulation_module.llm_client, "enabled", True)
+    monkeypatch.setattr(simulation_module.llm_client, "generate_message", fake_generate_message)
+
+    engine = SimulationEngine(async_session)
+    engine.stream_messages = True
+    await engine.step([(await client.get("/api/agents", headers=auth_headers)).json()[0]["id"]])
+
+    deltas = [p["data"] for p in sent if p["type"] == "message_delta"]
+    assert [d["delta"] for d in deltas] == ["Всем ", "привет"] and [d["seq"] for d in deltas] == [0, 1]
+    # Итоговое событие приходит последним, в пакете тика, с тем же id
+    assert sent[-1]["type"] == "tick_batch"
+    (event,) = sent[-1]["data"]["events"]
+    assert event["id"] == deltas[0]["id"] and "Всем привет" in event["description"]
@@ -0,0 +1,34 @@
+def _clock(policy: str, max_catch_up: int = 5):
+    from backend.services.ticker import TickClock
+
+    now = [100.0]
+    clock = TickClock(policy, max_catch_up, clock=lambda: now[0])
+    return clock, now
+
+
+def test_tick_clock_compensates_drift() -> None:
+    clock, now = _clock("skip")
+    # Шаг занял 0.3 с из секунды — ждём только оставшиеся 0.7 с
+    now[0] += 0.3
+    assert abs(clock.tick_finished(1.0) - 0.7) < 1e-9
+    now[0] += 0.7
+    clock.tick_started()
+    assert clock.lag_seconds == 0.0 and clock.overruns == 0
+
+
+def test_tick_clock_skip_policy_drops_missed_deadlines() -> None:
+    clock, now = _clock("skip")
+    now[0] += 3.5
+    # Дедлайны 101, 102, 103 пропущены, следующий тик в 104
+    assert abs(clock.tick_finished(1.0) - 0.5) < 1e-9
+    assert clock.overruns == 1 and clock.skipped == 3
+
+
+def test_tick_clock_catch_up_policy_is_bounded() -> None:
+    clock, now = _clock("catch_up", max_catch_up=2)
+    now[0] += 5.5
+    assert clock.tick_finished(1.0) == 0.0
+    assert clock.skipped == 2
+    clock.tick_started()
+    # Догоняем не больше двух тиков: отставание урезано до 2.5 с
+    assert abs(clock.lag_seconds - 2.5) < 1e-9
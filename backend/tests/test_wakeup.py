@@ -0,0 +1,133 @@
+import random
+
+import httpx
+
+
+def _scheduler():
+    from backend.services.wakeup import WakeScheduler
+
+    now = [0.0]
+    wakeups = WakeScheduler(base_seconds=10.0, clock=lambda: now[0], rng=random.Random(1))
+    return wakeups, now
+
+
+def test_wake_interval_depends_on_energy_mood_and_activity() -> None:
+    from backend.services.wakeup import wake_interval
+
+    rng = random.Random(0)
+    calm = [wake_interval(50, 0.5, 0.0, 10.0, rng) for _ in range(200)]
+    tired = [wake_interval(0, 0.5, 0.0, 10.0, rng) for _ in range(200)]
+    busy = [wake_interval(50, 0.5, 3.0, 10.0, rng) for _ in range(200)]
+    assert sum(busy) < sum(calm) < sum(tired)
+
+
+def test_wake_scheduler_pops_in_time_order_and_wakes_on_message() -> None:
+    wakeups, now = _scheduler()
+    for agent_id in ("a", "b", "c"):
+        wakeups.add(agent_id)
+    wakeups.schedule("a", 5.0)
+    wakeups.schedule("b", 3.0)
+    wakeups.schedule("c", 8.0)
+
+    assert wakeups.pop_due(now[0]) is None
+    assert wakeups.next_wake_at() == 3.0
+
+    # Сообщение для "c" будит его немедленно, устаревшая запись в куче пропускается
+    now[0] = 1.0
+    wakeups.wake_now(["c"])
+    assert wakeups.pop_due(now[0]) == ("c", 1.0)
+    now[0] = 6.0
+    assert [wakeups.pop_due(now[0])[0] for _ in range(2)] == ["b", "a"]
+    assert wakeups.pop_due(now[0]) is None
+
+    # После шага более раннее пробуждение не откладывается
+    wakeups.wake_now(["a"])
+    wakeups.reschedule("a", 30.0)
+    assert wakeups.wake_at_of("a") == 6.0
+
+
+async def test_group_message_wakes_members(client: httpx.AsyncClient, auth_headers: dict[str, str]) -> None:
+    from backend.services.world import world
+
+    agent_ids = []
+    for i in range(2):
+        r = await client.post("/api/agents", json={"name": f"Agent {i}", "persona": "Житель"}, headers=auth_headers)
+        agent_ids.append(r.json()["id"])
+    r = await client.get("/api/group-chats", headers=auth_headers)
+    chat_id = r.json()[0]["id"]
+
+    r = await client.post(f"/api/group-chats/{chat_id}/message", json={"message": "Всем привет"}, headers=auth_headers)
+    assert r.status_code == 200, r.text
+    now = world.wakeups.clock()
+    assert all(world.wakeups.wake_at_of(agent_id) <= now for agent_id in agent_ids)
+
+
+async def test_engine_takes_due_agents_and_reschedules(
+        client: httpx.AsyncClient, auth_headers: dict[str, str]
+) -> None:
+    from backend.database.postgr.db import async_session
+    from backend.services.simulation import SimulationEngine
+
+    for i in range(3):
+        await client.post("/api/agents", json={"name": f"Agent {i}", "persona": "Житель"}, headers=auth_headers)
+    engine = SimulationEngine(async_session)
+    async with async_session() as session:
+        await engine.world.load(session)
+    wakeups = engine.world.wakeups
+    now = wakeups.clock()
+    wakeups.wake_now(list(engine.world.agents))
+
+    due = engine._take_due_agents(now + 0.001)
+    assert sorted(due) == sorted(engine.world.agents)
+    await engine.step(due)
+    for agent_id in due:
+        engine._reschedule(agent_id)
+    assert all(wakeups.wake_at_of(agent_id) > now for agent_id in due)
+    # Больше никто не проснулся: цикл будет спать до ближайшего пробуждения
+    assert engine._take_due_agents(now + 0.001) == []
+
+
+async def test_events_mode_recovers_energy_on_tick_clock(
+        client: httpx.AsyncClient, auth_headers: dict[str, str]
+) -> None:
+    from backend.database.postgr.db import async_session
+    from backend.services.simulation import SimulationEngine
+
+    for i in range(2):
+        await client.post("/api/agents", json={"name": f"Agent {i}", "persona": "Житель"}, headers=auth_headers)
+    engine = SimulationEngine(async_session)
+    engine.scheduler = "events"
+    engine.energy_recovery = 5
+    async with async_session() as session:
+        await engine.world.load(session)
+    active, resting = list(engine.world.agents)
+    recover = engine.world.recover_energy
+    calls = []
+    engine.world.recover_energy = lambda amount: calls.append(amount) or recover(amount)
+
+    # Пачки проснувшихся агентов идут часто, но отдыху до них дела нет
+    for _ in range(3):
+        await engine.step([active])
+    assert calls == []
+
+    engine.world.agents[resting].energy = 50
+    now = engine.world.wakeups.clock()
+    assert await engine._world_tick_if_due(now) is True
+    assert await engine._world_tick_if_due(now + engine.tick_period / 2) is False
+    assert await engine._world_tick_if_due(now + engine.tick_period) is True
+    assert calls == [5, 5] and engine.world.agents[resting].energy == 60
+
+
+def test_upcoming_skips_stale_entries() -> None:
+    from backend.services.wakeup import WakeScheduler
+
+    now = [0.0]
+    wakeups = WakeScheduler(base_seconds=10, clock=lambda: now[0])
+    for agent_id in ("a", "b", "c"):
+        wakeups.add(agent_id)
+    wakeups.schedule("a", 5.0)
+    wakeups.schedule("b", 1.0)
+    wakeups.schedule("c", 3.0)
+    wakeups.schedule("b", 9.0)  # старая запись b=1.0 устарела
+
+    assert wakeups.upcoming(2) == ["c", "a"]
@@ -0,0 +1,228 @@
+# ---------------------------------------------------------
+# Шардированные воркеры симуляции
+# Координатор: python -m backend.worker --shards 4
+# Один воркер (например, на отдельной машине): python -m backend.worker --run-one --shards 4
+# Отчёт по шардам: python -m backend.worker --report
+# ---------------------------------------------------------
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from typing import List, Optional
+
+logger = logging.getLogger("backend.worker")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m backend.worker",
+        description="Запустить симуляцию в M процессах, каждый из которых владеет своим шардом пользователей.",
+    )
+    parser.add_argument("--shards", type=int, default=None, help="Число шардов (по умолчанию SIMULATION_SHARDS)")
+    parser.add_argument("--run-one", action="store_true", help="Запустить один воркер без координатора")
+    parser.add_argument("--report", action="store_true", help="Вывести состояние шардов и выйти")
+    parser.add_argument("--report-seconds", type=float, default=10.0, help="Период отчёта координатора")
+    return parser.parse_args(argv)
+
+
+class ShardWorker:
+    """
+    Воркер: арендует шард, крутит SimulationEngine по состоянию мира этого шарда,
+    продлевает аренду и периодически подтягивает изменения, сделанные через API.
+    """
+
+    def __init__(self, session_factory, shard_count: int, owner: Optional[str] = None) -> None:
+        from backend.project_config import settings
+
+        self.session_factory = session_factory
+        self.shard_count = max(1, shard_count)
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = settings.SIMULATION_LEASE_SECONDS
+        self.sync_seconds = max(0.5, settings.SIMULATION_SYNC_SECONDS)
+        self.shard_id: Optional[int] = None
+        self._stop = asyncio.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    async def _sleep(self, seconds: float) -> bool:
+        """Пауза, прерываемая остановкой. Возвращает True, если воркер останавливается."""
+        try:
+            await asyncio.wait_for(self._stop.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def run(self) -> None:
+        from backend.services.sharding import claim_shard
+
+        while not self._stop.is_set():
+            async with self.session_factory() as session:
+                self.shard_id = await claim_shard(
+                    session, self.owner, self.shard_count, self.lease_seconds, preferred=self.shard_id
+                )
+            if self.shard_id is None:
+                # Все шарды заняты: ждём, пока чья-нибудь аренда истечёт
+                if await self._sleep(self.lease_seconds / 2):
+                    return
+                continue
+            await self._run_shard(self.shard_id)
+
+    async def _run_shard(self, shard_id: int) -> None:
+        from backend.project_config import settings
+        from backend.services.realtime import broker
+        from backend.services.relay import FrameOutbox
+        from backend.services.sharding import release_shard, renew_lease
+        from backend.services.simulation import SimulationEngine
+        from backend.services.world import WorldState
+
+        # WebSocket-клиенты подключены к API: кадры движка уходят туда через realtime_frames
+        outbox = FrameOutbox(
+            self.session_factory,
+            shard_id,
+            flush_seconds=settings.SIMULATION_RELAY_POLL_SECONDS,
+            retention_seconds=settings.SIMULATION_RELAY_RETENTION_SECONDS,
+        )
+        broker.set_publisher(outbox.publish)
+        outbox.start()
+
+        world_state = WorldState(shard=(shard_id, self.shard_count))
+        engine = SimulationEngine(self.session_factory, world_state=world_state)
+        await engine.start()
+        lost = False
+        try:
+            last_ticks, last_time = 0, time.monotonic()
+            while not await self._sleep(self.sync_seconds):
+                now = time.monotonic()
+                tps = (engine.ticks - last_ticks) / (now - last_time) if now > last_time else 0.0
+                last_ticks, last_time = engine.ticks, now
+
+                async with self.session_factory() as session:
+                    renewed = await renew_lease(
+                        session, shard_id, self.owner, self.lease_seconds,
+                        ticks=engine.ticks, ticks_per_second=tps, agents=len(world_state.agents),
+                    )
+                if not renewed:
+                    logger.warning("Воркер %s потерял аренду шарда %d", self.owner, shard_id)
+                    lost = True
+                    return
+
+                await engine.flush()
+                async with self.session_factory() as session:
+                    await world_state.sync(session)
+        finally:
+            await engine.stop()
+            await outbox.stop()
+            broker.set_publisher(None)
+            if not lost:
+                async with self.session_factory() as session:
+                    await release_shard(session, shard_id, self.owner)
+                logger.info("Воркер %s освободил шард %d", self.owner, shard_id)
+
+
+def _install_stop_handlers(stop) -> None:
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остаётся KeyboardInterrupt
+            pass
+
+
+async def run_worker(shard_count: int) -> None:
+    from backend.database.postgr.db import async_session
+
+    worker = ShardWorker(async_session, shard_count)
+    _install_stop_handlers(worker.stop)
+    logger.info("Воркер %s запущен, шардов=%d", worker.owner, worker.shard_count)
+    await worker.run()
+
+
+async def report(shard_count: Optional[int] = None) -> str:
+    from backend.database.postgr.db import async_session
+    from backend.services.sharding import fetch_shards, lease_alive
+
+    async with async_session() as session:
+        shards = await fetch_shards(session, shard_count)
+    lines = []
+    total = 0.0
+    for shard in shards:
+        alive = lease_alive(shard)
+        if alive:
+            total += shard.ticks_per_second or 0.0
+        lines.append(
+            f"shard={shard.shard_id} owner={shard.owner or '-'} alive={alive} "
+            f"agents={shard.agents} ticks={shard.ticks} ticks/s={shard.ticks_per_second or 0.0:.2f}"
+        )
+    lines.append(f"total ticks/s={total:.2f}")
+    return "\n".join(lines)
+
+
+def _spawn_worker(shard_count: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "backend.worker", "--run-one", "--shards", str(shard_count)]
+    )
+
+
+async def coordinate(shard_count: int, report_seconds: float) -> None:
+    """
+    Координатор: поднимает по процессу на шард, перезапускает упавшие
+    и периодически выводит скорость тиков по шардам.
+    """
+    from backend.services.seed import init_schema
+
+    await init_schema()
+    stop = asyncio.Event()
+    _install_stop_handlers(stop.set)
+
+    processes = [_spawn_worker(shard_count) for _ in range(shard_count)]
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=report_seconds)
+            except asyncio.TimeoutError:
+                pass
+            for i, proc in enumerate(processes):
+                if proc.poll() is not None and not stop.is_set():
+                    logger.warning("Воркер pid=%d завершился с кодом %s, перезапускаем", proc.pid, proc.returncode)
+                    processes[i] = _spawn_worker(shard_count)
+            logger.info("Шарды симуляции:\n%s", await report(shard_count))
+    finally:
+        for proc in processes:
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in processes:
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    from backend.project_config import settings
+
+    shard_count = max(1, args.shards or settings.SIMULATION_SHARDS)
+    if args.report:
+        print(asyncio.run(report(shard_count)))
+    elif args.run_one:
+        asyncio.run(run_worker(shard_count))
+    else:
+        asyncio.run(coordinate(shard_count, args.report_seconds))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,6 +11,7 @@ export default function EventStream() {
     const error = useEventStore((state) => state.error)
     const fetchEvents = useEventStore((state) => state.fetchEvents)
     const addEvent = useEventStore((state) => state.addEvent)
+    const appendDelta = useEventStore((state) => state.appendDelta)
 
     const updateAgentFromEvent = useAgentStore((state) => state.updateAgentFromEvent)
     const setRelations = useAgentStore((state) => state.setRelations)
@@ -29,6 +30,9 @@ export default function EventStream() {
             if (payload.type === 'event_created') {
                 addEvent(payload.data)
             }
+            if (payload.type === 'message_delta') {
+                appendDelta(payload.data)
+            }
             if (payload.type === 'agent_update') {
                 updateAgentFromEvent(payload.data)
             }
@@ -39,7 +43,7 @@ export default function EventStream() {
         return () => {
             connection.close()
         }
-    }, [addEvent, setRelations, updateAgentFromEvent, wsKey])
+    }, [addEvent, appendDelta, setRelations, updateAgentFromEvent, wsKey])
 
     useEffect(() => {
         const handler = () => setWsKey((k) => k + 1)
@@ -11,6 +11,20 @@ const wsBase =
             ? `ws://${window.location.host}`
             : 'ws://localhost:8000')
 
+/**
+ * Разворачивает пакет обновлений за тик симуляции (tick_batch) в отдельные сообщения
+ * прежнего формата, чтобы подписчики обрабатывали их как раньше.
+ */
+function unpackTickBatch(data = {}) {
+    return [
+        ...(data.events || []).map((item) => ({type: 'event_created', data: item})),
+        ...(data.agent_updates || []).map((item) => ({type: 'agent_update', data: item})),
+        ...(data.relations || []).map((item) => ({type: 'relation_changed', data: item})),
+        ...(data.memories || []).map((item) => ({type: 'memory_created', data: item})),
+        ...(data.messages || []),
+    ]
+}
+
 /**
  * Подключение к стриму событий симуляции по WebSocket.
  *
@@ -32,7 +46,11 @@ export function connectEventStream(onMessage, opts = {}) {
         socket.onmessage = (event) => {
             try {
                 const payload = JSON.parse(event.data)
-                onMessage?.(payload)
+                if (payload.type === 'tick_batch') {
+                    unpackTickBatch(payload.data).forEach((message) => onMessage?.(message))
+                } else {
+                    onMessage?.(payload)
+                }
             } catch (e) {
                 console.warn('WS parse error', e)
                 useErrorStore.getState().pushError({source: 'ws:onmessage', message: e.message})
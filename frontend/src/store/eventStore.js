@@ -13,6 +13,7 @@ const fallbackEvents = []
  * Умеет:
  * - подгружать последние события с API,
  * - аккуратно добавлять новые события в конец (realtime-стрим),
+ * - собирать реплику из фрагментов message_delta и заменять её итоговым событием с тем же id,
  * - ограничивать размер ленты до MAX_EVENTS.
  */
 const useEventStore = create((set) => ({
@@ -33,9 +34,37 @@ const useEventStore = create((set) => ({
     },
     addEvent: (event) =>
         set((state) => {
+            // Итоговое событие заменяет реплику, собранную из потоковых фрагментов
+            const index = event?.id ? state.events.findIndex((item) => item.id === event.id) : -1
+            if (index !== -1) {
+                const next = [...state.events]
+                next[index] = event
+                return {events: next}
+            }
             const next = [...state.events, event].slice(-MAX_EVENTS)
             return {events: next}
         }),
+    appendDelta: (delta) =>
+        set((state) => {
+            if (!delta?.id) return state
+            const index = state.events.findIndex((item) => item.id === delta.id)
+            if (index === -1) {
+                const draft = {
+                    id: delta.id,
+                    actor_id: delta.actor_id,
+                    description: delta.delta,
+                    timestamp: new Date().toISOString(),
+                    streaming: true,
+                }
+                return {events: [...state.events, draft].slice(-MAX_EVENTS)}
+            }
+            const current = state.events[index]
+            // Событие уже пришло целиком — запоздавшие фрагменты не нужны
+            if (!current.streaming) return state
+            const next = [...state.events]
+            next[index] = {...current, description: (current.description || '') + delta.delta}
+            return {events: next}
+        }),
 }))
 
 export default useEventStore